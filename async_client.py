@@ -0,0 +1,263 @@
+"""
+Async client for claude cli
+
+AsyncClaudeCLI has the same surface as ClaudeCLI (send_message, complete,
+conversation history, save/load) for code running on an asyncio event
+loop. Requests go through one pooled aiohttp.ClientSession and streams
+are read with native async iteration, so many conversations can share a single
+event loop without a thread per request. Saving, loading and summarizing
+run on worker threads, so they do not hold up the loop either.
+"""
+
+import asyncio
+import json
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+import aiohttp
+
+import config
+import stats
+from cli import MessageAssembler, SSEDecoder, StreamError
+from client import BaseClient
+from history import encode_payload
+from ratelimit import parse_retry_after
+
+if TYPE_CHECKING:
+    from sessions import Session
+
+T = TypeVar("T")
+
+
+class AsyncClaudeCLI(BaseClient):
+    def __init__(self, api_key: Optional[str] = None,
+                 pool_size: int = config.ASYNC_POOL_MAXSIZE,
+                 keep_alive: bool = config.KEEP_ALIVE, **kwargs: Any) -> None:
+        """
+        asyncio counterpart of ClaudeCLI; takes the same arguments.
+        send_message, complete, create_message, prewarm, close and the methods
+        that save or load the conversation are coroutines. race, compare,
+        request and batch mode need ClaudeCLI.
+        """
+        super().__init__(api_key, **kwargs)
+        # aiohttp sessions must be created on the event loop that uses them,
+        # so only the settings are kept here; see _client
+        self._pool = (pool_size, keep_alive)
+        self._session: Optional[aiohttp.ClientSession] = None
+        # the loop _fit waits on while a summary is requested
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _client(self) -> aiohttp.ClientSession:
+        """the pooled session shared by every request, created on first use"""
+        if self._session is None:
+            pool_size, keep_alive = self._pool
+            connect_timeout, read_timeout = self.timeout
+            connector = aiohttp.TCPConnector(limit=pool_size, force_close=not keep_alive)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers, connector=connector,
+                timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout))
+        return self._session
+
+    async def prewarm(self) -> None:
+        """open a pooled connection to the API host ahead of the first request"""
+        try:
+            async with self._client().head(self.base_url):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # the real request will report connection problems
+            pass
+
+    async def close(self) -> None:
+        """close pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncClaudeCLI":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def _post_with_retry(self, payload: Dict[str, Any]) -> aiohttp.ClientResponse:
+        """
+        post the payload, backing off and retrying on 429/529/5xx and dropped connections.
+        the returned response is unread; the caller must release it.
+        """
+        body = encode_payload(payload)
+        tokens = len(body) // config.CHARS_PER_TOKEN if self.rate_limiter.tokens else 0
+        attempt = 0
+        while True:
+            wait = self.rate_limiter.reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            try:
+                response = await self._client().post(self.base_url, data=body)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+            stats.set_value("ttfb", time.perf_counter() - start)
+            stats.set_value("retries", attempt)
+
+            self.rate_limiter.update_from_headers(response.headers)
+            if response.ok:
+                return response
+            response.release()
+            if not self.retry_policy.should_retry(attempt, response.status, response.headers):
+                response.raise_for_status()
+
+            delay = self.retry_policy.delay(attempt, parse_retry_after(response.headers))
+            if response.status == 429:
+                # every task sharing this client backs off, not just this one
+                self.rate_limiter.pause(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def create_message(self, payload: Dict[str, Any],
+                             on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        post a request body to the Messages API
+        returns:
+            dict: the raw API message
+        raises:
+            aiohttp.ClientError, StreamError: on http or stream errors
+        """
+        response = await self._post_with_retry(payload)
+        try:
+            if not payload.get("stream"):
+                body = await response.read()
+                stats.set_value("response_bytes", len(body))
+                return json.loads(body)
+
+            decoder = SSEDecoder()
+            assembler = MessageAssembler()
+            received = 0
+            async for line in response.content:
+                received += len(line)
+                event = decoder.feed(line.rstrip(b"\r\n"))
+                if event is None:
+                    continue
+                text = assembler.feed(*event)
+                if text:
+                    stats.mark("ttft")
+                    if on_text:
+                        on_text(text)
+                if assembler.done:
+                    break
+            stats.set_value("response_bytes", received)
+            return assembler.result()
+        finally:
+            response.release()
+
+    async def _send(self, messages: List[Dict[str, Any]], model: str,
+                    max_tokens: int, system_prompt: Optional[str], stream: bool,
+                    on_text: Optional[Callable[[str], None]]) -> Dict[str, Any]:
+        """send messages and wrap the reply or error in a result dict with its request stats"""
+        sample = self.stats.start(model, stream)
+        response: Dict[str, Any] = {"success": False}
+        try:
+            response = await self._exchange(messages, model, max_tokens, system_prompt,
+                                            stream, on_text)
+            return response
+        finally:
+            response["stats"] = self.stats.finish(sample, response)
+
+    async def _exchange(self, messages: List[Dict[str, Any]], model: str,
+                        max_tokens: int, system_prompt: Optional[str], stream: bool,
+                        on_text: Optional[Callable[[str], None]]) -> Dict[str, Any]:
+        """send one request, or answer it from the response cache"""
+        payload = self.build_payload(messages, model, max_tokens, system_prompt, stream,
+                                     splice=True)
+        key, result = self._lookup(payload)
+        cached = result is not None
+        try:
+            if result is None:
+                result = await self.create_message(payload, on_text)
+            elif on_text:
+                on_text(result["content"][0]["text"])
+            return self._success(result, model, key, cached)
+        except (aiohttp.ClientError, asyncio.TimeoutError, StreamError, ValueError, KeyError) as e:
+            return self._failure(e)
+
+    async def send_message(self, message: str,
+                           model: str = config.DEFAULT_MODEL,
+                           max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                           system_prompt: Optional[str] = None, stream: bool = False,
+                           on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """send message to claude, update the conversation and return the response"""
+        messages = self.conversation_history + [{"role": "user", "content": message}]
+        messages = await self._fit(messages, system_prompt)
+        response = await self._send(messages, model, max_tokens, system_prompt, stream, on_text)
+
+        if response["success"]:
+            if self.store is not None or self.chat_session is not None:
+                # appending fsyncs, so keep it off the event loop
+                await self._in_thread(self._record_turn, message, response["message"])
+            else:
+                self._record_turn(message, response["message"])
+        return response
+
+    async def complete(self, message: str,
+                       model: str = config.DEFAULT_MODEL,
+                       max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                       system_prompt: Optional[str] = None, stream: bool = False,
+                       on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """send a one-off message that neither reads nor updates the conversation history"""
+        return await self._send([{"role": "user", "content": message}], model, max_tokens,
+                                system_prompt, stream, on_text)
+
+    async def _in_thread(self, function: Callable[..., T], *args: Any) -> T:
+        """run a blocking call on the loop's default executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _fit(self, messages: Sequence[Dict[str, Any]],
+                   system_prompt: Optional[str]) -> Sequence[Dict[str, Any]]:
+        """
+        fit messages to the context budget. summarizing runs on a worker thread,
+        whose summary request is sent on this loop by _summarize
+        """
+        if self.context.strategy != "summarize":
+            return self.context.fit(messages, system_prompt)
+        self._loop = asyncio.get_running_loop()
+        return await self._in_thread(self.context.fit, messages, system_prompt)
+
+    def _summarize(self, transcript: str) -> Optional[str]:
+        """summary of older turns, requested from the worker thread _fit runs the fitting on"""
+        if self._loop is None:
+            return None
+        response = asyncio.run_coroutine_threadsafe(
+            self.complete(transcript, config.SUMMARY_MODEL, config.SUMMARY_MAX_TOKENS,
+                          config.SUMMARY_SYSTEM), self._loop).result()
+        return response["message"] if response["success"] else None
+
+    async def record_turn(self, message: str, reply: str) -> None:
+        """add a turn answered outside send_message, see ClaudeCLI.record_turn"""
+        await self._in_thread(self._record_turn, message, reply)
+
+    async def save_conversation(self, filename: str) -> bool:
+        """save the history to a json file or a .jsonl store, see ClaudeCLI.save_conversation"""
+        return await self._in_thread(self._save_conversation, filename)
+
+    async def attach_store(self, filename: str) -> bool:
+        """append every completed turn to a .jsonl store, see ClaudeCLI.attach_store"""
+        return await self._in_thread(self._attach_store, filename)
+
+    async def load_conversation(self, filename: str) -> bool:
+        """load the history from a file, see ClaudeCLI.load_conversation"""
+        return await self._in_thread(self._load_conversation, filename)
+
+    async def attach_session(self, session: "Session") -> None:
+        """write every completed turn into a named session as well"""
+        await self._in_thread(self._attach_session, session)
+
+    async def resume_session(self, session: "Session") -> None:
+        """
+        continue a named session
+        raises:
+            ValueError: if the session does not exist
+        """
+        await self._in_thread(self._resume_session, session)
@@ -0,0 +1,169 @@
+"""
+Batch mode for claude cli
+
+runs many independent prompts over a bounded thread pool that shares one
+ClaudeCLI connection pool, and writes one JSONL result record per prompt.
+"""
+
+import inspect
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Set, TextIO
+
+import config
+
+
+def load_prompts(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    read batch prompts from a JSONL file or a directory of prompt files
+    args:
+        path: JSONL file with one {"id", "message"} object per line, or a
+              directory whose files each hold one prompt
+    yields:
+        dict with at least "id" and "message"; JSONL lines may also set
+        "model", "max_tokens" and "system"
+    raises:
+        ValueError: if a JSONL line is malformed
+    """
+    source = Path(path)
+    if source.is_dir():
+        for file_path in sorted(p for p in source.rglob("*") if p.is_file()):
+            message = file_path.read_text(encoding="utf-8").strip()
+            if message:
+                yield {"id": file_path.relative_to(source).as_posix(), "message": message}
+        return
+
+    with open(source, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("expected a JSON object")
+                item.setdefault("message", item.get("prompt"))
+                if not item["message"]:
+                    raise ValueError("missing message")
+            except ValueError as e:
+                raise ValueError(config.ERROR_MESSAGES["invalid_batch_line"].format(line_number, e))
+            item["id"] = str(item.get("id", line_number))
+            yield item
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """ids that already have a successful record in the output file"""
+    done: Set[str] = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # partial line from an interrupted run
+                continue
+            if record.get("success"):
+                done.add(str(record["id"]))
+    return done
+
+
+def _last_byte(path: str) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(-1, 2)
+        return f.read(1)
+
+
+def open_output(output_path: str) -> TextIO:
+    """open a JSONL results file for appending, finishing a line cut short by an interrupted run"""
+    out = open(output_path, "a", encoding="utf-8")
+    if out.tell() and _last_byte(output_path) != b"\n":
+        out.write("\n")
+    return out
+
+
+def run_prompt(claude_cli: Any, item: Dict[str, Any], model: str, max_tokens: int,
+               system_prompt: Optional[str] = None) -> Dict[str, Any]:
+    """send one batch prompt and build its result record"""
+    response = claude_cli.complete(item["message"],
+                                   item.get("model", model),
+                                   item.get("max_tokens", max_tokens),
+                                   item.get("system", system_prompt))
+    record = {"id": item["id"]}
+    record.update(response)
+    return record
+
+
+def require_sync(claude_cli: Any, what: str) -> None:
+    """
+    raises:
+        TypeError: for an AsyncClaudeCLI, whose coroutines the worker threads cannot run
+    """
+    if inspect.iscoroutinefunction(getattr(claude_cli, "complete", None)):
+        raise TypeError(config.ERROR_MESSAGES["async_unsupported"].format(what))
+
+
+def run_batch(claude_cli: Any, prompts: Iterable[Dict[str, Any]], output_path: str,
+              model: str = config.DEFAULT_MODEL,
+              max_tokens: int = config.DEFAULT_MAX_TOKENS,
+              system_prompt: Optional[str] = None,
+              concurrency: int = config.BATCH_CONCURRENCY,
+              ordered: bool = True,
+              on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+              resume: bool = True) -> Dict[str, int]:
+    """
+    fan prompts out over a bounded worker pool and append results to a JSONL file
+    args:
+        claude_cli: shared client; its complete() must be thread safe
+        prompts: items from load_prompts
+        output_path: JSONL results file, appended to so runs can resume
+        concurrency: number of requests in flight at once
+        ordered: write results in input order instead of completion order
+        on_result: called with every record as it is written
+        resume: skip prompts whose id already succeeded in output_path; off when
+                the caller decides what to skip, e.g. by content hash
+    returns:
+        dict: counts of succeeded, failed and skipped prompts
+    raises:
+        TypeError: if claude_cli is an AsyncClaudeCLI
+    """
+    require_sync(claude_cli, "run_batch")
+    done = completed_ids(output_path) if resume else set()
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    # only a small window of prompts is read ahead of the workers
+    window = concurrency * 2
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, open_output(output_path) as out:
+
+        def write(future: "Future[Dict[str, Any]]") -> None:
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["succeeded" if record["success"] else "failed"] += 1
+            if on_result:
+                on_result(record)
+
+        pending: Deque["Future[Dict[str, Any]]"] = deque()
+
+        def drain(limit: int) -> None:
+            while len(pending) > limit:
+                if ordered:
+                    write(pending.popleft())
+                    continue
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pending.remove(future)
+                    write(future)
+
+        for item in prompts:
+            if item["id"] in done:
+                counts["skipped"] += 1
+                continue
+            pending.append(executor.submit(run_prompt, claude_cli, item, model,
+                                           max_tokens, system_prompt))
+            drain(window - 1)
+        drain(0)
+
+    return counts
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for claude cli
+
+runs the client against the local mock server in mock_server.py, so the
+numbers measure the client's own overhead and concurrency, not the API.
+Each scenario reports pytest-benchmark style timings; the JSON report of a
+run can be kept as a baseline and later runs compared with it.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+import cli
+import config
+from batch import run_batch
+from history import encode_payload
+from stats import percentile
+from store import ConversationStore
+
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py")
+
+
+SCENARIOS = ("single", "multi_turn", "batch", "async", "store", "history", "startup")
+# compared by --compare: metric -> whether higher is better
+COMPARED = {"median_ms": False, "milliseconds": False, "requests_per_second": True}
+# a user turn of about 300 tokens, so the history grows like a real session's
+TURN = "Please review the following paragraph and suggest improvements. " * 20
+# conversation sizes, in messages, of the history scenario
+HISTORY_SIZES = (100, 1000, 10000)
+
+
+def measure(run: Callable[[], Any], rounds: int, warmup: int = 1) -> Dict[str, Any]:
+    """
+    time rounds calls of run after warmup untimed ones
+    returns:
+        dict: min, max, mean, median, p95 and standard deviation in ms
+    """
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timing_summary(timings)
+
+
+def timing_summary(timings: List[float]) -> Dict[str, Any]:
+    timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    return {
+        "rounds": len(timings),
+        "min_ms": round(timings[0], 3),
+        "max_ms": round(timings[-1], 3),
+        "mean_ms": round(mean, 3),
+        "median_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "stddev_ms": round(math.sqrt(sum((t - mean) ** 2 for t in timings) / len(timings)), 3),
+    }
+
+
+def _peak_threads(run: Callable[[], None]) -> int:
+    """run a workload while sampling the number of live threads"""
+    peak = threading.active_count()
+    done = threading.Event()
+
+    def sample() -> None:
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, threading.active_count())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        run()
+    finally:
+        done.set()
+        sampler.join()
+    # the sampler itself does not count
+    return peak - 1
+
+
+def bench_threaded(url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    """ClaudeCLI.complete fanned out over a thread pool"""
+    claude_cli = cli.ClaudeCLI("bench", pool_size=concurrency, max_retries=0)
+    claude_cli.base_url = url
+    results: List[Dict[str, Any]] = []
+
+    def run() -> None:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results.extend(executor.map(lambda i: claude_cli.complete(f"prompt {i}"),
+                                        range(requests)))
+
+    start = time.perf_counter()
+    threads = _peak_threads(run)
+    elapsed = time.perf_counter() - start
+    claude_cli.close()
+    return _summary(results, elapsed, threads)
+
+
+def bench_async(url: str, requests: int, concurrency: int) -> Dict[str, Any]:
+    """AsyncClaudeCLI.complete multiplexed on one event loop"""
+    from async_client import AsyncClaudeCLI
+
+    results: List[Dict[str, Any]] = []
+
+    async def main() -> None:
+        async with AsyncClaudeCLI("bench", pool_size=concurrency, max_retries=0) as claude_cli:
+            claude_cli.base_url = url
+            limit = asyncio.Semaphore(concurrency)
+
+            async def one(i: int) -> Dict[str, Any]:
+                async with limit:
+                    return await claude_cli.complete(f"prompt {i}")
+
+            results.extend(await asyncio.gather(*(one(i) for i in range(requests))))
+
+    start = time.perf_counter()
+    threads = _peak_threads(lambda: asyncio.run(main()))
+    elapsed = time.perf_counter() - start
+    return _summary(results, elapsed, threads)
+
+
+def _summary(results: List[Dict[str, Any]], elapsed: float, threads: int) -> Dict[str, Any]:
+    return {
+        "requests": len(results),
+        "failed": sum(not r["success"] for r in results),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(results) / elapsed, 1),
+        "peak_threads": threads,
+    }
+
+
+@contextmanager
+def mock_server_process(*args: str) -> Iterator[str]:
+    """
+    run mock_server.py in its own process so its threads neither count
+    towards nor compete with the client being measured
+    yields:
+        the Messages API url of the server
+    """
+    process = subprocess.Popen([sys.executable, MOCK_SERVER, "--port", "0", *args],
+                               stdout=subprocess.PIPE, text=True)
+    try:
+        # first line: "Mock Messages API listening on <url>"
+        yield process.stdout.readline().split()[-1]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_async_vs_threaded(requests: int, concurrency: int, latency: float) -> Dict[str, Any]:
+    """compare the threaded sync path with the async client at the same concurrency"""
+    with mock_server_process("--latency", str(latency)) as url:
+        return {
+            "threaded": bench_threaded(url, requests, concurrency),
+            "async": bench_async(url, requests, concurrency),
+        }
+
+
+def _client(url: str, **kwargs: Any) -> "cli.ClaudeCLI":
+    claude_cli = cli.ClaudeCLI("bench", **kwargs)
+    claude_cli.base_url = url
+    return claude_cli
+
+
+def bench_single(url: str, rounds: int) -> Dict[str, Any]:
+    """latency of one message, blocking and streamed, on a warm connection"""
+    claude_cli = _client(url)
+    failed = 0
+
+    def send(stream: bool) -> Callable[[], None]:
+        def run() -> None:
+            nonlocal failed
+            failed += not claude_cli.complete("Hello", stream=stream)["success"]
+        return run
+
+    report = {
+        "single.blocking": measure(send(False), rounds),
+        "single.streaming": measure(send(True), rounds),
+    }
+    claude_cli.close()
+    for result in report.values():
+        result["failed"] = failed
+    return report
+
+
+def bench_multi_turn(url: str, turns: int) -> Dict[str, Any]:
+    """per-turn latency of one conversation as its history grows"""
+    claude_cli = _client(url)
+    timings: List[float] = []
+    failed = 0
+    for _ in range(turns):
+        start = time.perf_counter()
+        failed += not claude_cli.send_message(TURN, stream=True)["success"]
+        timings.append((time.perf_counter() - start) * 1000)
+    claude_cli.close()
+    result = timing_summary(timings)
+    # the first and last quarter of the turns show how cost grows with the history
+    quarter = max(1, turns // 4)
+    result["first_turns_ms"] = round(sum(timings[:quarter]) / quarter, 3)
+    result["last_turns_ms"] = round(sum(timings[-quarter:]) / quarter, 3)
+    result["failed"] = failed
+    return {"multi_turn": result}
+
+
+def bench_batch(url: str, requests: int, concurrency: Sequence[int]) -> Dict[str, Any]:
+    """batch mode throughput at each concurrency level"""
+    report = {}
+    prompts = [{"id": f"p{i}", "message": f"prompt {i}"} for i in range(requests)]
+    for workers in concurrency:
+        claude_cli = _client(url, pool_size=workers)
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            counts = run_batch(claude_cli, prompts, os.path.join(directory, "results.jsonl"),
+                               concurrency=workers)
+            elapsed = time.perf_counter() - start
+        claude_cli.close()
+        report[f"batch.c{workers}"] = {
+            "requests": requests,
+            "failed": counts["failed"],
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(requests / elapsed, 1),
+        }
+    return report
+
+
+def bench_store(messages: int, rounds: int) -> Dict[str, Any]:
+    """saving and loading a large conversation as .json and as a .jsonl store"""
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {TURN}"}
+               for i in range(messages)]
+    claude_cli = cli.ClaudeCLI("bench")
+    claude_cli.conversation_history = history
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "conversation.json")
+        store_path = os.path.join(directory, "conversation.jsonl")
+
+        def save_store() -> None:
+            for path in (store_path, store_path + config.STORE_INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+            ConversationStore.write(store_path, history)
+
+        report = {
+            "store.save_json": measure(lambda: claude_cli.save_conversation(json_path), rounds),
+            "store.save_jsonl": measure(save_store, rounds),
+            "store.load_json": measure(lambda: claude_cli.load_conversation(json_path), rounds),
+            # reads only the tail that fits the context budget
+            "store.load_jsonl": measure(lambda: claude_cli.load_conversation(store_path), rounds),
+            "store.append_turn": measure(lambda: claude_cli.store.append(history[:2]), rounds),
+        }
+    claude_cli.close()
+    for result in report.values():
+        result["messages"] = messages
+    return report
+
+
+def bench_history(sizes: Sequence[int], rounds: int) -> Dict[str, Any]:
+    """
+    client-side cost of the request for one more turn of a long conversation:
+    fitting it to the context budget, building and encoding it, with nothing
+    sent. history.reencode is the same request serializing the history as a
+    plain list of dicts; history.whole sends the whole conversation (no
+    budget), where only copying the encoded bytes grows with its size.
+    """
+    report: Dict[str, Any] = {}
+    new = {"role": "user", "content": TURN}
+    for size in sizes:
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {TURN}"}
+                    for i in range(size)]
+        for name, budget in (("turn", config.CONTEXT_BUDGET), ("whole", 0)):
+            claude_cli = cli.ClaudeCLI("bench", context_budget=budget)
+            claude_cli.conversation_history = messages
+
+            def turn() -> None:
+                window = claude_cli.context.fit(claude_cli.conversation_history + [new])
+                encode_payload(claude_cli.build_payload(window, splice=True))
+
+            report[f"history.{name}.n{size}"] = dict(measure(turn, rounds), messages=size)
+            if name == "turn":
+                def reencode() -> None:
+                    window = claude_cli.context.fit(messages + [new])
+                    json.dumps(claude_cli.build_payload(window)).encode("utf-8")
+
+                report[f"history.reencode.n{size}"] = dict(measure(reencode, rounds),
+                                                           messages=size)
+            claude_cli.close()
+    return report
+
+
+def import_time(module: str = "cli", runs: int = 5) -> Dict[str, Any]:
+    """
+    cost of importing a module in a fresh interpreter, from python -X importtime.
+    bytecode goes to a scratch cache that is warmed first, so compiling is not counted.
+    returns:
+        dict: best cumulative import time in ms and the modules it loaded
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as pycache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        best = None
+        loaded: List[str] = []
+        for _ in range(runs + 1):
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                     cwd=here, env=env, capture_output=True, text=True, check=True)
+            # "import time: <self us> | <cumulative us> | <indented name>"; modules
+            # already imported by site (e.g. certifi's) appear earlier in the output
+            lines = [line.split("|") for line in process.stderr.splitlines()
+                     if line.startswith("import time:") and "self [us]" not in line]
+            names = [name.strip() for _, _, name in lines]
+            start = len(names) - 1 - names[::-1].index(module)
+            # the module's own line follows the modules it imported, which run
+            # back to the previous top-level (unindented) import
+            previous = max((i for i, name in enumerate(names[:start]) if lines[i][2] == " " + name),
+                           default=-1)
+            micros = int(lines[start][1])
+            if best is None or micros < best:
+                best = micros
+                loaded = names[previous + 1:start + 1]
+        return {"module": module, "milliseconds": round(best / 1000, 2), "modules": loaded}
+
+
+def run(scenarios: Sequence[str] = SCENARIOS, rounds: int = 50, requests: int = 1000,
+        concurrency: Sequence[int] = (1, 8, 32), messages: int = 20000,
+        server_args: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    run the named scenarios, each against a fresh mock server process
+    args:
+        rounds: timed rounds of the single, multi_turn, store and history scenarios
+        requests: prompts per batch and async run
+        concurrency: worker counts for the batch scenario; async uses the largest
+        messages: size of the conversation the store scenario saves and loads
+        server_args: mock_server.py options, e.g. latency and error injection
+    returns:
+        dict: the report, with one entry per measurement under "results"
+    """
+    results: Dict[str, Any] = {}
+    for scenario in scenarios:
+        if scenario == "store":
+            results.update(bench_store(messages, max(1, rounds // 10)))
+        elif scenario == "history":
+            results.update(bench_history(HISTORY_SIZES, max(1, rounds // 5)))
+        elif scenario == "startup":
+            startup = import_time("cli")
+            results["startup"] = {"milliseconds": startup["milliseconds"],
+                                  "modules": len(startup["modules"])}
+        elif scenario == "async":
+            with mock_server_process(*server_args) as url:
+                for name, result in (("threaded", bench_threaded), ("async", bench_async)):
+                    results[f"async.{name}"] = result(url, requests, max(concurrency))
+        else:
+            with mock_server_process(*server_args) as url:
+                if scenario == "single":
+                    results.update(bench_single(url, rounds))
+                elif scenario == "multi_turn":
+                    results.update(bench_multi_turn(url, rounds))
+                elif scenario == "batch":
+                    results.update(bench_batch(url, requests, concurrency))
+                else:
+                    raise ValueError(f"unknown scenario: {scenario}")
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "server_args": list(server_args),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any],
+            threshold: float = config.BENCH_REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    measurements of report that are more than threshold worse than in baseline
+    returns:
+        list: one dict per regressed metric, with its old and new value
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name, {})
+        for metric, higher_is_better in COMPARED.items():
+            if metric not in result or not before.get(metric):
+                continue
+            change = result[metric] / before[metric] - 1
+            if higher_is_better:
+                change = -change
+            if change > threshold:
+                regressions.append({"name": name, "metric": metric, "baseline": before[metric],
+                                    "value": result[metric], "change": round(change, 3)})
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark claude cli against a local mock server")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Scenario to run, repeatable (default: all)")
+    parser.add_argument("--rounds", type=int, default=50,
+                        help="Timed rounds, and turns of the multi-turn scenario (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="Prompts per batch and async run (default: %(default)s)")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        help="Comma separated batch concurrency levels (default: %(default)s)")
+    parser.add_argument("--messages", type=int, default=20000,
+                        help="Messages in the saved and loaded conversation (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Mock server latency per request in seconds (default: %(default)s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="Mock server delay between streamed deltas in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests the mock server fails with a 500 or 529")
+    parser.add_argument("--rps", type=int, help="Mock server requests per second before 429s")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare with an earlier report, exiting 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=config.BENCH_REGRESSION_THRESHOLD,
+                        help="Relative slowdown counted as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    server_args = ["--latency", str(args.latency), "--chunk-delay", str(args.chunk_delay),
+                   "--error-rate", str(args.error_rate), "--seed", "0"]
+    if args.rps:
+        server_args += ["--rps", str(args.rps)]
+    report = run(args.scenario or SCENARIOS, args.rounds, args.requests,
+                 [int(c) for c in args.concurrency.split(",")], args.messages, server_args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for r in regressions:
+            print(f"regression: {r['name']} {r['metric']} {r['baseline']} -> {r['value']} "
+                  f"({r['change']:+.0%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
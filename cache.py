@@ -0,0 +1,111 @@
+"""
+Local response cache for claude cli
+
+stores successful replies in a SQLite database keyed on a canonical hash
+of the request (model, system prompt, messages, max_tokens), with a TTL
+and least-recently-used eviction once the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import config
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """canonical hash of the parts of a request body that decide the reply"""
+    canonical = json.dumps({
+        "model": payload.get("model"),
+        "system": payload.get("system"),
+        # a history.Window is read as the messages it holds
+        "messages": list(payload.get("messages") or []),
+        "max_tokens": payload.get("max_tokens"),
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir: str = config.CACHE_DIR,
+                 ttl: float = config.CACHE_TTL,
+                 max_bytes: int = config.CACHE_MAX_BYTES,
+                 refresh: bool = False) -> None:
+        """
+        args:
+            cache_dir: directory holding the cache database
+            ttl: seconds an entry stays valid
+            max_bytes: total size of stored replies before the least recently
+                       used ones are evicted
+            refresh: skip lookups but still store new replies
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, config.CACHE_FILE_NAME)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def key(self, payload: Dict[str, Any]) -> str:
+        return cache_key(payload)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """cached reply for a key, or None on a miss"""
+        with self.lock:
+            row = None
+            if not self.refresh:
+                row = self.db.execute("SELECT response, created FROM responses WHERE key = ?",
+                                      (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        """store a reply and evict old entries past the size limit"""
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                            (key, data, len(data), now, now))
+            self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,243 @@
+"""
+Large file input for claude cli
+
+files bigger than one request are split into chunks under a token budget,
+on line or paragraph boundaries with some overlap between neighbours, and
+read line by line so the whole file is never held in memory. map_reduce
+sends the chunks concurrently through batch mode, whose JSONL output makes
+every stage resumable, and combines the partial answers with a reduce
+prompt, in several rounds if they do not fit one request.
+"""
+
+import hashlib
+import json
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import config
+from batch import require_sync, run_batch
+from ratelimit import estimate_tokens
+
+# (first line, last line, text)
+Chunk = Tuple[int, int, str]
+
+
+def _units(f: TextIO, boundary: str) -> Iterator[Chunk]:
+    """the lines of a file, or its paragraphs with their trailing blank lines"""
+    if boundary == "line":
+        for number, line in enumerate(f, 1):
+            yield number, number, line
+        return
+    lines: List[str] = []
+    first = 1
+    for number, line in enumerate(f, 1):
+        if lines and line.strip() and not lines[-1].strip():
+            yield first, number - 1, "".join(lines)
+            lines, first = [], number
+        lines.append(line)
+    if lines:
+        yield first, first + len(lines) - 1, "".join(lines)
+
+
+def iter_chunks(f: TextIO, max_tokens: int = config.CHUNK_TOKENS,
+                overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS,
+                boundary: str = config.CHUNK_BOUNDARY) -> Iterator[Chunk]:
+    """
+    split a text file into chunks of at most max_tokens estimated tokens
+    args:
+        f: file opened for reading text, read incrementally
+        overlap_tokens: each chunk repeats up to this much of the end of the previous one
+        boundary: chunks end on a "line" or "paragraph" boundary; a longer
+                  line or paragraph is cut mid-text
+    """
+    max_chars = max(1, max_tokens * config.CHARS_PER_TOKEN)
+    # a chunk always has room for new text after its overlap
+    overlap_chars = min(overlap_tokens * config.CHARS_PER_TOKEN, max_chars // 2)
+    window: Deque[Chunk] = deque()
+    size = 0
+    for first, last, text in _units(f, boundary):
+        for start in range(0, len(text), max_chars):
+            piece = text[start:start + max_chars]
+            if window and size + len(piece) > max_chars:
+                yield window[0][0], window[-1][1], "".join(unit[2] for unit in window)
+                kept: Deque[Chunk] = deque()
+                size = 0
+                while window and size + len(window[-1][2]) <= overlap_chars:
+                    kept.appendleft(window.pop())
+                    size += len(kept[0][2])
+                window = kept
+                while window and size + len(piece) > max_chars:
+                    size -= len(window.popleft()[2])
+            window.append((first, last, piece))
+            size += len(piece)
+    if window:
+        yield window[0][0], window[-1][1], "".join(unit[2] for unit in window)
+
+
+def _results(path: str) -> Dict[str, Dict[str, Any]]:
+    """the successful records of a stage file by id"""
+    records: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # partial line from an interrupted run
+                continue
+            if record.get("success"):
+                records[record["id"]] = record
+    return records
+
+
+def work_path(path: str, task: str, model: str, max_tokens: int, system_prompt: Optional[str],
+              chunk_tokens: int, overlap_tokens: int, boundary: str,
+              work_dir: str = config.MAP_REDUCE_DIR) -> str:
+    """
+    the JSONL file holding the partial results of a run; the same file and
+    settings map to the same file, a changed file to a new one
+    """
+    info = os.stat(path)
+    key = json.dumps([os.path.abspath(path), info.st_size, info.st_mtime_ns, task, model,
+                      max_tokens, system_prompt, chunk_tokens, overlap_tokens, boundary])
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+    os.makedirs(work_dir, exist_ok=True)
+    return os.path.join(work_dir, name + ".jsonl")
+
+
+def _stage(claude_cli: Any, prompts: Iterable[Dict[str, Any]], total: int, output_path: str,
+           stage: str, model: str, max_tokens: int, system_prompt: Optional[str],
+           concurrency: int,
+           on_progress: Optional[Callable[[str, int, int], None]]) -> Dict[str, int]:
+    """run one map or reduce round through batch mode, reporting progress"""
+    # results of this stage kept from an earlier run are skipped by run_batch
+    done = sum(key.startswith(stage + "-") for key in _results(output_path))
+    counts = {"done": 0}
+
+    def progress(record: Dict[str, Any]) -> None:
+        counts["done"] += 1
+        if on_progress:
+            on_progress(stage, min(total, done + counts["done"]), total)
+
+    if on_progress:
+        on_progress(stage, min(total, done), total)
+    return run_batch(claude_cli, prompts, output_path, model, max_tokens, system_prompt,
+                     concurrency, on_result=progress)
+
+
+def map_reduce(claude_cli: Any, path: str, task: str = config.DEFAULT_TASK,
+               model: str = config.DEFAULT_MODEL, max_tokens: int = config.DEFAULT_MAX_TOKENS,
+               system_prompt: Optional[str] = None,
+               chunk_tokens: int = config.CHUNK_TOKENS,
+               overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS,
+               boundary: str = config.CHUNK_BOUNDARY,
+               concurrency: int = config.BATCH_CONCURRENCY,
+               work_dir: str = config.MAP_REDUCE_DIR, stream: bool = False,
+               on_text: Optional[Callable[[str], None]] = None,
+               on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    answer a task about a file of any size: each chunk is sent with the task
+    (map), then the answers are combined (reduce). partial results are kept
+    in work_dir, so an interrupted or partly failed run continues where it
+    stopped when run again.
+    args:
+        claude_cli: shared client; its complete() must be thread safe
+        task: what to do with the file, sent with every chunk and with the reduce prompt
+        on_text: called with the text deltas of the final answer when streaming
+        on_progress: called with the stage name and chunks done and total
+    returns:
+        dict: the result dict of the final request, with the number of chunks
+              and the partial results file, or a failure
+    raises:
+        OSError, UnicodeDecodeError: if the file cannot be read
+        TypeError: if claude_cli is an AsyncClaudeCLI
+    """
+    require_sync(claude_cli, "map_reduce")
+    name = os.path.basename(path)
+    output_path = work_path(path, task, model, max_tokens, system_prompt, chunk_tokens,
+                            overlap_tokens, boundary, work_dir)
+
+    def chunks() -> Iterator[Chunk]:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from iter_chunks(f, chunk_tokens, overlap_tokens, boundary)
+
+    # a first pass only counts, so progress has a total without holding the chunks
+    total = sum(1 for _ in chunks())
+    if not total:
+        return {"success": False, "message": None, "error": config.ERROR_MESSAGES["file_empty"]}
+
+    def map_prompts() -> Iterator[Dict[str, Any]]:
+        for index, (first, last, text) in enumerate(chunks(), 1):
+            yield {"id": f"map-{index}", "message": config.MAP_PROMPT.format(
+                index=index, total=total, name=name, first=first, last=last, task=task, text=text)}
+
+    counts = _stage(claude_cli, map_prompts(), total, output_path, "map", model, max_tokens,
+                    system_prompt, concurrency, on_progress)
+    if counts["failed"]:
+        return _failure(counts["failed"], total)
+
+    records = _results(output_path)
+    partials = [records[f"map-{index}"]["message"] for index in range(1, total + 1)]
+    if total == 1:
+        # a file that fits one chunk needs no combining
+        response = dict(records["map-1"], chunks=total, work_path=output_path)
+        del response["id"]
+        if on_text:
+            on_text(response["message"])
+        return response
+
+    round_number = 0
+    while True:
+        message = _reduce_prompt(name, task, partials)
+        if estimate_tokens(message) <= chunk_tokens or len(partials) <= 2:
+            break
+        # too many answers for one request: combine them in groups first
+        round_number += 1
+        groups = _groups(partials, chunk_tokens)
+        stage = f"reduce-{round_number}"
+        prompts = ({"id": f"{stage}-{i}", "message": _reduce_prompt(name, task, group)}
+                   for i, group in enumerate(groups, 1))
+        counts = _stage(claude_cli, prompts, len(groups), output_path, stage, model, max_tokens,
+                        system_prompt, concurrency, on_progress)
+        if counts["failed"]:
+            return _failure(counts["failed"], len(groups))
+        records = _results(output_path)
+        partials = [records[f"{stage}-{i}"]["message"] for i in range(1, len(groups) + 1)]
+
+    if on_progress:
+        on_progress("reduce", 0, 1)
+    response = claude_cli.complete(message, model, max_tokens, system_prompt, stream, on_text)
+    if on_progress and response["success"]:
+        on_progress("reduce", 1, 1)
+    response.update(chunks=total, work_path=output_path)
+    return response
+
+
+def _reduce_prompt(name: str, task: str, partials: List[str]) -> str:
+    results = "\n\n".join(f"<part index=\"{i}\">\n{text}\n</part>"
+                          for i, text in enumerate(partials, 1))
+    return config.REDUCE_PROMPT.format(name=name, task=task, results=results)
+
+
+def _groups(partials: List[str], max_tokens: int) -> List[List[str]]:
+    """consecutive partial answers in groups under max_tokens, at least two per group"""
+    groups: List[List[str]] = []
+    group: List[str] = []
+    size = 0
+    for text in partials:
+        tokens = estimate_tokens(text)
+        if len(group) >= 2 and size + tokens > max_tokens:
+            groups.append(group)
+            group, size = [], 0
+        group.append(text)
+        size += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _failure(failed: int, total: int) -> Dict[str, Any]:
+    return {"success": False, "message": None,
+            "error": config.ERROR_MESSAGES["chunks_failed"].format(failed, total)}
@@ -1,112 +1,686 @@
 #!/usr/bin/env python3
 """
 claude cli: command-line interface with Claude AI
+
+startup matters for scripts that call the cli thousands of times, so
+heavy modules (requests, colorama, argparse, pathlib) are imported inside
+the functions that need them rather than at module level. json and
+threading are cheap and are loaded at startup by the history, store, stats
+and rate limit modules.
 """
 
 import os
 import sys
-import json
-import argparse
-from typing import List, Dict, Any, Optional, Union
-import requests
-from pathlib import Path
-# adding color to the text
-from colorama import Fore, Back, Style, init
+import time
+from typing import (TYPE_CHECKING, List, Dict, Any, Optional, Union, Callable, Iterable, Iterator,
+                    Tuple)
 
 import config
+from client import BaseClient, with_cache_control
+from ratelimit import parse_retry_after
+from history import encode_payload
+from store import conversation_path, is_store_file
+import stats
+
+if TYPE_CHECKING:
+    import argparse
+    import queue
+    import threading
+    import requests
+    from sessions import Session, SessionStore
+    from warmer import CacheWarmer
+
+
+class _NoColor:
+    """stand-in for colorama's Fore/Back/Style when output is not colored"""
+
+    def __getattr__(self, name: str) -> str:
+        return ""
+
+
+# adding color to the text; setup_colors swaps in colorama when output is a terminal
+Fore: Any = _NoColor()
+Back: Any = _NoColor()
+Style: Any = _NoColor()
+
+
+def setup_colors(enabled: bool) -> None:
+    """
+    color terminal output with colorama, which is only imported when enabled
+    args:
+        enabled: false for pipes, --raw and NO_COLOR
+    """
+    global Fore, Back, Style
+    if not enabled:
+        Fore = Back = Style = _NoColor()
+        return
+    import colorama
+    colorama.init(autoreset=True)
+    Fore, Back, Style = colorama.Fore, colorama.Back, colorama.Style
+
+
+class SSEDecoder:
+    """incremental server-sent event parser, fed one line at a time"""
 
-init(autoreset=True)
+    def __init__(self) -> None:
+        self.event: Optional[str] = None
+        self.data: List[str] = []
 
-class ClaudeCLI:
-    def __init__(self, api_key: Optional[str] = None) -> None:
+    def feed(self, line: Union[str, bytes]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        args:
+            line: one line of the stream, without its terminator
+        returns:
+            (event, data) once a blank line completes an event, else None
+        """
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line:
+            # blank line dispatches the buffered event
+            return self.flush()
+        if line.startswith(":"):
+            return None
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            self.event = value
+        elif field == "data":
+            self.data.append(value)
+        return None
+
+    def flush(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """the buffered event, if any"""
+        import json
+
+        result = None
+        if self.data:
+            result = (self.event or "message", json.loads("\n".join(self.data)))
+        self.event, self.data = None, []
+        return result
+
+
+def iter_sse_events(lines: Iterable[Union[str, bytes]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    parse server-sent event lines into (event, data) pairs
+    args:
+        lines: raw lines of an event stream, without line terminators
+    yields:
+        tuple of the event name and its decoded json data
+    """
+    decoder = SSEDecoder()
+    for line in lines:
+        event = decoder.feed(line)
+        if event:
+            yield event
+    event = decoder.flush()
+    if event:
+        yield event
+
+
+class StreamError(Exception):
+    """error event received in the middle of a streamed response"""
+
+
+class Cancelled(StreamError):
+    """a streamed response abandoned because its cancel event was set, e.g. a lost race"""
+
+    def __init__(self) -> None:
+        super().__init__(config.ERROR_MESSAGES["request_cancelled"])
+
+
+def cancellable(call: Callable[[], Any], cancel: "threading.Event") -> Any:
+    """
+    run a blocking call on a daemon thread and return its result, or give up
+    as soon as cancel is set; an abandoned call still runs to its end
+    raises:
+        Cancelled: if cancel was set before the call returned
+        Exception: whatever the call raised
+    """
+    import contextvars
+    import queue
+    import threading
+
+    done: "queue.Queue[Tuple[bool, Any]]" = queue.Queue()
+    # the copied context carries the stats sample of the request in flight
+    context = contextvars.copy_context()
+
+    def run() -> None:
+        try:
+            done.put((True, context.run(call)))
+        except Exception as e:
+            done.put((False, e))
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        try:
+            ok, value = done.get(timeout=config.CANCEL_POLL_INTERVAL)
+        except queue.Empty:
+            if cancel.is_set():
+                raise Cancelled()
+            continue
+        if not ok:
+            raise value
+        return value
+
+
+class MessageAssembler:
+    """builds the final message from Messages API stream events"""
+
+    def __init__(self) -> None:
+        self.message: Dict[str, Any] = {}
+        self.blocks: Dict[int, Dict[str, Any]] = {}
+        # text deltas are collected per block and joined once at the end
+        self.parts: Dict[int, List[str]] = {}
+        self.done = False
+
+    def feed(self, event: str, data: Dict[str, Any]) -> Optional[str]:
+        """
+        apply one event
+        returns:
+            the text delta carried by the event, if any
+        raises:
+            StreamError: on an error event
+        """
+        if event == "message_start":
+            self.message = data["message"]
+        elif event == "content_block_start":
+            self.blocks[data["index"]] = data["content_block"]
+        elif event == "content_block_delta":
+            delta = data["delta"]
+            if delta.get("type") == "text_delta":
+                self.parts.setdefault(data["index"], []).append(delta["text"])
+                return delta["text"]
+        elif event == "message_delta":
+            self.message.update(data.get("delta", {}))
+            usage = self.message.setdefault("usage", {})
+            usage.update(data.get("usage", {}))
+        elif event == "message_stop":
+            self.done = True
+        elif event == "error":
+            raise StreamError(data.get("error", {}).get("message", "stream error"))
+        return None
+
+    def result(self) -> Dict[str, Any]:
+        """the assembled message, in the same shape as a non-streamed response"""
+        for index, text in self.parts.items():
+            block = self.blocks.setdefault(index, {"type": "text", "text": ""})
+            block["text"] = block.get("text", "") + "".join(text)
+        self.message["content"] = [self.blocks[index] for index in sorted(self.blocks)]
+        return self.message
+
+
+def read_message_stream(events: Iterable[Tuple[str, Dict[str, Any]]],
+                        on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    assemble a streamed response into the same shape as a non-streamed one
+    args:
+        events: (event, data) pairs from iter_sse_events
+        on_text: called with every text delta as soon as it arrives
+    returns:
+        dict: the final message, including content, stop_reason and usage
+    """
+    assembler = MessageAssembler()
+    for event, data in events:
+        text = assembler.feed(event, data)
+        if text and on_text:
+            on_text(text)
+        if assembler.done:
+            break
+    return assembler.result()
+
+
+def distinct_models(models: Iterable[str]) -> List[str]:
+    """
+    the models of a --race/--compare list, without duplicates
+    raises:
+        ValueError: if fewer than two different models are left
+    """
+    distinct = list(dict.fromkeys(model.strip() for model in models if model.strip()))
+    if len(distinct) < 2:
+        raise ValueError(config.ERROR_MESSAGES["too_few_models"])
+    return distinct
+
+
+class ClaudeCLI(BaseClient):
+    def __init__(self, api_key: Optional[str] = None,
+                 pool_size: int = config.POOL_MAXSIZE,
+                 keep_alive: bool = config.KEEP_ALIVE,
+                 connect_timeout: float = config.CONNECT_TIMEOUT,
+                 read_timeout: float = config.READ_TIMEOUT,
+                 max_retries: int = config.MAX_RETRIES,
+                 requests_per_minute: Optional[float] = config.RATE_LIMIT_RPM,
+                 tokens_per_minute: Optional[float] = config.RATE_LIMIT_TPM,
+                 cache: Optional[Any] = None,
+                 prompt_cache: bool = config.PROMPT_CACHE_ENABLED,
+                 context_budget: Optional[int] = config.CONTEXT_BUDGET,
+                 context_strategy: str = config.CONTEXT_STRATEGY,
+                 request_stats: Optional[stats.Stats] = None) -> None:
         """
         command-line interface for interacting with Claude AI.
+        args:
+            pool_size: max pooled connections kept open to the API host
+            keep_alive: reuse connections between requests
+            connect_timeout: seconds to wait for a connection
+            read_timeout: seconds to wait between bytes of the response
+            max_retries: retries for rate limited, overloaded or dropped requests
+            requests_per_minute: client-side request quota shared by all threads
+            tokens_per_minute: client-side input token quota shared by all threads
+            cache: optional cache.ResponseCache consulted before every request
+            prompt_cache: add cache-control breakpoints so the API can reuse the
+                          system prompt and conversation prefix between turns
+            context_budget: max estimated input tokens per turn, None or 0 for no limit
+            context_strategy: "trim" or "summarize" the oldest turns past the budget
+            request_stats: collects per-request timings, a fresh stats.Stats by default
+        """
+        super().__init__(api_key, connect_timeout, read_timeout, max_retries, requests_per_minute,
+                         tokens_per_minute, cache, prompt_cache, context_budget, context_strategy,
+                         request_stats)
+        self.session = self._create_session(pool_size, keep_alive)
+
+    def _create_session(self, pool_size: int, keep_alive: bool) -> "requests.Session":
+        """create the pooled http session shared by every request"""
+        import requests
+
+        session = requests.Session()
+        # times dns, connect and tls of every new connection for the request stats
+        adapter = stats.timed_adapter(pool_connections=config.POOL_CONNECTIONS,
+                                      pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        if not keep_alive:
+            session.headers["connection"] = "close"
+        return session
+
+    def prewarm(self) -> "threading.Thread":
+        """
+        open a connection to the API host in the background so the
+        TCP+TLS handshake is done before the first real request
+        returns:
+            threading.Thread: the warm-up thread, already started
+        """
+        import threading
+        import requests
+
+        def warm() -> None:
+            try:
+                self.session.head(self.base_url, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                # the real request will report connection problems
+                pass
+
+        thread = threading.Thread(target=warm, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """close pooled connections"""
+        self.session.close()
+
+    def create_message(self, payload: Dict[str, Any],
+                       on_text: Optional[Callable[[str], None]] = None,
+                       cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """
+        post a request body to the Messages API
+        args:
+            payload: request body from build_payload
+            on_text: called with each text delta when the payload asks to stream
+            cancel: once set, the request is abandoned without waiting for the server
+        returns:
+            dict: the raw API message
+        raises:
+            requests.exceptions.RequestException, StreamError: on http or stream errors
+            Cancelled: if cancel was set before the reply was complete
+        """
+        if cancel is None:
+            return self._read_message(payload, on_text)
+        if cancel.is_set():
+            raise Cancelled()
+        # a reply can take minutes to start, or to send its next event, so it is
+        # read on another thread and left to finish on its own once cancelled
+        return cancellable(lambda: self._read_message(payload, on_text, cancel), cancel)
+
+    def _read_message(self, payload: Dict[str, Any],
+                      on_text: Optional[Callable[[str], None]] = None,
+                      cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """post a request body and read the reply; a stream is closed at its next line once cancelled"""
+        stream = bool(payload.get("stream"))
+        response = self._post_with_retry(payload, stream)
+        body = response.request.body
+        # the body can also be a generator or file, whose size is unknown
+        if isinstance(body, (bytes, str)):
+            stats.set_value("request_bytes", len(body))
+
+        if stream:
+            received = 0
+
+            def counted(lines: Iterable[bytes]) -> Iterator[bytes]:
+                nonlocal received
+                for line in lines:
+                    if cancel is not None and cancel.is_set():
+                        # the connection is dropped rather than drained back into the pool
+                        response.close()
+                        raise Cancelled()
+                    received += len(line) + 1
+                    yield line
+
+            def first_text(text: str) -> None:
+                stats.mark("ttft")
+                if on_text:
+                    on_text(text)
+
+            # chunk_size=None hands over each chunk as soon as it arrives
+            events = iter_sse_events(counted(response.iter_lines(chunk_size=None)))
+            result = read_message_stream(events, first_text)
+            stats.set_value("response_bytes", received)
+            return result
+        if isinstance(response.content, bytes):
+            stats.set_value("response_bytes", len(response.content))
+        return response.json()
+
+    def _post_with_retry(self, payload: Dict[str, Any], stream: bool) -> "requests.Response":
+        """
+        post the payload, backing off and retrying on 429/529/5xx and dropped connections.
+        only the request is retried; a stream that fails midway is not replayed.
+        """
+        # the history's messages are already encoded; only the new ones are serialized
+        body = encode_payload(payload)
+        tokens = len(body) // config.CHARS_PER_TOKEN if self.rate_limiter.tokens else 0
+        return self.request("post", self.base_url, tokens, data=body, stream=stream)
+
+    def request(self, method: str, url: str, tokens: int = 0, **kwargs: Any) -> "requests.Response":
         """
-        self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+        send an API request on the pooled session under the client's rate limits,
+        backing off and retrying on 429/529/5xx and dropped connections
+        args:
+            method: "get" or "post"
+            tokens: input tokens to reserve against the tokens per minute limit
+            kwargs: passed on to requests, e.g. json, data or stream
+        raises:
+            requests.exceptions.RequestException: once retries are exhausted
+        """
+        import requests
+
+        stream = kwargs.pop("stream", False)
+        send = getattr(self.session, method)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            start = time.perf_counter()
+            try:
+                # always return at the headers, so the time to first byte is known
+                response = send(url, timeout=self.timeout, stream=True, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+            stats.set_value("ttfb", time.perf_counter() - start)
+            stats.set_value("retries", attempt)
+
+            self.rate_limiter.update_from_headers(response.headers)
+            if response.ok or not self.retry_policy.should_retry(
+                    attempt, response.status_code, response.headers):
+                response.raise_for_status()
+                if not stream:
+                    # read the body now, as requests does without stream=True
+                    response.content
+                return response
 
-        if not self.api_key:
-            raise ValueError(config.ERROR_MESSAGES["no_api_key"])
-        
-        self.base_url = config.API_BASE_URL
-        self.headers = config.get_api_headers(self.api_key)
-        # takes a list of dictionary that has a kvp of str,str
-        self.conversation_history: List[Dict[str, str]] = [] 
+            delay = self.retry_policy.delay(attempt, parse_retry_after(response.headers))
+            response.close()
+            if response.status_code == 429:
+                # every worker sharing this client backs off, not just this one
+                self.rate_limiter.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+              system_prompt: Optional[str], stream: bool,
+              on_text: Optional[Callable[[str], None]],
+              cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """send messages and wrap the reply or error in a result dict with its request stats"""
+        sample = self.stats.start(model, stream)
+        response: Dict[str, Any] = {"success": False}
+        try:
+            response = self._exchange(messages, model, max_tokens, system_prompt, stream, on_text,
+                                      cancel)
+            return response
+        finally:
+            response["stats"] = self.stats.finish(sample, response)
+
+    def _exchange(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                  system_prompt: Optional[str], stream: bool,
+                  on_text: Optional[Callable[[str], None]],
+                  cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """send one request, or answer it from the response cache"""
+        import requests
+
+        payload = self.build_payload(messages, model, max_tokens, system_prompt, stream,
+                                     splice=True)
+        key, result = self._lookup(payload)
+        cached = result is not None
+        try:
+            if result is None:
+                result = self.create_message(payload, on_text, cancel)
+            elif on_text:
+                on_text(result["content"][0]["text"])
+            return self._success(result, model, key, cached)
+        except Cancelled as e:
+            # e.g. a lost race: abandoned rather than failed, and counted apart in the stats
+            return dict(self._failure(e), cancelled=True)
+        except (requests.exceptions.RequestException, StreamError) as e:
+            return self._failure(e)
+        except (ValueError, KeyError) as e:
+            # e.g. a malformed event in the stream
+            return self._failure(e)
 
     def send_message(self, message: str, model: str = config.DEFAULT_MODEL, 
                     max_tokens: int = config.DEFAULT_MAX_TOKENS, 
-                    system_prompt: Optional[str] = None) -> Dict[str, Any]:
+                    system_prompt: Optional[str] = None, stream: bool = False,
+                    on_text: Optional[Callable[[str], None]] = None,
+                    cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
 
-        """send message to claude and return the response"""
+        """
+        send message to claude and return the response
+        args:
+            stream: consume the server-sent event stream instead of waiting for the full body
+            on_text: called with each text delta while streaming
+            cancel: once set, the stream is closed and the turn is left out of the history
+        """
         messages = self.conversation_history + [{"role": "user", "content": message}]
-        payload = {
-            "model": model,
-            "max_tokens": max_tokens,
-            "messages": messages
-        }
-        
-        if system_prompt:
-            payload["system"] = system_prompt
-        try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            assistant_message = result["content"][0]["text"]
-            
+        messages = self.context.fit(messages, system_prompt)
+        response = self._send(messages, model, max_tokens, system_prompt, stream, on_text, cancel)
+
+        if response["success"] and not (cancel is not None and cancel.is_set()):
             # update convo
-            self.conversation_history.append({"role": "user", "content": message})
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
-            
-            return {
-                "success": True,
-                "message": assistant_message,
-                "usage": result.get("usage", {}),
-                "model": result.get("model", model)
-            }
-        except requests.exceptions.RequestException as e:
-            return {
-                "success": False,
-                "error": config.ERROR_MESSAGES["api_request_failed"].format(str(e)),
-                "message": None
-            }
-        except KeyError as e:
-            return {
-                "success": False,
-                "error": config.ERROR_MESSAGES["api_request_failed"].format(str(e)),
-                "message": None
-            }
+            self._record_turn(message, response["message"])
+        return response
+
+    def _fan_out(self, messages: List[Dict[str, Any]], models: List[str], max_tokens: int,
+                 system_prompt: Optional[str], stream: bool,
+                 on_text: Callable[[str], Optional[Callable[[str], None]]],
+                 cancels: Dict[str, "threading.Event"]) -> "queue.Queue[Tuple[str, Dict[str, Any]]]":
+        """
+        send the same messages to every model, each on its own daemon thread so an
+        abandoned request never holds up the caller or interpreter exit
+        returns:
+            queue.Queue: (model, result dict) pairs in the order the requests finish
+        """
+        import queue
+        import threading
+
+        done: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+
+        def run(model: str) -> None:
+            try:
+                result = self._send(messages, model, max_tokens, system_prompt, stream,
+                                    on_text(model), cancels.get(model))
+            except Exception as e:
+                # the caller waits for a result from every model, so one is always queued
+                result = self._failure(e)
+            done.put((model, result))
+
+        for model in models:
+            threading.Thread(target=run, args=(model,), daemon=True).start()
+        return done
+
+    def race(self, message: str, models: List[str],
+             max_tokens: int = config.DEFAULT_MAX_TOKENS,
+             system_prompt: Optional[str] = None,
+             on_text: Optional[Callable[[str], None]] = None,
+             cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """
+        send a message to several models at once and keep whichever streams text first.
+        the other requests are cancelled, and only the winner's reply enters the history.
+        args:
+            on_text: called with the text deltas of the winning model only
+            cancel: once set, every request is cancelled
+        returns:
+            dict: the winner's result dict, with the other models under "cancelled"
+        """
+        import queue
+        import threading
+
+        models = distinct_models(models)
+        messages = self.conversation_history + [{"role": "user", "content": message}]
+        messages = self.context.fit(messages, system_prompt)
+        cancels = {model: threading.Event() for model in models}
+        lock = threading.Lock()
+        winner: Optional[str] = None
+
+        def forward(model: str) -> Callable[[str], None]:
+            def text(delta: str) -> None:
+                nonlocal winner
+                with lock:
+                    if winner is None:
+                        winner = model
+                        for other, cancel in cancels.items():
+                            if other != model:
+                                cancel.set()
+                if winner == model and on_text:
+                    on_text(delta)
+            return text
+
+        done = self._fan_out(messages, models, max_tokens, system_prompt, True, forward, cancels)
+        results: Dict[str, Dict[str, Any]] = {}
+        while len(results) < len(models):
+            try:
+                model, result = done.get(timeout=config.CANCEL_POLL_INTERVAL)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    for event in cancels.values():
+                        event.set()
+                continue
+            results[model] = result
+            if model == winner:
+                break
+        if winner is None:
+            # nobody streamed any text; the first model that succeeded wins
+            winner = next((model for model in models if results[model]["success"]), models[0])
+
+        response = dict(results[winner])
+        response["cancelled"] = [model for model in models if model != winner]
+        if response["success"] and not (cancel is not None and cancel.is_set()):
+            self._record_turn(message, response["message"])
+        return response
+
+    def compare(self, message: str, models: List[str],
+                max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                system_prompt: Optional[str] = None, stream: bool = False,
+                cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+        """
+        send a message to several models at once and collect every reply side by side.
+        the first model's reply is the one that continues the conversation.
+        args:
+            cancel: once set, every request is cancelled and the turn is left out of the history
+        returns:
+            dict: success of the first model and a result dict per model under "results",
+                  in the order given, each with its latency under "stats"
+        """
+        models = distinct_models(models)
+        messages = self.conversation_history + [{"role": "user", "content": message}]
+        messages = self.context.fit(messages, system_prompt)
+        done = self._fan_out(messages, models, max_tokens, system_prompt, stream,
+                             lambda model: None,
+                             {model: cancel for model in models} if cancel is not None else {})
+        results: Dict[str, Dict[str, Any]] = {}
+        while len(results) < len(models):
+            model, result = done.get()
+            results[model] = result
+
+        first = results[models[0]]
+        if first["success"] and not (cancel is not None and cancel.is_set()):
+            self._record_turn(message, first["message"])
+        return {"success": first["success"], "error": first.get("error"),
+                "results": [dict(results[model], model=results[model].get("model") or model)
+                            for model in models]}
+
+    def _summarize(self, transcript: str) -> Optional[str]:
+        """summary of older turns for the summarize context strategy, None on failure"""
+        response = self.complete(transcript, config.SUMMARY_MODEL, config.SUMMARY_MAX_TOKENS,
+                                 config.SUMMARY_SYSTEM)
+        return response["message"] if response["success"] else None
+
+    def complete(self, message: str, model: str = config.DEFAULT_MODEL,
+                 max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                 system_prompt: Optional[str] = None, stream: bool = False,
+                 on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        send a one-off message that neither reads nor updates the conversation history.
+        safe to call from several threads at once.
+        """
+        return self._send([{"role": "user", "content": message}], model, max_tokens,
+                          system_prompt, stream, on_text)
     
-    def clear_conversation(self) -> None:
+    def record_turn(self, message: str, reply: str) -> None:
         """
-        Removes all messages from the current convo. history 
+        add a turn answered outside send_message, e.g. by map-reduce, to the
+        history and the attached store and session
         """
-        self.conversation_history = []
-        
+        self._record_turn(message, reply)
+
     def save_conversation(self, filename: str) -> bool:
         """
-        Save the current history to a json file
+        Save the current history to a json file, or to an append-only
+        .jsonl conversation store
         args:
             filename: path to the file where convo. should be saved
         returns:
             bool: true if successful, false otherwise 
         """
-        try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, indent=2, ensure_ascii=False)
-            return True
-        except Exception as e:
-            print(f"Error saving conversation: {e}")
-            return False
+        return self._save_conversation(filename)
+
+    def attach_store(self, filename: str) -> bool:
+        """
+        append every completed turn to a .jsonl conversation store as it happens.
+        an empty store first receives the current history; a non-empty one is continued.
+        """
+        return self._attach_store(filename)
             
     def load_conversation(self, filename: str) -> bool:
-        """load convo from file"""
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                self.conversation_history = json.load(f)
-            return True
-        except Exception as e:
-            print(f"Error loading conversation: {e}")
-            return False
+        """
+        load convo from file. for a .jsonl store only the newest messages
+        that fit the context budget are read, and new turns are appended to it.
+        """
+        return self._load_conversation(filename)
+
+    def attach_session(self, session: "Session") -> None:
+        """
+        write every completed turn into a named session as well.
+        an empty session first receives the current history; a non-empty one is continued.
+        """
+        self._attach_session(session)
+
+    def resume_session(self, session: "Session") -> None:
+        """
+        continue a named session; only its newest turns that fit the context budget are read
+        raises:
+            ValueError: if the session does not exist
+        """
+        self._resume_session(session)
 
 
 def print_header(text: str) -> None:
@@ -129,10 +703,243 @@ def print_error(text: str) -> None:
 def print_separator() -> None:
     print(f"{Fore.CYAN}{'-' * 60}{Style.RESET_ALL}")
 
+def format_usage(response: Dict[str, Any], cache: Optional[Any] = None) -> str:
+    """token usage line, with cache hit/miss counters when a response cache is in use"""
+    usage = response.get("usage", {})
+    text = (f"[Tokens - Input: {usage.get('input_tokens', 'N/A')}, "
+            f"Output: {usage.get('output_tokens', 'N/A')}")
+    if usage.get("cache_read_input_tokens") or usage.get("cache_creation_input_tokens"):
+        text += (f", Cache read: {usage.get('cache_read_input_tokens', 0)}, "
+                 f"Cache write: {usage.get('cache_creation_input_tokens', 0)}")
+    if cache is not None:
+        text += f" | Cache: {cache.hits} hits, {cache.misses} misses"
+    return f"\n{Fore.CYAN}{Style.DIM}{text}]{Style.RESET_ALL}"
+
+def format_race(response: Dict[str, Any]) -> str:
+    """which model won a --race, and which were cancelled"""
+    text = f"[Winner: {response.get('model', 'none')}"
+    if response.get("cancelled"):
+        text += f", cancelled: {', '.join(response['cancelled'])}"
+    return f"{Fore.CYAN}{Style.DIM}{text}]{Style.RESET_ALL}"
+
+def print_comparison(response: Dict[str, Any], cache: Optional[Any] = None) -> None:
+    """the replies of a --compare side by side, with each model's latency and usage"""
+    for result in response["results"]:
+        timing = result.get("stats", {}).get("total_ms")
+        latency = f" ({timing / 1000:.2f}s)" if timing is not None else ""
+        print(f"\n{Fore.MAGENTA}{Style.BRIGHT}== {result['model']}{latency} =={Style.RESET_ALL}")
+        if result["success"]:
+            print(f"{Fore.WHITE}{result['message']}{Style.RESET_ALL}")
+            if result.get("usage"):
+                print(format_usage(result, cache))
+        else:
+            print_error(result["error"])
+
+def output_record(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    a result dict as an --output json/jsonl record: the reply with its model,
+    stop reason, usage and latency, or the error
+    """
+    if not response["success"]:
+        record = {"type": "error", "error": response["error"]}
+        if response.get("model"):
+            record["model"] = response["model"]
+        return record
+    timing = response.get("stats") or {}
+    record = {"type": "message", "model": response.get("model"), "message": response["message"],
+              "stop_reason": response.get("stop_reason"), "usage": response.get("usage", {}),
+              "latency_ms": timing.get("total_ms"), "ttft_ms": timing.get("ttft_ms")}
+    for key in ("cached", "cancelled", "chunks"):
+        if key in response:
+            record[key] = response[key]
+    return record
+
+def write_record(record: Dict[str, Any], output: str) -> None:
+    """print an --output record: an indented document for json, one line for jsonl"""
+    import json
+
+    sys.stdout.write(json.dumps(record, ensure_ascii=False,
+                                indent=2 if output == "json" else None) + "\n")
+    sys.stdout.flush()
+
+def record_writer(output: str, stream: bool) -> Optional[Callable[[str], None]]:
+    """on_text for --output: streamed deltas become jsonl delta records, json waits for the reply"""
+    if not (stream and output == "jsonl"):
+        return None
+
+    def on_text(text: str) -> None:
+        write_record({"type": "delta", "text": text}, output)
+    return on_text
+
+def send_turn(claude_cli: ClaudeCLI, message: str, model: str, max_tokens: int,
+              system_prompt: Optional[str], stream: bool,
+              race: Optional[List[str]] = None,
+              compare: Optional[List[str]] = None,
+              cancel: Optional["threading.Event"] = None) -> Dict[str, Any]:
+    """send one turn to a model, a --race of models or a --compare of models"""
+    if compare:
+        return claude_cli.compare(message, compare, max_tokens, system_prompt, cancel=cancel)
+    on_text = print_stream_delta if stream else None
+    if stream:
+        print(Fore.WHITE, end="", flush=True)
+    if race:
+        response = claude_cli.race(message, race, max_tokens, system_prompt, on_text, cancel)
+    else:
+        response = claude_cli.send_message(message, model, max_tokens, system_prompt,
+                                           stream=stream, on_text=on_text, cancel=cancel)
+    if stream:
+        print(Style.RESET_ALL)
+    return response
+
+def print_stats(request_stats: stats.Stats, file: Any = None) -> None:
+    print(f"{Fore.CYAN}{Style.DIM}{request_stats.format()}{Style.RESET_ALL}", file=file)
+
+def print_warming(warmer: "CacheWarmer", file: Any = None) -> None:
+    print(f"{Fore.CYAN}{Style.DIM}{warmer.format()}{Style.RESET_ALL}", file=file)
+
+def finish_stats(request_stats: stats.Stats, show: bool) -> None:
+    """write the --stats-file export and print the --stats report at exit"""
+    request_stats.close()
+    if show and request_stats.counts["requests"]:
+        print_stats(request_stats, file=sys.stderr)
+
+def print_stream_delta(text: str) -> None:
+    """write a streamed text delta without waiting for a newline"""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def print_context(claude_cli: ClaudeCLI) -> None:
+    """show how much of the context budget the conversation uses"""
+    summary = claude_cli.context.describe(claude_cli.conversation_history)
+    budget = f"{summary['budget']:,}" if summary["budget"] else "unlimited"
+    print_info(f"History: {summary['messages']} messages, ~{summary['tokens']:,} tokens")
+    print_info(f"Last request: {summary['window_messages']} messages, ~{summary['window_tokens']:,} tokens")
+    print_info(f"Budget: {budget} tokens ({summary['strategy']})")
+    if summary["summarized"]:
+        print_info(f"Summarized: oldest {summary['summarized']} messages")
+
+def print_sessions(session_store: "SessionStore") -> None:
+    """the most recent sessions, for /sessions"""
+    rows = session_store.list()
+    if not rows:
+        print_info("No saved sessions")
+    for row in rows:
+        updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["updated"]))
+        print(f"  {Fore.MAGENTA}{row['name']}{Style.RESET_ALL}  {updated}  "
+              f"{row['turns']:>4} msgs  {row['title']}")
+
+def print_search(session_store: "SessionStore", query: str) -> None:
+    """turns matching a /search query, best first"""
+    results = session_store.search(query)
+    if not results:
+        print_info(f"No turns match '{query}'")
+    for result in results:
+        print(f"  {Fore.MAGENTA}{result['name']}{Style.RESET_ALL} #{result['turn']} "
+              f"{result['role']}: {result['snippet']}")
+
+class TurnWorker:
+    """
+    runs interactive turns one at a time on a daemon thread, so the prompt keeps
+    reading input while a reply streams: lines typed meanwhile are queued, and
+    Ctrl-C cancels only the turn in flight
+    """
+
+    def __init__(self, run: Callable[[str, "threading.Event"], None]) -> None:
+        """
+        args:
+            run: sends one message, giving up once the event is set
+        """
+        import queue
+        import threading
+
+        self.run = run
+        self.pending: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.lock = threading.Lock()
+        self.current: Optional["threading.Event"] = None
+        # turns submitted and not yet done
+        self.outstanding = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    @property
+    def busy(self) -> bool:
+        """whether a turn is in flight or queued"""
+        return self.outstanding > 0
+
+    def _work(self) -> None:
+        import threading
+
+        while True:
+            message = self.pending.get()
+            if message is None:
+                self.pending.task_done()
+                return
+            with self.lock:
+                self.current = None if self.stopped else threading.Event()
+            try:
+                if self.current is not None:
+                    self.run(message, self.current)
+            except Exception as e:
+                print_error(str(e))
+            finally:
+                with self.lock:
+                    self.current = None
+                    self.outstanding -= 1
+                self.pending.task_done()
+
+    def submit(self, message: str) -> None:
+        with self.lock:
+            self.outstanding += 1
+        self.pending.put(message)
+
+    def cancel(self) -> bool:
+        """cancel the turn in flight, keeping queued ones; False if there is none"""
+        with self.lock:
+            if self.current is None or self.current.is_set():
+                return False
+            self.current.set()
+            return True
+
+    def wait(self) -> None:
+        """block until every queued turn is done; Ctrl-C meanwhile cancels the turn in flight"""
+        while True:
+            try:
+                self.pending.join()
+                return
+            except KeyboardInterrupt:
+                if not self.cancel():
+                    raise
+                print_warning(config.ERROR_MESSAGES["request_cancelled"].capitalize())
+
+    def close(self) -> None:
+        """stop the thread once the queued turns are done"""
+        self.pending.put(None)
+        self.wait()
+
+    def stop(self) -> None:
+        """cancel the turn in flight and drop the queued ones, without waiting"""
+        with self.lock:
+            self.stopped = True
+            if self.current is not None:
+                self.current.set()
+        self.pending.put(None)
 
 def interactive_mode(claude_cli: ClaudeCLI, model: str, max_tokens: int,
-                      system_prompt: Optional[str] = None) -> None:
-    """use interactive mode"""
+                      system_prompt: Optional[str] = None, stream: bool = True,
+                      race: Optional[List[str]] = None,
+                      compare: Optional[List[str]] = None,
+                      session_store: Optional["SessionStore"] = None,
+                      warmer: Optional["CacheWarmer"] = None) -> None:
+    """
+    use interactive mode, streaming replies by default
+    args:
+        race: models to race each turn, keeping the first to stream
+        compare: models to ask each turn side by side; the first continues the conversation
+        session_store: every conversation is written to a new or resumed session in it
+        warmer: keeps the prompt cache warm for the next turn while the user types
+    """
     print(f"{config.CLI_NAME} - Interactive Mode")
 
     # added color 
@@ -140,23 +947,86 @@ def interactive_mode(claude_cli: ClaudeCLI, model: str, max_tokens: int,
     print(f"  {Fore.MAGENTA}clear{Style.RESET_ALL} - Clear Conversation History")
     print(f"  {Fore.MAGENTA}save <filename>{Style.RESET_ALL} - Save conversation")
     print(f"  {Fore.MAGENTA}load <filename>{Style.RESET_ALL} - Load conversation")
+    print(f"  {Fore.MAGENTA}/context{Style.RESET_ALL} - Show conversation size and context budget")
+    print(f"  {Fore.MAGENTA}/stats{Style.RESET_ALL} - Show request latency and token stats")
+    if session_store is not None:
+        print(f"  {Fore.MAGENTA}/sessions{Style.RESET_ALL} - List saved sessions")
+        print(f"  {Fore.MAGENTA}/resume <name>{Style.RESET_ALL} - Continue a saved session")
+        print(f"  {Fore.MAGENTA}/search <query>{Style.RESET_ALL} - Search every saved session")
     print_separator()    
  
     if system_prompt:
         print(f"{Fore.YELLOW}{Style.BRIGHT}System prompt: {Style.RESET_ALL}{system_prompt}")
         print_separator()
     
+    prompt = f"\n{Fore.GREEN}{Style.BRIGHT}You: {Style.RESET_ALL}"
+
+    def answer(message: str, cancel: "threading.Event") -> None:
+        if session_store is not None and claude_cli.chat_session is None:
+            # a new, cleared or loaded conversation starts a new session
+            claude_cli.attach_session(session_store.new())
+
+        print(f"\n{Fore.BLUE}{Style.BRIGHT}Claude: {Style.RESET_ALL}", end="", flush=True)
+        warmed = warmer.pause() if warmer is not None else False
+        response = send_turn(claude_cli, message, model, max_tokens, system_prompt,
+                             stream, race, compare, cancel)
+        if warmer is not None:
+            if not cancel.is_set():
+                warmer.record(response, warmed)
+            # the history has a new turn to warm, or the old one to keep warm
+            warmer.schedule()
+
+        if cancel.is_set():
+            # reported by the prompt; the turn is not in the history
+            pass
+        elif compare:
+            print_comparison(response, claude_cli.cache)
+        elif response["success"]:
+            if not stream:
+                print(f"{Fore.WHITE}{response['message']}{Style.RESET_ALL}")
+            if response.get("usage"):
+                print(format_usage(response, claude_cli.cache))
+            if race:
+                print(format_race(response))
+        else:
+            print(f"Error: {response['error']}")
+        if worker.pending.empty():
+            # the prompt shown while this turn ran has scrolled away
+            print(prompt, end="", flush=True)
+
+    commands = {config.INTERACTIVE_COMMANDS[name] for name in
+                ("save", "load", "context", "stats", "sessions", "resume", "search")}
+    commands.update(config.INTERACTIVE_COMMANDS["clear"])
+    worker = TurnWorker(answer)
+    if warmer is not None:
+        # the system prompt or a loaded conversation is cached while the first prompt is typed
+        warmer.schedule()
     while True:
         try:
-            user_input = input(f"\n{Fore.GREEN}{Style.BRIGHT}You: {Style.RESET_ALL}").strip()
+            # while a turn is in flight the worker shows the prompt once it is done
+            user_input = input("" if worker.busy else prompt).strip()
             
             if user_input.lower() in config.INTERACTIVE_COMMANDS["quit"]:
+                worker.close()
                 print_success("Goodbye!")
                 break
+
+            if not user_input:
+                continue
+
+            command, _, argument = user_input.partition(" ")
+            if command.lower() not in commands:
+                worker.submit(user_input)
+                continue
+
+            # commands see the conversation as it is after the turns typed before them
+            worker.wait()
                 
             if user_input.lower() == config.INTERACTIVE_COMMANDS["clear"][0]:
                 claude_cli.clear_conversation()
                 print("Conversation cleared")
+                if warmer is not None:
+                    warmer.schedule()
                 continue
                 
             if user_input.lower().startswith(f'{config.INTERACTIVE_COMMANDS["save"]} '):
@@ -169,32 +1039,67 @@ def interactive_mode(claude_cli: ClaudeCLI, model: str, max_tokens: int,
                 filename = user_input[5:].strip()
                 if claude_cli.load_conversation(filename):
                     print(f"Conversation loaded from {filename}")
+                    if warmer is not None:
+                        warmer.schedule()
                 continue
                 
-            if not user_input:
+            if user_input.lower() == config.INTERACTIVE_COMMANDS["context"]:
+                print_context(claude_cli)
                 continue
-                
-            print("\n{Fore.BLUE}{Style.BRIGHT}Claude: {Style.RESET_ALL}", end="", flush=True)
-            response = claude_cli.send_message(user_input, model, max_tokens, system_prompt)
-            
-            if response["success"]:
-                print(f"{Fore.WHITE}{response['message']}{Style.RESET_ALL}")
-                if response.get("usage"):
-                    usage = response["usage"]
-                    print(f"\n{Fore.CYAN}{Style.DIM}[Tokens - Input: {usage.get('input_tokens', 'N/A')}, "
-                          f"Output: {usage.get('output_tokens', 'N/A')}]{Style.RESET_ALL}")
-            else:
-                print(f"Error: {response['error']}")
+
+            if user_input.lower() == config.INTERACTIVE_COMMANDS["stats"]:
+                print_stats(claude_cli.stats)
+                if warmer is not None:
+                    print_warming(warmer)
+                continue
+
+            if session_store is not None and command.lower() in (
+                    config.INTERACTIVE_COMMANDS["sessions"], config.INTERACTIVE_COMMANDS["resume"],
+                    config.INTERACTIVE_COMMANDS["search"]):
+                if command.lower() == config.INTERACTIVE_COMMANDS["sessions"]:
+                    print_sessions(session_store)
+                elif command.lower() == config.INTERACTIVE_COMMANDS["search"]:
+                    print_search(session_store, argument.strip())
+                else:
+                    try:
+                        claude_cli.resume_session(session_store.open(argument.strip()))
+                        print_success(config.SUCCESS_MESSAGES["session_resumed"].format(
+                            argument.strip(), len(claude_cli.chat_session)))
+                        if warmer is not None:
+                            warmer.schedule()
+                    except ValueError as e:
+                        print_error(str(e))
+                continue
+
+            # not a command after all, e.g. "save" without a file name
+            worker.submit(user_input)
                 
         except KeyboardInterrupt:
+            if worker.cancel():
+                # only the reply in flight is abandoned; the session goes on
+                print_warning(f"\n{config.ERROR_MESSAGES['request_cancelled'].capitalize()}")
+                continue
+            worker.stop()
             print(f"\n\n{Fore.YELLOW}Interrupted by user. Goodbye!{Style.RESET_ALL}")
             break
         except EOFError:
+            try:
+                # piped input: answer what was read before exiting
+                worker.close()
+            except KeyboardInterrupt:
+                pass
             print(f"\n{Fore.YELLOW}Goodbye!{Style.RESET_ALL}")
             break
+    if warmer is not None:
+        warmer.close()
+        if warmer.summary()["requests"]:
+            print_warming(warmer)
 
 def single_message_mode(claude_cli: ClaudeCLI, message: str, model: str, 
-                       max_tokens: int, system_prompt: Optional[str] = None) -> None:
+                       max_tokens: int, system_prompt: Optional[str] = None,
+                       stream: bool = False, race: Optional[List[str]] = None,
+                       compare: Optional[List[str]] = None,
+                       output: str = config.OUTPUT_FORMAT) -> None:
     """
     send a single message and print the response. One-off queries
 
@@ -204,33 +1109,331 @@ def single_message_mode(claude_cli: ClaudeCLI, message: str, model: str,
         model:
         max_tokens:
         system_prompt:
+        stream: print text as it arrives instead of after the full response
+        race: models to send to at once, printing the first to stream
+        compare: models to send to at once, printing every reply
+        output: text, or json/jsonl records on stdout without colors
     exit codes:
         0; success
         1. error occurred 
     """
-    response = claude_cli.send_message(message, model, max_tokens, system_prompt)
-    
+    if output != config.OUTPUT_FORMAT:
+        structured_message_mode(claude_cli, message, model, max_tokens, system_prompt, stream,
+                                race, compare, output)
+        return
+
+    response = send_turn(claude_cli, message, model, max_tokens, system_prompt, stream,
+                         race, compare)
+    if compare:
+        print_comparison(response, claude_cli.cache)
+        if not response["success"]:
+            sys.exit(1)
+        return
+
     if response["success"]:
-        print(f"{Fore.WHITE}{response['message']}{Style.RESET_ALL}")
+        if not stream:
+            print(f"{Fore.WHITE}{response['message']}{Style.RESET_ALL}")
         if response.get("usage"):
-            usage = response["usage"]
-            print(f"\n{Fore.CYAN}{Style.DIM}[Tokens - Input: {usage.get('input_tokens', 'N/A')}, "
-                  f"Output: {usage.get('output_tokens', 'N/A')}]{Style.RESET_ALL}", file=sys.stderr)
+            print(format_usage(response, claude_cli.cache), file=sys.stderr)
+        if race:
+            print(format_race(response), file=sys.stderr)
     else:
         #print(f"Error: {response['error']}", file=sys.stderr)
         print_error(response['error'])
         sys.exit(1)
 
+def structured_message_mode(claude_cli: ClaudeCLI, message: str, model: str, max_tokens: int,
+                            system_prompt: Optional[str], stream: bool,
+                            race: Optional[List[str]], compare: Optional[List[str]],
+                            output: str) -> None:
+    """
+    send a single message and print --output json/jsonl records. with jsonl and
+    streaming, each text delta is a {"type": "delta"} line as it arrives,
+    followed by the {"type": "message"} record
+
+    exit codes:
+        0; success
+        1. error occurred, reported as a {"type": "error"} record
+    """
+    on_text = record_writer(output, stream)
+    if compare:
+        response = claude_cli.compare(message, compare, max_tokens, system_prompt)
+        records = [output_record(result) for result in response["results"]]
+        if output == "json":
+            write_record({"type": "comparison", "results": records}, output)
+        else:
+            for record in records:
+                write_record(record, output)
+    else:
+        if race:
+            response = claude_cli.race(message, race, max_tokens, system_prompt, on_text)
+        else:
+            response = claude_cli.send_message(message, model, max_tokens, system_prompt,
+                                               stream=stream, on_text=on_text)
+        write_record(output_record(response), output)
+    if not response["success"]:
+        sys.exit(1)
+
+def map_reduce_mode(claude_cli: ClaudeCLI, file_path: str, task: str, model: str,
+                    max_tokens: int, system_prompt: Optional[str] = None,
+                    stream: bool = False, concurrency: int = config.BATCH_CONCURRENCY,
+                    chunk_tokens: int = config.CHUNK_TOKENS,
+                    overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS,
+                    boundary: str = config.CHUNK_BOUNDARY,
+                    output: str = config.OUTPUT_FORMAT) -> None:
+    """
+    answer a task about a file too large for one request by sending its chunks
+    concurrently and combining the answers. progress goes to stderr, and a run
+    that fails or is interrupted continues where it stopped when run again.
+
+    exit codes:
+        0; success
+        1. a chunk or the final answer failed
+    """
+    from chunker import map_reduce
+
+    def progress(stage: str, done: int, total: int) -> None:
+        end = "\n" if done == total else ""
+        print(f"\r{Fore.CYAN}{Style.DIM}[{stage}: {done}/{total} chunks]{Style.RESET_ALL}",
+              end=end, file=sys.stderr, flush=True)
+
+    structured = output != config.OUTPUT_FORMAT
+    on_text = record_writer(output, stream) if structured else print_stream_delta
+    if stream and not structured:
+        print(Fore.WHITE, end="", flush=True)
+    try:
+        response = map_reduce(claude_cli, file_path, task, model, max_tokens, system_prompt,
+                              chunk_tokens, overlap_tokens, boundary, concurrency,
+                              stream=stream, on_text=on_text if stream else None,
+                              on_progress=progress)
+    except UnicodeDecodeError:
+        print_error(config.ERROR_MESSAGES["invalid_encoding"].format(file_path))
+        sys.exit(1)
+    if stream and not structured:
+        print(Style.RESET_ALL)
+
+    if response["success"]:
+        claude_cli.record_turn(f"{task}\n\n[{file_path}, {response['chunks']} chunks]",
+                               response["message"])
+    if structured:
+        write_record(output_record(response), output)
+    elif response["success"]:
+        if not stream:
+            print(f"{Fore.WHITE}{response['message']}{Style.RESET_ALL}")
+        if response.get("usage"):
+            print(format_usage(response, claude_cli.cache), file=sys.stderr)
+    else:
+        print_error(response["error"])
+    if not response["success"]:
+        sys.exit(1)
+
+def files_mode(claude_cli: ClaudeCLI, patterns: List[str], output_path: str, template: str,
+               model: str, max_tokens: int, system_prompt: Optional[str] = None,
+               concurrency: int = config.BATCH_CONCURRENCY,
+               output_dir: Optional[str] = None) -> None:
+    """
+    send every file matching the patterns through the template, concurrently.
+    files unchanged since the last run are skipped using the manifest kept
+    next to output_path.
+
+    exit codes:
+        0; every file succeeded
+        1. a file failed or no file matched
+    """
+    import files
+
+    try:
+        paths = files.expand_paths(patterns)
+    except ValueError as e:
+        print_error(str(e))
+        sys.exit(1)
+
+    def report(record: Dict[str, Any]) -> None:
+        if not record["success"]:
+            print_warning(f"{record['id']}: {record['error']}")
+
+    def unreadable(path: str) -> None:
+        print_warning(config.ERROR_MESSAGES["invalid_encoding"].format(path))
+
+    counts = files.run_files(claude_cli, paths, output_path, template, model, max_tokens,
+                             system_prompt, concurrency, output_dir, report, unreadable)
+    print_success(config.SUCCESS_MESSAGES["files_complete"].format(
+        counts["succeeded"], counts["failed"], counts["unchanged"], counts["unreadable"],
+        output_dir or output_path))
+    if counts["failed"]:
+        print_error(config.ERROR_MESSAGES["files_failed"].format(
+            counts["failed"], counts["succeeded"] + counts["failed"]))
+        sys.exit(1)
+
+def batch_mode(claude_cli: ClaudeCLI, batch_path: str, output_path: str, model: str,
+               max_tokens: int, system_prompt: Optional[str] = None,
+               concurrency: int = config.BATCH_CONCURRENCY, ordered: bool = True) -> None:
+    """
+    run every prompt in a batch file or directory and write JSONL results.
+    prompts that already succeeded in output_path are skipped, so an
+    interrupted run can be resumed by running the same command again.
+
+    exit codes:
+        0; every prompt succeeded
+        1. a prompt failed or the batch could not be read
+    """
+    import batch
+    from pathlib import Path
+
+    if not Path(batch_path).exists():
+        print_error(config.ERROR_MESSAGES["file_not_found"].format(batch_path))
+        sys.exit(1)
+
+    def report(record: Dict[str, Any]) -> None:
+        if not record["success"]:
+            print_warning(f"{record['id']}: {record['error']}")
+
+    try:
+        counts = batch.run_batch(claude_cli, batch.load_prompts(batch_path), output_path,
+                                 model, max_tokens, system_prompt, concurrency, ordered,
+                                 on_result=report)
+    except ValueError as e:
+        print_error(str(e))
+        sys.exit(1)
+
+    print_success(config.SUCCESS_MESSAGES["batch_complete"].format(
+        counts["succeeded"], counts["failed"], counts["skipped"], output_path))
+    if counts["failed"]:
+        print_error(config.ERROR_MESSAGES["batch_failed"].format(
+            counts["failed"], counts["succeeded"] + counts["failed"]))
+        sys.exit(1)
+
+def submit_batch_mode(claude_cli: ClaudeCLI, batch_path: str, output_path: str, model: str,
+                      max_tokens: int, system_prompt: Optional[str] = None) -> None:
+    """
+    submit every prompt in a batch file or directory to the Message Batches API.
+    prompts with a result in output_path or a pending batch are skipped.
+
+    exit codes:
+        0; every remaining prompt was submitted
+        1. the batch could not be read or a submission failed
+    """
+    import batch
+    import message_batches
+    import requests
+    from pathlib import Path
+
+    if not Path(batch_path).exists():
+        print_error(config.ERROR_MESSAGES["file_not_found"].format(batch_path))
+        sys.exit(1)
+
+    def report(submitted: Dict[str, Any]) -> None:
+        print_info(f"Submitted {submitted['id']} "
+                   f"({submitted['request_counts']['processing']} requests)")
+
+    batches = message_batches.MessageBatches(claude_cli, output_path)
+    try:
+        counts = batches.submit(batch.load_prompts(batch_path), model, max_tokens,
+                                system_prompt, on_submit=report)
+    except ValueError as e:
+        print_error(str(e))
+        sys.exit(1)
+    except requests.exceptions.RequestException as e:
+        print_error(config.ERROR_MESSAGES["api_request_failed"].format(e))
+        sys.exit(1)
+    print_success(config.SUCCESS_MESSAGES["batches_submitted"].format(
+        counts["submitted"], counts["batches"], counts["skipped"], output_path))
+
+def collect_batch_mode(claude_cli: ClaudeCLI, output_path: str) -> None:
+    """
+    wait for the batches submitted for output_path and append their results
+
+    exit codes:
+        0; every prompt succeeded
+        1. nothing to collect, a prompt failed or polling failed
+    """
+    import message_batches
+    import requests
+
+    batches = message_batches.MessageBatches(claude_cli, output_path)
+    if not batches.pending():
+        print_error(config.ERROR_MESSAGES["no_pending_batches"].format(output_path))
+        sys.exit(1)
+
+    def status(batch: Dict[str, Any]) -> None:
+        counts = ", ".join(f"{name} {count}" for name, count in batch["request_counts"].items())
+        print_info(f"{batch['id']}: {batch['processing_status']} ({counts})")
+
+    def report(record: Dict[str, Any]) -> None:
+        if not record["success"]:
+            print_warning(f"{record['id']}: {record['error']}")
+
+    try:
+        counts = batches.collect(on_result=report, on_status=status)
+    except requests.exceptions.RequestException as e:
+        print_error(config.ERROR_MESSAGES["api_request_failed"].format(e))
+        sys.exit(1)
+    print_success(config.SUCCESS_MESSAGES["batch_complete"].format(
+        counts["succeeded"], counts["failed"], counts["skipped"], output_path))
+    if counts["failed"]:
+        print_error(config.ERROR_MESSAGES["batch_failed"].format(
+            counts["failed"], counts["succeeded"] + counts["failed"]))
+        sys.exit(1)
+
+def daemon_mode(claude_cli: ClaudeCLI, socket_path: str) -> None:
+    """
+    keep claude_cli warm behind a unix socket until stopped
+
+    exit codes:
+        0; stopped with --stop-daemon, Ctrl+C or SIGTERM
+        1. the socket is taken by a running daemon
+    """
+    import signal
+    import daemon
+
+    server = daemon.Daemon(claude_cli, socket_path)
+    # SIGTERM unwinds like Ctrl+C, so the socket is removed either way
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    claude_cli.prewarm()
+    try:
+        server.start()
+    except ValueError as e:
+        print_error(str(e))
+        sys.exit(1)
+    print_success(config.SUCCESS_MESSAGES["daemon_started"].format(socket_path))
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print_info(config.SUCCESS_MESSAGES["daemon_stopped"].format(socket_path))
+
+def exceeds_budget(path: str, budget: int) -> bool:
+    """whether a -f file is estimated to need more tokens than the context budget, 0 for no limit"""
+    return bool(budget) and os.path.isfile(path) and os.path.getsize(path) > budget * config.CHARS_PER_TOKEN
+
+def client_options_set(parser: "argparse.ArgumentParser", args: "argparse.Namespace") -> List[str]:
+    """client settings given on the command line, which a running daemon would ignore"""
+    return [dest for dest in config.DAEMON_CLIENT_OPTIONS
+            if getattr(args, dest) != parser.get_default(dest)]
+
 def main() -> None:
+    import argparse
+
     parser = argparse.ArgumentParser(
         description=config.CLI_DESCRIPTION,
         formatter_class= argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
   %(prog)s -i                                    # Interactive mode
+  %(prog)s -i --resume 20250101-093000           # Continue a saved session
   %(prog)s -m "Hello, Claude!"                   # Single message
   %(prog)s -f input.txt                          # Read from file
+  %(prog)s -f huge.log --task "List the errors"  # Map-reduce over a file of any size
+  %(prog)s -f "src/**/*.py" --template "Review {path}:\n{content}" --output-dir reviews
   %(prog)s -m "Explain this code" --system "You are a code reviewer"
+  %(prog)s -m "Write a haiku" --stream           # Print the reply as it arrives
+  %(prog)s -i --race MODEL_A,MODEL_B             # Keep whichever model answers first
+  %(prog)s --batch prompts.jsonl --concurrency 8 # Run many prompts in parallel
+  %(prog)s --submit-batch prompts.jsonl          # Queue prompts on the Message Batches API
+  %(prog)s --collect-batch                       # Wait for them and write the results
+  %(prog)s --daemon &                            # Keep a warm client for later -m calls
         """
     )
     
@@ -246,7 +1449,118 @@ Examples:
                         help="Maximum tokens in response (default: %(default)d)")
     parser.add_argument("--system",
                         help="System prompt to guide the AI behavior")
+    parser.add_argument("--stream",
+                        dest="stream",
+                        action="store_true",
+                        default=None,
+                        help="Stream the reply as it is generated (default in interactive mode)")
+    parser.add_argument("--no-stream",
+                        dest="stream",
+                        action="store_false",
+                        help="Wait for the full reply before printing")
+    models_group = parser.add_mutually_exclusive_group()
+    models_group.add_argument("--race",
+                        metavar="MODELS",
+                        help="Send each message to these comma separated models at once, keep "
+                             "the first to stream and cancel the rest (-m, -f and -i)")
+    models_group.add_argument("--compare",
+                        metavar="MODELS",
+                        help="Send each message to these comma separated models at once and show "
+                             "every reply; the first continues the conversation (-m, -f and -i)")
+    parser.add_argument("--raw",
+                        action="store_true",
+                        help=f"Plain output without colors (also when piped or {config.NO_COLOR_ENV_VAR} is set)")
+    parser.add_argument("--output",
+                        choices=config.OUTPUT_FORMATS,
+                        default=config.OUTPUT_FORMAT,
+                        help="How -m and -f print the reply: text, one JSON record (json), or JSON lines "
+                             "with a record per streamed delta (jsonl) (default: %(default)s)")
+
+    # connection
+    parser.add_argument("--pool-size",
+                        type=int,
+                        default=config.POOL_MAXSIZE,
+                        help="Maximum pooled connections to the API (default: %(default)d)")
+    parser.add_argument("--connect-timeout",
+                        type=float,
+                        default=config.CONNECT_TIMEOUT,
+                        help="Seconds to wait for a connection (default: %(default)s)")
+    parser.add_argument("--read-timeout",
+                        type=float,
+                        default=config.READ_TIMEOUT,
+                        help="Seconds to wait for response data (default: %(default)s)")
+    parser.add_argument("--no-keep-alive",
+                        dest="keep_alive",
+                        action="store_false",
+                        default=config.KEEP_ALIVE,
+                        help="Close the connection after every request")
+    parser.add_argument("--no-prewarm",
+                        dest="prewarm",
+                        action="store_false",
+                        default=config.PREWARM_CONNECTION,
+                        help="Don't open the API connection before the first prompt")
+
+    # retries and rate limits
+    parser.add_argument("--max-retries",
+                        type=int,
+                        default=config.MAX_RETRIES,
+                        help="Retries for rate limited or failed requests (default: %(default)d)")
+    parser.add_argument("--rpm",
+                        type=float,
+                        default=config.RATE_LIMIT_RPM,
+                        help="Client-side limit on requests per minute")
+    parser.add_argument("--tpm",
+                        type=float,
+                        default=config.RATE_LIMIT_TPM,
+                        help="Client-side limit on input tokens per minute")
     
+    parser.add_argument("--no-prompt-cache",
+                        dest="prompt_cache",
+                        action="store_false",
+                        default=config.PROMPT_CACHE_ENABLED,
+                        help="Don't mark the system prompt and history as cacheable by the API")
+    parser.add_argument("--warm-cache",
+                        action="store_true",
+                        default=config.WARM_CACHE_ENABLED,
+                        help="Interactive mode: cache the conversation for the next turn while you type, "
+                             "and keep it cached while idle")
+    parser.add_argument("--warm-budget",
+                        type=int,
+                        default=config.WARM_BUDGET_TOKENS,
+                        help="Stop warming after this many input-token equivalents (default: %(default)d)")
+
+    # context window
+    parser.add_argument("--context-budget",
+                        type=int,
+                        default=config.CONTEXT_BUDGET,
+                        help="Max estimated input tokens per request, 0 for no limit (default: %(default)d)")
+    parser.add_argument("--context-strategy",
+                        choices=config.CONTEXT_STRATEGIES,
+                        default=config.CONTEXT_STRATEGY,
+                        help="How to shrink history past the budget (default: %(default)s)")
+
+    # response cache
+    parser.add_argument("--cache",
+                        dest="cache",
+                        action="store_true",
+                        default=None,
+                        help=f"Reuse stored replies to identical requests (or set {config.CACHE_ENV_VAR}=1)")
+    parser.add_argument("--no-cache",
+                        dest="cache",
+                        action="store_false",
+                        default=None,
+                        help="Don't read or write the response cache")
+    parser.add_argument("--refresh",
+                        action="store_true",
+                        help="Ignore cached replies but store the new ones")
+    parser.add_argument("--cache-dir",
+                        default=config.CACHE_DIR,
+                        help="Response cache directory (default: %(default)s)")
+    parser.add_argument("--cache-ttl",
+                        type=float,
+                        default=config.CACHE_TTL,
+                        help="Seconds a cached reply stays valid (default: %(default)d)")
+
     # input
     input_group = parser.add_mutually_exclusive_group(required=True)
     input_group.add_argument("--interactive", "-i",
@@ -255,36 +1569,244 @@ Examples:
     input_group.add_argument("--message", "-m",
                         help="Send a single message and exit")
     input_group.add_argument("--file", "-f",
-                        help="Read message from file and send")
+                        nargs="+",
+                        metavar="PATH",
+                        help="Read message from file and send; several files, globs or "
+                             "directories send each file through --template")
+    input_group.add_argument("--batch",
+                        help="Send every prompt in a JSONL file or directory of prompt files")
+    input_group.add_argument("--submit-batch",
+                        metavar="BATCH",
+                        help="Submit the prompts of a batch file or directory to the Message Batches API")
+    input_group.add_argument("--collect-batch",
+                        action="store_true",
+                        help="Wait for submitted Message Batches and append their results to --batch-output")
+    input_group.add_argument("--daemon",
+                        action="store_true",
+                        help="Keep a warm client listening on --socket for -m/-f calls")
+    input_group.add_argument("--stop-daemon",
+                        action="store_true",
+                        help="Stop the daemon listening on --socket")
+
+    # instrumentation
+    parser.add_argument("--stats",
+                        action="store_true",
+                        help="Print request latency percentiles and token throughput at exit")
+    parser.add_argument("--stats-file",
+                        help=f"Export per-request stats as JSONL, or as Prometheus text "
+                             f"if the name ends in {config.STATS_PROMETHEUS_SUFFIX}")
+
+    # daemon mode
+    parser.add_argument("--socket",
+                        default=os.getenv(config.DAEMON_SOCKET_ENV_VAR, config.DAEMON_SOCKET),
+                        help=f"Daemon socket (or set {config.DAEMON_SOCKET_ENV_VAR}; default: %(default)s)")
+    parser.add_argument("--no-daemon",
+                        dest="use_daemon",
+                        action="store_false",
+                        help="Don't forward -m/-f to a running daemon")
+
+    # batch mode
+    parser.add_argument("--batch-output",
+                        default=config.BATCH_OUTPUT_FILE,
+                        help="JSONL file batch results are appended to; submitted Message Batches "
+                             "are tracked next to it (default: %(default)s)")
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=config.BATCH_CONCURRENCY,
+                        help="Batch requests in flight at once (default: %(default)d)")
+    parser.add_argument("--order",
+                        choices=["input", "completion"],
+                        default="input",
+                        help="Write batch results in input or completion order (default: %(default)s)")
+
+    # file input
+    parser.add_argument("--template",
+                        help="Message for each -f file, with {path} and {content} placeholders "
+                             "(default: the file content)")
+    parser.add_argument("--output-dir",
+                        help="With several -f files, also write each reply to "
+                             f"<dir>/<file path>{config.FILE_OUTPUT_SUFFIX}")
+    parser.add_argument("--task",
+                        default=config.DEFAULT_TASK,
+                        help="What to do with a -f file too large for one request (default: %(default)s)")
+    parser.add_argument("--chunk-tokens",
+                        type=int,
+                        default=config.CHUNK_TOKENS,
+                        help="Size of the chunks a -f file over the context budget is split into "
+                             "and map-reduced, in estimated tokens (default: %(default)d)")
+    parser.add_argument("--chunk-overlap",
+                        type=int,
+                        default=config.CHUNK_OVERLAP_TOKENS,
+                        help="Estimated tokens each chunk repeats from the previous one (default: %(default)d)")
+    parser.add_argument("--chunk-boundary",
+                        choices=config.CHUNK_BOUNDARIES,
+                        default=config.CHUNK_BOUNDARY,
+                        help="Split chunks between lines or paragraphs (default: %(default)s)")
 
     # load /save convo
+    parser.add_argument("--conversation",
+                        metavar="NAME",
+                        help=f"Continue a named conversation kept in {config.CONVERSATIONS_DIR}")
+    parser.add_argument("--resume",
+                        metavar="NAME",
+                        help="Continue a saved session (see /sessions in interactive mode)")
+    parser.add_argument("--no-sessions",
+                        dest="sessions",
+                        action="store_false",
+                        default=config.SESSIONS_ENABLED,
+                        help="Don't save interactive conversations as searchable sessions")
     parser.add_argument("--load",
-                        help="Load conversation from file")
+                        help="Load conversation from file (a .jsonl file is continued)")
     parser.add_argument("--save",
-                        help="Save conversation to file after completion")
+                        help="Save conversation to file after completion "
+                             "(a .jsonl file is appended to after every turn)")
     
     args = parser.parse_args()
+    structured = args.output != config.OUTPUT_FORMAT
+    # with --output json/jsonl, stdout carries only the records
+    status = sys.stderr if structured else sys.stdout
+    setup_colors(sys.stdout.isatty() and not args.raw and not structured
+                 and not os.getenv(config.NO_COLOR_ENV_VAR))
+
+    if args.stop_daemon:
+        import daemon
+
+        if not daemon.stop(args.socket):
+            print(config.ERROR_MESSAGES["daemon_not_running"].format(args.socket), file=sys.stderr)
+            sys.exit(1)
+        print(config.SUCCESS_MESSAGES["daemon_stopped"].format(args.socket))
+        return
 
     try:
-        #init. claude cli
-        claude_cli = ClaudeCLI(args.api_key)
+        race = distinct_models(args.race.split(",")) if args.race else None
+        compare = distinct_models(args.compare.split(",")) if args.compare else None
+        # several files, a glob or a directory are sent file by file
+        multi_file = False
+        if args.file:
+            import files
+            multi_file = len(args.file) > 1 or files.is_pattern(args.file[0])
+        if args.file and not multi_file:
+            args.file = args.file[0]
+        request_stats = stats.Stats(args.stats_file)
+        # a -f file too large for one request is map-reduced in chunks
+        chunked = bool(args.file) and not multi_file and exceeds_budget(args.file, args.context_budget)
+        if args.stats or args.stats_file:
+            import atexit
+            atexit.register(finish_stats, request_stats, args.stats)
+
+        claude_cli = None
+        # scripted one-off calls go to a running daemon, skipping client setup;
+        # options that act on local files, another key, several models or client
+        # settings other than the daemon's stay in-process
+        if ((args.message or args.file) and args.use_daemon
+                and not (args.api_key or args.load or args.save or race or compare or chunked
+                         or multi_file or args.resume or client_options_set(parser, args))):
+            from daemon import DaemonClient
+            claude_cli = DaemonClient.connect(args.socket, args.conversation, request_stats)
+
+        if claude_cli is None:
+            #init. claude cli
+            use_cache = args.cache
+            if use_cache is None:
+                use_cache = config.CACHE_ENABLED or os.getenv(config.CACHE_ENV_VAR) == "1"
+            response_cache = None
+            if use_cache:
+                from cache import ResponseCache
+                response_cache = ResponseCache(args.cache_dir, args.cache_ttl, refresh=args.refresh)
+
+            pool_size = (max(args.pool_size, args.concurrency) if args.batch or chunked or multi_file
+                         else args.pool_size)
+            claude_cli = ClaudeCLI(args.api_key, pool_size=pool_size,
+                                   keep_alive=args.keep_alive,
+                                   connect_timeout=args.connect_timeout,
+                                   read_timeout=args.read_timeout,
+                                   max_retries=args.max_retries,
+                                   requests_per_minute=args.rpm,
+                                   tokens_per_minute=args.tpm,
+                                   cache=response_cache,
+                                   prompt_cache=args.prompt_cache,
+                                   context_budget=args.context_budget,
+                                   context_strategy=args.context_strategy,
+                                   request_stats=request_stats)
+
+            # a named conversation is a store that is continued turn by turn
+            if args.conversation:
+                path = conversation_path(args.conversation)
+                opened = (claude_cli.load_conversation(path) if os.path.exists(path)
+                          else claude_cli.attach_store(path))
+                if not opened:
+                    print(config.ERROR_MESSAGES["conversation_load_failed"].format(path),
+                          file=sys.stderr)
+                    sys.exit(1)
  
+        session_store = None
+        if args.resume or (args.interactive and args.sessions):
+            from sessions import SessionStore
+            session_store = SessionStore()
+        if args.resume:
+            claude_cli.resume_session(session_store.open(args.resume))
+            print(config.SUCCESS_MESSAGES["session_resumed"].format(
+                args.resume, len(claude_cli.chat_session)), file=sys.stderr)
+
         # load convo if specified
         if args.load:
-            print(f"Loading conversation from {args.load}...")
+            print(f"Loading conversation from {args.load}...", file=status)
             if not claude_cli.load_conversation(args.load):
                 print(config.ERROR_MESSAGES["conversation_load_failed"].format(args.load),
                       file=sys.stderr)
                 sys.exit(1)
-            print(config.SUCCESS_MESSAGES["conversation_loaded"].format(args.load))
+            print(config.SUCCESS_MESSAGES["conversation_loaded"].format(args.load), file=status)
+
+        # a .jsonl save target is written turn by turn instead of at the end
+        if args.save and is_store_file(args.save):
+            if not claude_cli.attach_store(args.save):
+                print(config.ERROR_MESSAGES["conversation_save_failed"].format(args.save),
+                      file=sys.stderr)
+                sys.exit(1)
 
         # route to appro mode
         if args.interactive:
-            interactive_mode(claude_cli, args.model, args.max_tokens, args.system)
+            # handshake while the user types their first prompt
+            if args.prewarm:
+                claude_cli.prewarm()
+            warmer = None
+            if args.warm_cache:
+                if not args.prompt_cache:
+                    print_warning(config.ERROR_MESSAGES["warm_needs_prompt_cache"])
+                elif race or compare:
+                    print_warning(config.ERROR_MESSAGES["warm_single_model"])
+                else:
+                    from warmer import CacheWarmer
+                    warmer = CacheWarmer(claude_cli, args.model, args.system, args.warm_budget)
+            interactive_mode(claude_cli, args.model, args.max_tokens, args.system,
+                             stream=args.stream is not False, race=race, compare=compare,
+                             session_store=session_store, warmer=warmer)
         elif args.message:
             single_message_mode(claude_cli, args.message, args.model,
+                              args.max_tokens, args.system, stream=bool(args.stream),
+                              race=race, compare=compare, output=args.output)
+        elif args.daemon:
+            daemon_mode(claude_cli, args.socket)
+        elif args.submit_batch:
+            submit_batch_mode(claude_cli, args.submit_batch, args.batch_output, args.model,
                               args.max_tokens, args.system)
+        elif args.collect_batch:
+            collect_batch_mode(claude_cli, args.batch_output)
+        elif args.batch:
+            batch_mode(claude_cli, args.batch, args.batch_output, args.model,
+                       args.max_tokens, args.system, args.concurrency,
+                       ordered=args.order == "input")
+        elif multi_file:
+            files_mode(claude_cli, args.file, args.batch_output,
+                       args.template or config.FILE_TEMPLATE, args.model, args.max_tokens,
+                       args.system, args.concurrency, args.output_dir)
+        elif chunked:
+            map_reduce_mode(claude_cli, args.file, args.task, args.model, args.max_tokens,
+                            args.system, bool(args.stream), args.concurrency, args.chunk_tokens,
+                            args.chunk_overlap, args.chunk_boundary, args.output)
         elif args.file:
+            from pathlib import Path
+
             try:
                 file_path = Path(args.file)
                 if not file_path.exists():
@@ -298,9 +1820,13 @@ Examples:
                 if not message:
                     print(config.ERROR_MESSAGES["file_empty"], file=sys.stderr)
                     sys.exit(1)
+                if args.template:
+                    from files import render
+                    message = render(args.template, args.file, message)
 
                 single_message_mode(claude_cli, message, args.model,
-                                    args.max_tokens, args.system)
+                                    args.max_tokens, args.system, stream=bool(args.stream),
+                                    race=race, compare=compare, output=args.output)
             except UnicodeDecodeError:
                 print(config.ERROR_MESSAGES["invalid_encoding"])
 
@@ -308,14 +1834,15 @@ Examples:
                 print(f"Error reading file: {e}", file= sys.stderr)
                 sys.exit(1)
 
-            # save convo if needed
-            if args.save:
-                print(f"Saving conversation to {args.save}...")
-                if not claude_cli.save_conversation(args.save):
-                    print(config.ERROR_MESSAGES["conversation_save_failed"].format(args.save),
-                          file=sys.stderr)
-                    sys.exit(1)
-                print(config.SUCCESS_MESSAGES["conversation_saved"].format(args.save))
+        # save convo if needed
+        if args.save and not (args.batch or args.submit_batch or args.collect_batch or args.daemon
+                              or multi_file):
+            print(f"Saving conversation to {args.save}...", file=status)
+            if not claude_cli.save_conversation(args.save):
+                print(config.ERROR_MESSAGES["conversation_save_failed"].format(args.save),
+                      file=sys.stderr)
+                sys.exit(1)
+            print(config.SUCCESS_MESSAGES["conversation_saved"].format(args.save), file=status)
 
                 
     except ValueError as e:
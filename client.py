@@ -0,0 +1,253 @@
+"""
+Shared client state for claude cli
+
+ClaudeCLI and AsyncClaudeCLI differ only in how a request travels: on a
+pooled requests.Session from the calling thread, or on an aiohttp session
+from an event loop. BaseClient holds everything else they share: the api
+key, retry policy and rate limits, the response cache, request stats,
+building request bodies and result dicts, and the conversation with its
+context window, store and session. Steps that read or write files are
+private here, so each client can expose them as plain calls or coroutines.
+"""
+
+import os
+from typing import (TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple, Union)
+
+import config
+import stats
+from context import ContextManager
+from history import ConversationHistory
+from ratelimit import RateLimiter, RetryPolicy
+from store import ConversationStore, is_store_file
+
+if TYPE_CHECKING:
+    from sessions import Session
+
+
+def with_cache_control(content: Union[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    copy message or system content as content blocks whose last block is a
+    prompt-caching breakpoint
+    """
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": config.CACHE_CONTROL}]
+    if not content:
+        return content
+    return content[:-1] + [dict(content[-1], cache_control=config.CACHE_CONTROL)]
+
+
+class BaseClient:
+    def __init__(self, api_key: Optional[str] = None,
+                 connect_timeout: float = config.CONNECT_TIMEOUT,
+                 read_timeout: float = config.READ_TIMEOUT,
+                 max_retries: int = config.MAX_RETRIES,
+                 requests_per_minute: Optional[float] = config.RATE_LIMIT_RPM,
+                 tokens_per_minute: Optional[float] = config.RATE_LIMIT_TPM,
+                 cache: Optional[Any] = None,
+                 prompt_cache: bool = config.PROMPT_CACHE_ENABLED,
+                 context_budget: Optional[int] = config.CONTEXT_BUDGET,
+                 context_strategy: str = config.CONTEXT_STRATEGY,
+                 request_stats: Optional[stats.Stats] = None) -> None:
+        """
+        the state ClaudeCLI and AsyncClaudeCLI share; see ClaudeCLI for the arguments
+        raises:
+            ValueError: if there is no api key
+        """
+        self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
+
+        if not self.api_key:
+            raise ValueError(config.ERROR_MESSAGES["no_api_key"])
+
+        self.base_url = config.API_BASE_URL
+        self.headers = config.get_api_headers(self.api_key)
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = request_stats or stats.Stats()
+        self.retry_policy = RetryPolicy(max_retries)
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.cache = cache
+        self.prompt_cache = prompt_cache
+        self.context = ContextManager(context_budget, context_strategy, self._summarize)
+        # append-only file every completed turn is written to, see attach_store
+        self.store: Optional[ConversationStore] = None
+        # sessions.Session every completed turn is also written to, see attach_session
+        self.chat_session: Optional["Session"] = None
+        # the messages so far, see history.ConversationHistory
+        self.history = ConversationHistory()
+
+    @property
+    def conversation_history(self) -> ConversationHistory:
+        return self.history
+
+    @conversation_history.setter
+    def conversation_history(self, messages: Iterable[Dict[str, Any]]) -> None:
+        self.history = (messages if isinstance(messages, ConversationHistory)
+                        else ConversationHistory(messages))
+
+    def _summarize(self, transcript: str) -> Optional[str]:
+        """summary of older turns for the summarize context strategy, None on failure"""
+        raise NotImplementedError
+
+    def fork(self) -> Any:
+        """a new, empty conversation sharing this client's connections, caches and rate limits"""
+        import copy
+
+        clone = copy.copy(self)
+        clone.context = ContextManager(self.context.budget, self.context.strategy,
+                                       clone._summarize if self.context.summarizer else None)
+        clone.store = None
+        clone.chat_session = None
+        clone.conversation_history = []
+        return clone
+
+    def build_payload(self, messages: Sequence[Dict[str, Any]],
+                      model: str = config.DEFAULT_MODEL,
+                      max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                      system_prompt: Optional[str] = None,
+                      stream: bool = False, splice: bool = False) -> Dict[str, Any]:
+        """
+        build the Messages API request body. with prompt caching on, the system
+        prompt and the last message before the new one get cache-control
+        breakpoints, so each turn only pays full prefill for the newest messages.
+        args:
+            splice: keep a history Window as the messages, for encode_payload to
+                    reuse its encoded turns; otherwise they are a list, as json expects
+        """
+        if self.prompt_cache and len(messages) > 1:
+            # the history prefix is stable between turns; the new message is not
+            messages = messages[:-2] + [dict(messages[-2], content=with_cache_control(
+                messages[-2]["content"])), messages[-1]]
+        payload: Dict[str, Any] = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": messages if splice else list(messages)
+        }
+
+        if system_prompt:
+            payload["system"] = (with_cache_control(system_prompt) if self.prompt_cache
+                                 else system_prompt)
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _lookup(self, payload: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """response cache key for a payload and the cached reply, if any"""
+        if not self.cache:
+            return None, None
+        key = self.cache.key(payload)
+        return key, self.cache.get(key)
+
+    def _success(self, result: Dict[str, Any], model: str, key: Optional[str] = None,
+                 cached: bool = False) -> Dict[str, Any]:
+        """
+        result dict for an API reply, storing fresh replies in the response cache
+        raises:
+            KeyError: if the reply has no text content
+        """
+        assistant_message = result["content"][0]["text"]
+        if key and not cached:
+            self.cache.put(key, result)
+
+        response = {
+            "success": True,
+            "message": assistant_message,
+            "usage": result.get("usage", {}),
+            "model": result.get("model", model),
+            "stop_reason": result.get("stop_reason")
+        }
+        if self.cache:
+            response["cached"] = cached
+        return response
+
+    def _failure(self, error: Exception) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": config.ERROR_MESSAGES["api_request_failed"].format(
+                str(error) or type(error).__name__),
+            "message": None
+        }
+
+    def _record_turn(self, message: str, reply: str) -> None:
+        """add a completed turn to the history and the attached store"""
+        self.conversation_history.append({"role": "user", "content": message})
+        self.conversation_history.append({"role": "assistant", "content": reply})
+        if self.store is not None:
+            self.store.append(self.conversation_history[-2:])
+        if self.chat_session is not None:
+            self.chat_session.append(self.conversation_history[-2:])
+
+    def clear_conversation(self) -> None:
+        """
+        Removes all messages from the current convo. history
+        """
+        self.conversation_history = []
+        self.context.reset()
+        # later turns start a new conversation rather than continuing the stored one
+        self.store = None
+        self.chat_session = None
+
+    def _save_conversation(self, filename: str) -> bool:
+        import json
+
+        try:
+            if self.store is not None and os.path.abspath(self.store.path) == os.path.abspath(filename):
+                # every turn is already on disk
+                return True
+            if is_store_file(filename):
+                ConversationStore.write(filename, self._full_history())
+            elif self.store is not None:
+                # the attached store holds turns that may not be loaded in memory
+                self.store.export_json(filename)
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(list(self.conversation_history), f, indent=2, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"Error saving conversation: {e}")
+            return False
+
+    def _full_history(self) -> Iterator[Dict[str, Any]]:
+        """every message of the conversation, including ones only kept in the store"""
+        return self.store.read() if self.store is not None else iter(self.conversation_history)
+
+    def _attach_store(self, filename: str) -> bool:
+        try:
+            store = ConversationStore(filename)
+            if not len(store):
+                store.append(self._full_history())
+            self.store = store
+            return True
+        except Exception as e:
+            print(f"Error opening conversation store: {e}")
+            return False
+
+    def _load_conversation(self, filename: str) -> bool:
+        import json
+
+        try:
+            if is_store_file(filename):
+                store = ConversationStore(filename)
+                self.conversation_history = store.tail(self.context.budget)
+                self.store = store
+            else:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    self.conversation_history = json.load(f)
+                self.store = None
+            # the loaded conversation is not the session's
+            self.chat_session = None
+            self.context.reset()
+            return True
+        except Exception as e:
+            print(f"Error loading conversation: {e}")
+            return False
+
+    def _attach_session(self, session: "Session") -> None:
+        if not len(session) and self.conversation_history:
+            session.append(self._full_history())
+        self.chat_session = session
+
+    def _resume_session(self, session: "Session") -> None:
+        self.conversation_history = session.tail(self.context.budget)
+        self.store = None
+        self.chat_session = session
+        self.context.reset()
@@ -5,6 +5,7 @@ contains config constants and settings for the claude cli application,
 providing a centralized place for config mgmt.
 """
 
+import os
 from typing import Dict, Any
 
 # API config
@@ -13,11 +14,149 @@ DEFAULT_MAX_TOKENS = 1000
 API_BASE_URL = "https://api.anthropic.com/v1/messages"
 API_VERSION = "2023-06-01"
 
+# prompt caching: mark the system prompt and history prefix as cacheable
+PROMPT_CACHE_ENABLED = True
+CACHE_CONTROL = {"type": "ephemeral"}
+# entries expire this many seconds after they were last read or written
+PROMPT_CACHE_TTL = 300
+# shorter prefixes are not cached by the API
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# cache warming (--warm-cache): one-token requests that write the conversation
+# prefix into the prompt cache before the next turn needs it
+WARM_CACHE_ENABLED = False
+WARM_MAX_TOKENS = 1
+WARM_MESSAGE = "Reply with OK."
+# refreshed this long after the last warm while the user is idle, before the TTL runs out
+WARM_REFRESH_INTERVAL = 270
+# no more refreshes once the user has been idle this long, in seconds
+WARM_IDLE_LIMIT = 1800
+# spend cap per session in input-token equivalents
+WARM_BUDGET_TOKENS = 200000
+# price of each kind of token relative to an uncached input token
+WARM_TOKEN_WEIGHTS = {"input_tokens": 1.0, "cache_creation_input_tokens": 1.25,
+                      "cache_read_input_tokens": 0.1, "output_tokens": 5.0}
+
+# context window management
+CONTEXT_BUDGET = 150000
+CONTEXT_STRATEGY = "trim"
+CONTEXT_STRATEGIES = ("trim", "summarize")
+# once over budget, trim down to this fraction so the window start stays put for a while
+CONTEXT_TRIM_TARGET = 0.75
+SUMMARY_MODEL = DEFAULT_MODEL
+SUMMARY_MAX_TOKENS = 1000
+SUMMARY_SYSTEM = ("Summarize the conversation below for your own future reference. "
+                  "Keep facts, decisions, names and open questions; drop pleasantries.")
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+SUMMARY_ACK = "Understood, I'll keep that earlier context in mind."
+
+# connection pool config
+POOL_CONNECTIONS = 1
+POOL_MAXSIZE = 10
+KEEP_ALIVE = True
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 600.0
+PREWARM_CONNECTION = True
+# how often a wait on several requests checks whether it was cancelled, in seconds
+CANCEL_POLL_INTERVAL = 0.1
+# the async client multiplexes many conversations, so it pools more connections
+ASYNC_POOL_MAXSIZE = 100
+
+# retry and rate limit config
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504, 529)
+# client-side quota, None leaves it to the server
+RATE_LIMIT_RPM = None
+RATE_LIMIT_TPM = None
+
+# response cache config (opt-in with --cache or the env. var below)
+CACHE_ENABLED = False
+CACHE_ENV_VAR = "CLAUDE_CLI_CACHE"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "claude-cli")
+CACHE_FILE_NAME = "responses.sqlite3"
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# Message Batches API (--submit-batch / --collect-batch)
+MESSAGE_BATCH_MAX_REQUESTS = 100000
+MESSAGE_BATCH_MAX_BYTES = 256 * 1024 * 1024
+# submitted batch ids are tracked next to the results file
+MESSAGE_BATCH_STATE_SUFFIX = ".batches"
+MESSAGE_BATCH_POLL_INTERVAL = 10.0
+MESSAGE_BATCH_MAX_POLL_INTERVAL = 300.0
+
+# request instrumentation (--stats, --stats-file)
+STATS_PERCENTILES = (0.5, 0.95, 0.99)
+# --stats-file with this suffix is written as Prometheus text, anything else as JSONL
+STATS_PROMETHEUS_SUFFIX = ".prom"
+STATS_METRIC_PREFIX = "claude_cli"
+
+# sessions: interactive conversations are kept in one searchable database
+SESSIONS_ENABLED = True
+SESSIONS_DB = os.path.join(CACHE_DIR, "sessions.db")
+SESSIONS_LIST_LIMIT = 20
+
+# daemon mode: a resident client that -m/-f calls are forwarded to
+DAEMON_SOCKET_ENV_VAR = "CLAUDE_CLI_SOCKET"
+DAEMON_SOCKET = os.path.join(CACHE_DIR, "daemon.sock")
+DAEMON_CONNECT_TIMEOUT = 1.0
+# client settings the daemon fixes at startup; a call that sets any of them runs in-process
+DAEMON_CLIENT_OPTIONS = ("pool_size", "connect_timeout", "read_timeout", "keep_alive",
+                         "max_retries", "rpm", "tpm", "prompt_cache", "context_budget",
+                         "context_strategy", "cache", "refresh", "cache_dir", "cache_ttl")
+# named conversations (--conversation) are stores in this directory
+CONVERSATIONS_DIR = os.path.join(CACHE_DIR, "conversations")
+
+# batch mode config
+BATCH_CONCURRENCY = 4
+BATCH_OUTPUT_FILE = "batch_results.jsonl"
+
+# -f over globs and directories: the message sent for each file
+FILE_TEMPLATE = "{content}"
+# per-file content hashes of the last run, kept next to the results so unchanged files are skipped
+FILE_MANIFEST_SUFFIX = ".manifest.json"
+# --output-dir: one reply per file, at <dir>/<file path> + this suffix
+FILE_OUTPUT_SUFFIX = ".md"
+
+# map-reduce over -f files too large for one request
+# inverse of ratelimit.estimate_tokens
+CHARS_PER_TOKEN = 4
+# files over the context budget are split into chunks of at most this many estimated tokens
+CHUNK_TOKENS = 50000
+CHUNK_OVERLAP_TOKENS = 500
+CHUNK_BOUNDARIES = ["line", "paragraph"]
+CHUNK_BOUNDARY = "paragraph"
+# partial results of interrupted runs, reused when the same file and task are run again
+MAP_REDUCE_DIR = os.path.join(CACHE_DIR, "map_reduce")
+DEFAULT_TASK = "Summarize this file."
+MAP_PROMPT = ("This is part {index} of {total} of the file {name}, lines {first}-{last}. "
+              "{task}\nAnswer for this part only; the answers for all parts are combined later."
+              "\n\n<part>\n{text}</part>")
+REDUCE_PROMPT = ("These are answers for consecutive parts of the file {name}. {task}\n"
+                 "Combine them into one answer for the whole file.\n\n{results}")
+
+# --output: how -m and -f print the reply; json and jsonl are records for other programs
+OUTPUT_FORMATS = ("text", "json", "jsonl")
+OUTPUT_FORMAT = "text"
+
 # env. var
 API_KEY_ENV_VAR =  "ANTHROPIC_API_KEY"
+# https://no-color.org
+NO_COLOR_ENV_VAR = "NO_COLOR"
+
+# startup: `import cli` must stay under this (self time, python -X importtime)
+STARTUP_BUDGET_MS = 50
+
+# bench.py --compare: flag metrics that got this much worse than the baseline
+BENCH_REGRESSION_THRESHOLD = 0.2
 
 # file extensions
 CONVERSATION_FILE_EXTENSION = ".json"
+# append-only conversation store and its offset index
+STORE_FILE_EXTENSION = ".jsonl"
+STORE_INDEX_SUFFIX = ".idx"
 
 # cli config
 CLI_NAME = "Claude CLI"
@@ -29,7 +168,12 @@ INTERACTIVE_COMMANDS = {
     "quit" : ["quit", "exit", "q"],
     "clear" : ["clear"],
     "save" : "save",
-    "load" : "load"
+    "load" : "load",
+    "context" : "/context",
+    "stats" : "/stats",
+    "sessions" : "/sessions",
+    "resume" : "/resume",
+    "search" : "/search"
 }
 
 # http header template
@@ -55,6 +199,24 @@ ERROR_MESSAGES = {
     "conversation_save_failed": "Failed to save conversation to '{}'",
     "api_request_failed": "API request failed: {}",
     "unexpected_response": "Unexpected API response format: {}",
+    "invalid_batch_line": "Invalid batch prompt on line {}: {}",
+    "batch_failed": "{} of {} batch prompts failed",
+    "invalid_context_strategy": "Unknown context strategy '{}'",
+    "batch_request_too_large": "Batch prompt '{}' is larger than a batch submission may be",
+    "no_pending_batches": "No submitted batches to collect for '{}'",
+    "invalid_conversation_name": "Invalid conversation name '{}'",
+    "daemon_running": "A daemon is already listening on '{}'",
+    "daemon_not_running": "No daemon is listening on '{}'",
+    "daemon_disconnected": "daemon closed the connection",
+    "request_cancelled": "request cancelled",
+    "session_not_found": "No session named '{}'",
+    "no_files_match": "No files match '{}'",
+    "files_failed": "{} of {} files failed",
+    "chunks_failed": "{} of {} file chunks failed; run the same command again to retry them",
+    "async_unsupported": "{} is not available on AsyncClaudeCLI; use ClaudeCLI for it",
+    "too_few_models": "--race and --compare need at least two different models",
+    "warm_needs_prompt_cache": "--warm-cache needs prompt caching; ignored with --no-prompt-cache",
+    "warm_single_model": "--warm-cache warms one model; ignored with --race and --compare",
     "config_error": "Configuration error: {}",
     "unexpected_error": "Unexpected error: {}"
 }
@@ -62,5 +224,11 @@ ERROR_MESSAGES = {
 SUCCESS_MESSAGES = {
     "conversation_loaded": "Conversation loaded successfully from '{}'",
     "conversation_saved": "Conversation saved successfully to '{}'",
-    "conversation_cleared": "Conversation cleared."
+    "conversation_cleared": "Conversation cleared.",
+    "batch_complete": "Batch complete: {} succeeded, {} failed, {} skipped. Results in '{}'",
+    "files_complete": "Files complete: {} succeeded, {} failed, {} unchanged, {} unreadable. Results in '{}'",
+    "batches_submitted": "Submitted {} prompts in {} batches ({} skipped); collect with --collect-batch --batch-output '{}'",
+    "session_resumed": "Resumed session '{}' ({} turns)",
+    "daemon_started": "Daemon listening on '{}'",
+    "daemon_stopped": "Daemon on '{}' stopped"
 }
\ No newline at end of file
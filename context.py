@@ -0,0 +1,186 @@
+"""
+Context window management for claude cli
+
+keeps the messages sent each turn under an input token budget, either by
+dropping the oldest turns or by replacing them with a running summary.
+The full conversation history is never modified; only the window sent to
+the API is.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import config
+from ratelimit import estimate_tokens
+
+Content = Union[str, List[Dict[str, Any]]]
+
+# role, separators and other per-message framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(content: Content) -> int:
+    """estimated tokens of message or system content"""
+    if isinstance(content, list):
+        return sum(message_tokens(block.get("text", "")) for block in content)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextManager:
+    def __init__(self, budget: Optional[int] = config.CONTEXT_BUDGET,
+                 strategy: str = config.CONTEXT_STRATEGY,
+                 summarizer: Optional[Callable[[str], Optional[str]]] = None) -> None:
+        """
+        args:
+            budget: max estimated input tokens per request, None or 0 for no limit
+            strategy: "trim" drops the oldest turns, "summarize" folds them into a summary
+            summarizer: turns a transcript into a summary, None on failure;
+                        required for the summarize strategy
+        """
+        if strategy not in config.CONTEXT_STRATEGIES:
+            raise ValueError(config.ERROR_MESSAGES["invalid_context_strategy"].format(strategy))
+        self.budget = budget or None
+        self.strategy = strategy
+        self.summarizer = summarizer
+        # estimates keyed on the content string; str caches its own hash so
+        # looking up an already counted message is O(1)
+        self._counts: Dict[str, int] = {}
+        # (history messages covered, summary text) for the summarize strategy
+        self._summary: Optional[Tuple[int, str]] = None
+        self._start = 0
+        self.last_window = 0
+        self.last_tokens = 0
+
+    def count(self, content: Content) -> int:
+        """estimated tokens of message or system content, cached per message"""
+        if isinstance(content, list):
+            return sum(self.count(block.get("text", "")) for block in content)
+        tokens = self._counts.get(content)
+        if tokens is None:
+            tokens = self._counts[content] = message_tokens(content)
+        return tokens
+
+    def total(self, messages: Sequence[Dict[str, Any]]) -> int:
+        """estimated tokens of messages; a history.Window keeps its own running total"""
+        if isinstance(messages, list):
+            return sum(self.count(message["content"]) for message in messages)
+        return messages.tokens()
+
+    def reset(self) -> None:
+        """forget estimates and summaries, e.g. after the history was cleared or replaced"""
+        self._counts.clear()
+        self._summary = None
+        self._start = 0
+
+    def fit(self, messages: Sequence[Dict[str, Any]],
+            system_prompt: Optional[Content] = None) -> Sequence[Dict[str, Any]]:
+        """
+        choose the messages to send this turn
+        args:
+            messages: full history followed by the new user message, as a list
+                      or a history.Window
+            system_prompt: counted against the budget
+        returns:
+            list: the newest messages that fit, starting with a user message,
+                  preceded by a summary of the rest when summarizing
+        """
+        if self.budget is None:
+            self._record(messages)
+            return messages
+
+        start = self._start = self._window_start(messages, system_prompt)
+        window = messages[start:]
+        if start and self.strategy == "summarize":
+            summary = self._summarize(messages, start)
+            if summary:
+                window = [{"role": "user", "content": config.SUMMARY_PREFIX + summary},
+                          {"role": "assistant", "content": config.SUMMARY_ACK}] + window
+        self._record(window)
+        return window
+
+    def peek(self, messages: Sequence[Dict[str, Any]],
+             system_prompt: Optional[Content] = None) -> Optional[Sequence[Dict[str, Any]]]:
+        """
+        the window fit would choose now, without moving the window or summarizing,
+        e.g. to warm the prompt cache for the next turn from another thread
+        returns:
+            list: the messages, or None when fit would need a new summary first
+        """
+        if self.budget is None:
+            return messages
+        start = self._window_start(messages, system_prompt)
+        window = messages[start:]
+        if start and self.strategy == "summarize":
+            covered, summary = self._summary or (0, None)
+            if covered != start or summary is None:
+                return None
+            window = [{"role": "user", "content": config.SUMMARY_PREFIX + summary},
+                      {"role": "assistant", "content": config.SUMMARY_ACK}] + window
+        return window
+
+    def _window_start(self, messages: Sequence[Dict[str, Any]],
+                      system_prompt: Optional[Content]) -> int:
+        """index of the oldest message to send this turn"""
+        budget = self.budget - (self.count(system_prompt) if system_prompt else 0)
+        if self.strategy == "summarize":
+            budget -= config.SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS * 2
+
+        # keep the previous window start while it fits, so the prefix sent to
+        # the API stays the same and prompt caching keeps hitting
+        start = self._start if self._start < len(messages) else 0
+        if messages[start]["role"] != "user" or self.total(messages[start:]) > budget:
+            start = self._trim_start(messages, int(budget * config.CONTEXT_TRIM_TARGET))
+        return start
+
+    def _trim_start(self, messages: Sequence[Dict[str, Any]], budget: int) -> int:
+        """index of the oldest message that still fits; the new message is always kept"""
+        start = len(messages) - 1
+        used = self.count(messages[start]["content"])
+        while start > 0:
+            tokens = self.count(messages[start - 1]["content"])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+        # the window has to open on a user turn
+        while start < len(messages) - 1 and messages[start]["role"] != "user":
+            start += 1
+        return start
+
+    def _summarize(self, messages: Sequence[Dict[str, Any]], start: int) -> Optional[str]:
+        """summary of messages[:start], extending the previous summary when possible"""
+        covered, summary = self._summary or (0, None)
+        if covered == start:
+            return summary
+        if covered > start or self.summarizer is None:
+            # the history shrank or there is nothing to summarize with
+            covered, summary = 0, None
+
+        transcript = [f"Earlier summary: {summary}"] if summary else []
+        for message in messages[covered:start]:
+            content = message["content"]
+            if isinstance(content, list):
+                content = " ".join(block.get("text", "") for block in content)
+            transcript.append(f"{message['role']}: {content}")
+
+        new_summary = self.summarizer("\n\n".join(transcript)) if self.summarizer else None
+        if new_summary is None:
+            # fall back to trimming this turn and try again next turn
+            return None
+        self._summary = (start, new_summary)
+        return new_summary
+
+    def _record(self, window: Sequence[Dict[str, Any]]) -> None:
+        self.last_window = len(window)
+        self.last_tokens = self.total(window)
+
+    def describe(self, history: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """current size of the history and of the last window sent"""
+        return {
+            "messages": len(history),
+            "tokens": self.total(history),
+            "window_messages": self.last_window,
+            "window_tokens": self.last_tokens,
+            "budget": self.budget,
+            "strategy": self.strategy,
+            "summarized": self._summary[0] if self._summary else 0,
+        }
@@ -0,0 +1,270 @@
+"""
+Daemon mode for claude cli
+
+`cli.py --daemon` keeps one warm ClaudeCLI (pooled connections, response
+cache, rate limits) and named conversations resident behind a Unix socket.
+`cli.py -m` and `-f` forward to it when it is running, so a scripted call
+costs a socket round trip instead of client setup and a TLS handshake.
+
+The protocol is one JSON request line per connection, answered with
+{"text": ...} lines while streaming and a final {"result": ...} line.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import config
+from stats import Stats
+from store import conversation_path
+
+
+def _connect(socket_path: str, timeout: Optional[float] = None) -> Optional[socket.socket]:
+    """a connection to the daemon, None if none is listening"""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        # no socket file, or one left behind by a daemon that was killed
+        sock.close()
+        return None
+    return sock
+
+
+def _send(sock: socket.socket, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """send one request and yield the events of the reply"""
+    with sock:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        for line in sock.makefile("rb"):
+            yield json.loads(line)
+
+
+def _command(socket_path: str, command: str) -> Optional[Dict[str, Any]]:
+    sock = _connect(socket_path, config.DAEMON_CONNECT_TIMEOUT)
+    if sock is None:
+        return None
+    try:
+        return next(_send(sock, {"command": command}), {}).get("result")
+    except OSError:
+        return None
+
+
+def is_running(socket_path: str = config.DAEMON_SOCKET) -> bool:
+    """whether a daemon answers on socket_path"""
+    return _command(socket_path, "ping") is not None
+
+
+def stop(socket_path: str = config.DAEMON_SOCKET) -> bool:
+    """ask a running daemon to exit, false if none was running"""
+    return _command(socket_path, "stop") is not None
+
+
+class DaemonClient:
+    # response cache counters live in the daemon
+    cache = None
+
+    def __init__(self, sock: socket.socket, conversation: Optional[str] = None,
+                 request_stats: Optional[Stats] = None) -> None:
+        """
+        one message forwarded to a running daemon; has the send_message
+        signature of ClaudeCLI so the cli modes can use either. see connect
+        args:
+            sock: connected daemon socket, consumed by send_message
+            conversation: named conversation kept by the daemon, None for a one-off
+            request_stats: collects the stats the daemon reports with each result
+        """
+        self.sock = sock
+        self.conversation = conversation
+        self.stats = request_stats or Stats()
+
+    @classmethod
+    def connect(cls, socket_path: str = config.DAEMON_SOCKET,
+                conversation: Optional[str] = None,
+                request_stats: Optional[Stats] = None) -> Optional["DaemonClient"]:
+        """a client for the daemon on socket_path, None if it is not running"""
+        sock = _connect(socket_path)
+        return cls(sock, conversation, request_stats) if sock else None
+
+    def send_message(self, message: str, model: str = config.DEFAULT_MODEL,
+                     max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                     system_prompt: Optional[str] = None, stream: bool = False,
+                     on_text: Optional[Callable[[str], None]] = None,
+                     cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        send a message through the daemon and return its result dict
+        args:
+            cancel: once set, the connection is closed at the next streamed event
+        """
+        request = {"command": "message", "message": message, "model": model,
+                   "max_tokens": max_tokens, "system": system_prompt, "stream": stream,
+                   "conversation": self.conversation}
+        error = config.ERROR_MESSAGES["daemon_disconnected"]
+        try:
+            events = _send(self.sock, request)
+            for event in events:
+                if cancel is not None and cancel.is_set():
+                    # closes the socket; the daemon finds out when it next writes
+                    events.close()
+                    error = config.ERROR_MESSAGES["request_cancelled"]
+                    break
+                if "text" in event:
+                    if on_text:
+                        on_text(event["text"])
+                elif "result" in event:
+                    if "stats" in event["result"]:
+                        self.stats.add(event["result"]["stats"])
+                    return event["result"]
+        except OSError:
+            pass
+        return {
+            "success": False,
+            "error": config.ERROR_MESSAGES["api_request_failed"].format(error)
+        }
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Conversation:
+    """a named conversation resident in the daemon"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.claude_cli: Any = None
+        # size of its store file when last used, to notice writes by other processes
+        self.size = -1
+
+
+class Daemon:
+    def __init__(self, claude_cli: Any, socket_path: str = config.DAEMON_SOCKET) -> None:
+        """
+        args:
+            claude_cli: warm client shared by every request; named
+                        conversations are forks of it
+            socket_path: unix socket to listen on
+        """
+        self.claude_cli = claude_cli
+        self.socket_path = socket_path
+        self.conversations: Dict[str, _Conversation] = {}
+        self.lock = threading.Lock()
+        self.server: Optional[_Server] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def _send_to(self, name: str, args: Tuple[Any, ...]) -> Dict[str, Any]:
+        """send a message in a named conversation, one turn at a time"""
+        with self.lock:
+            conversation = self.conversations.setdefault(name, _Conversation())
+        with conversation.lock:
+            path = conversation_path(name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if conversation.claude_cli is None or conversation.size != size:
+                claude_cli = self.claude_cli.fork()
+                if not (claude_cli.load_conversation(path) if size else claude_cli.attach_store(path)):
+                    raise ValueError(config.ERROR_MESSAGES["conversation_load_failed"].format(path))
+                conversation.claude_cli = claude_cli
+            result = conversation.claude_cli.send_message(*args)
+            conversation.size = os.path.getsize(path)
+        return result
+
+    def handle(self, request: Dict[str, Any], write: Callable[[Dict[str, Any]], None]) -> bool:
+        """
+        answer one request
+        returns:
+            bool: false once the daemon was asked to stop
+        """
+        command = request.get("command")
+        if command == "ping":
+            write({"result": {"success": True, "pid": os.getpid()}})
+            return True
+        if command == "stop":
+            write({"result": {"success": True}})
+            return False
+
+        def on_text(text: str) -> None:
+            write({"text": text})
+
+        args = (request["message"], request.get("model") or config.DEFAULT_MODEL,
+                request.get("max_tokens") or config.DEFAULT_MAX_TOKENS, request.get("system"),
+                bool(request.get("stream")), on_text)
+        name = request.get("conversation")
+        result = self._send_to(name, args) if name else self.claude_cli.complete(*args)
+        write({"result": result})
+        return True
+
+    def _handler(self) -> type:
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                def write(event: Dict[str, Any]) -> None:
+                    self.wfile.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+
+                try:
+                    request = json.loads(self.rfile.readline())
+                    keep_running = daemon.handle(request, write)
+                except (ValueError, KeyError, TypeError) as e:
+                    write({"result": {"success": False, "error": str(e)}})
+                    return
+                except OSError:
+                    # the client went away mid-reply
+                    return
+                if not keep_running:
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+        return Handler
+
+    def _bind(self) -> _Server:
+        if os.path.exists(self.socket_path):
+            if is_running(self.socket_path):
+                raise ValueError(config.ERROR_MESSAGES["daemon_running"].format(self.socket_path))
+            # left behind by a daemon that was killed
+            os.remove(self.socket_path)
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # the socket spends the owner's API key, so only the owner may connect
+        umask = os.umask(0o177)
+        try:
+            return _Server(self.socket_path, self._handler())
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self) -> None:
+        """listen until stopped, removing the socket on the way out"""
+        if self.server is None:
+            self.server = self._bind()
+        try:
+            self.server.serve_forever(poll_interval=0.05)
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def start(self) -> "Daemon":
+        """serve on a background thread"""
+        self.server = self._bind()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self) -> "Daemon":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
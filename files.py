@@ -0,0 +1,173 @@
+"""
+Multi-file input for claude cli
+
+`-f` with globs, directories or several paths sends every matching file
+through batch mode with an instruction template, over the shared pooled
+client. A manifest of content hashes next to the results remembers what
+the last run answered, so unchanged files are skipped. Replies go to the
+JSONL results file and optionally to one file per input.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import config
+
+
+def is_pattern(path: str) -> bool:
+    """whether a -f argument names more than one file: a glob or a directory"""
+    return glob.has_magic(path) or os.path.isdir(path)
+
+
+def _walk(directory: str) -> Iterator[str]:
+    """files under a directory, skipping hidden files and directories such as .git"""
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            if not name.startswith("."):
+                yield os.path.join(root, name)
+
+
+def expand_paths(patterns: Iterable[str]) -> List[str]:
+    """
+    the files named by paths, globs (** matches any depth) and directories
+    returns:
+        list: file paths in argument order, each once
+    raises:
+        ValueError: if a pattern matches no file
+    """
+    paths: Dict[str, None] = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        found = False
+        for match in matches:
+            for path in (_walk(match) if os.path.isdir(match) else [match]):
+                if os.path.isfile(path):
+                    paths[os.path.normpath(path)] = None
+                    found = True
+        if not found:
+            raise ValueError(config.ERROR_MESSAGES["no_files_match"].format(pattern))
+    return list(paths)
+
+
+def render(template: str, path: str, content: str) -> str:
+    """
+    the message for one file; {path} and {content} are replaced, and the content
+    is appended when the template does not place it
+    """
+    message = template.replace("{path}", path)
+    if "{content}" not in template:
+        return f"{message}\n\n{content}"
+    return message.replace("{content}", content)
+
+
+def content_hash(path: str, settings: str) -> str:
+    """hash of a file's bytes and the settings its reply depends on"""
+    digest = hashlib.sha256(settings.encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path: str, manifest: Dict[str, str]) -> None:
+    """replace the manifest atomically, so an interrupted write keeps the old one"""
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def output_file(output_dir: str, path: str) -> str:
+    """where --output-dir puts the reply for a file, mirroring its relative path"""
+    relative = os.path.relpath(os.path.abspath(path))
+    if relative.startswith(os.pardir):
+        # outside the working directory: keep the absolute path below output_dir
+        relative = os.path.abspath(path).lstrip(os.sep)
+    return os.path.join(output_dir, relative + config.FILE_OUTPUT_SUFFIX)
+
+
+def run_files(claude_cli: Any, paths: List[str], output_path: str,
+              template: str = config.FILE_TEMPLATE,
+              model: str = config.DEFAULT_MODEL,
+              max_tokens: int = config.DEFAULT_MAX_TOKENS,
+              system_prompt: Optional[str] = None,
+              concurrency: int = config.BATCH_CONCURRENCY,
+              output_dir: Optional[str] = None,
+              on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+              on_unreadable: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """
+    send every file through the template, skipping files whose content and
+    settings are unchanged since the last successful run
+    args:
+        claude_cli: shared client; its complete() must be thread safe
+        paths: files from expand_paths
+        output_path: JSONL results file, with the manifest next to it
+        output_dir: also write each reply to its own file under this directory
+        on_unreadable: called with files that are not UTF-8 text
+    returns:
+        dict: counts of succeeded, failed, unchanged and unreadable files
+    """
+    # batch mode's thread pool is only needed once files are sent, not for is_pattern
+    from batch import run_batch
+
+    manifest_path = output_path + config.FILE_MANIFEST_SUFFIX
+    manifest = load_manifest(manifest_path)
+    # results of earlier runs are not inputs, e.g. with -f . --output-dir replies
+    outputs = {os.path.abspath(output_path), os.path.abspath(manifest_path)}
+    output_root = os.path.join(os.path.abspath(output_dir), "") if output_dir else None
+    paths = [path for path in paths if os.path.abspath(path) not in outputs
+             and not (output_root and os.path.abspath(path).startswith(output_root))]
+    settings = json.dumps([template, model, max_tokens, system_prompt])
+    hashes: Dict[str, str] = {}
+    counts = {"unchanged": 0, "unreadable": 0}
+
+    def prompts() -> Iterator[Dict[str, Any]]:
+        for path in paths:
+            digest = content_hash(path, settings)
+            if manifest.get(path) == digest and (
+                    output_dir is None or os.path.exists(output_file(output_dir, path))):
+                counts["unchanged"] += 1
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = f.read()
+            except UnicodeDecodeError:
+                counts["unreadable"] += 1
+                if on_unreadable:
+                    on_unreadable(path)
+                continue
+            hashes[path] = digest
+            yield {"id": path, "message": render(template, path, content)}
+
+    def record(result: Dict[str, Any]) -> None:
+        path = result["id"]
+        if result["success"]:
+            if output_dir is not None:
+                target = output_file(output_dir, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "w", encoding="utf-8") as f:
+                    f.write(result["message"] + "\n")
+            manifest[path] = hashes[path]
+        if on_result:
+            on_result(result)
+
+    try:
+        batch_counts = run_batch(claude_cli, prompts(), output_path, model, max_tokens,
+                                 system_prompt, concurrency, on_result=record, resume=False)
+    finally:
+        # files answered before an interruption are not sent again
+        save_manifest(manifest_path, manifest)
+    return {"succeeded": batch_counts["succeeded"], "failed": batch_counts["failed"],
+            "unchanged": counts["unchanged"], "unreadable": counts["unreadable"]}
@@ -0,0 +1,318 @@
+"""
+Conversation history for claude cli
+
+the history is kept as slotted Turns whose JSON encodings are joined into
+one growing buffer as they are added, with running token estimates. A turn's
+request is a Window over the history plus the new message: choosing what
+fits the context budget is a lookup in the running totals, and the request
+body splices the encoded prefix instead of serializing the whole history
+again, so the client's cost per turn does not grow with the conversation.
+"""
+
+import copy
+import json
+from collections.abc import MutableSequence, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from context import message_tokens
+
+Message = Dict[str, Any]
+
+
+def encode(value: Any) -> bytes:
+    """compact UTF-8 JSON, as sent in request bodies"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class Turn:
+    """one message of a conversation, counted once; its encoding lives in the history's buffer"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: Any) -> None:
+        self.set(role, content)
+
+    def set(self, role: str, content: Any) -> None:
+        self.role = role
+        self.content = content
+        self.tokens = message_tokens(content)
+
+    def as_dict(self) -> Message:
+        """the message as a new dict; content blocks are copied, so edits leave the turn alone"""
+        content = self.content if isinstance(self.content, str) else copy.deepcopy(self.content)
+        return {"role": self.role, "content": content}
+
+
+class MessageView(dict):
+    """
+    a message read from a ConversationHistory: setting or removing its keys
+    writes it back, re-encoding it. its content blocks are copies, so assign
+    the content again to change them.
+    """
+
+    __slots__ = ("_history", "_turn")
+
+    def __init__(self, history: "ConversationHistory", turn: Turn) -> None:
+        super().__init__(turn.as_dict())
+        self._history = history
+        self._turn = turn
+
+    def _edit(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        # the edit is checked on a copy first, so a message the history rejects is left as it was
+        message = dict(self)
+        result = getattr(message, method)(*args, **kwargs)
+        self._history._rewrite(self._turn, message)
+        getattr(super(), method)(*args, **kwargs)
+        return result
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._edit("__setitem__", key, value)
+
+    def __delitem__(self, key: str) -> None:
+        self._edit("__delitem__", key)
+
+    def __ior__(self, other: Any) -> "MessageView":
+        self._edit("update", other)
+        return self
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        self._edit("update", *args, **kwargs)
+
+    def pop(self, *args: Any) -> Any:
+        return self._edit("pop", *args)
+
+    def popitem(self) -> Any:
+        return self._edit("popitem")
+
+    def setdefault(self, *args: Any) -> Any:
+        return self._edit("setdefault", *args)
+
+    def clear(self) -> None:
+        self._edit("clear")
+
+
+class ConversationHistory(MutableSequence):
+    """
+    the messages of a conversation; behaves like a list of message dicts, whose
+    items are MessageViews that write edits back. appending is cheap and keeps
+    Windows taken earlier valid; other edits re-encode the turns from the
+    first one changed, and invalidate earlier Windows.
+    """
+
+    def __init__(self, messages: Iterable[Message] = ()) -> None:
+        self.turns: List[Turn] = []
+        # every encoded turn followed by a comma
+        self._buffer = bytearray()
+        # where each turn starts in the buffer, and the buffer's end
+        self._offsets = [0]
+        # estimated tokens of the turns before each index
+        self._sums = [0]
+        self.extend(messages)
+
+    def append(self, message: Message) -> None:
+        self._add(Turn(message["role"], message["content"]))
+
+    def _add(self, turn: Turn) -> None:
+        self.turns.append(turn)
+        self._buffer += encode({"role": turn.role, "content": turn.content})
+        self._buffer += b","
+        self._offsets.append(len(self._buffer))
+        self._sums.append(self._sums[-1] + turn.tokens)
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [MessageView(self, turn) for turn in self.turns[index]]
+        return MessageView(self, self.turns[index])
+
+    def __setitem__(self, index: Union[int, slice], value: Any) -> None:
+        if isinstance(index, slice):
+            turns = self.turns[:]
+            turns[index] = [Turn(message["role"], message["content"]) for message in value]
+            first = self._first(index)
+            self._replace(first, turns[first:])
+        else:
+            position = self._position(index)
+            self._replace(position, [Turn(value["role"], value["content"])]
+                          + self.turns[position + 1:])
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        if isinstance(index, slice):
+            turns = self.turns[:]
+            del turns[index]
+            first = self._first(index)
+            self._replace(first, turns[first:])
+        else:
+            position = self._position(index)
+            self._replace(position, self.turns[position + 1:])
+
+    def insert(self, index: int, message: Message) -> None:
+        position = min(max(index + len(self) if index < 0 else index, 0), len(self))
+        self._replace(position, [Turn(message["role"], message["content"])] + self.turns[position:])
+
+    def clear(self) -> None:
+        self._replace(0, [])
+
+    def _position(self, index: int) -> int:
+        """an item index as a position, raising IndexError like a list"""
+        return range(len(self))[index]
+
+    def _first(self, index: slice) -> int:
+        """the first position a slice edit can change"""
+        start, _, step = index.indices(len(self))
+        return start if step == 1 else 0
+
+    def _replace(self, start: int, turns: List[Turn]) -> None:
+        """replace turns[start:] with turns, re-encoding only those"""
+        del self.turns[start:]
+        del self._buffer[self._offsets[start]:]
+        del self._offsets[start + 1:]
+        del self._sums[start + 1:]
+        for turn in turns:
+            self._add(turn)
+
+    def _rewrite(self, turn: Turn, message: Message) -> None:
+        """change a turn to message wherever it is now; a turn since removed is left alone"""
+        for position in range(len(self.turns) - 1, -1, -1):
+            if self.turns[position] is turn:
+                content = message["content"]
+                # the caller keeps the message, so the turn holds its own blocks
+                turn.set(message["role"], content if isinstance(content, str)
+                         else copy.deepcopy(content))
+                self._replace(position, self.turns[position:])
+                return
+
+    def __iter__(self) -> Iterator[Message]:
+        return (MessageView(self, turn) for turn in self.turns)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (ConversationHistory, list)):
+            return len(self) == len(other) and all(
+                {"role": turn.role, "content": turn.content} == message
+                for turn, message in zip(self.turns, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({list(self)!r})"
+
+    def __add__(self, messages: List[Message]) -> "Window":
+        """the history followed by new messages, without copying it"""
+        return Window(self, 0, len(self), tail=list(messages))
+
+    def tokens(self, start: int = 0, end: Optional[int] = None) -> int:
+        """estimated tokens of turns[start:end]"""
+        return self._sums[len(self) if end is None else end] - self._sums[start]
+
+    def encoded(self, start: int = 0, end: Optional[int] = None) -> bytearray:
+        """turns[start:end] as the comma-separated inside of a JSON array"""
+        end = len(self) if end is None else end
+        if start >= end:
+            return bytearray()
+        # the slice copies, so appends meanwhile cannot disturb it
+        return self._buffer[self._offsets[start]:self._offsets[end] - 1]
+
+
+class Window(Sequence):
+    """
+    the messages of one request: a range of a history between messages that
+    are not in it, e.g. a summary before and the new message after
+    """
+
+    def __init__(self, history: ConversationHistory, start: int, end: int,
+                 head: Optional[List[Message]] = None,
+                 tail: Optional[List[Message]] = None) -> None:
+        self.history = history
+        self.start = start
+        self.end = end
+        self.head = head or []
+        self.tail = tail or []
+
+    def __len__(self) -> int:
+        return len(self.head) + self.end - self.start + len(self.tail)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return self._slice(index)
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError(index)
+        if index < len(self.head):
+            return self.head[index]
+        index -= len(self.head)
+        if index < self.end - self.start:
+            return self.history.turns[self.start + index].as_dict()
+        return self.tail[index - (self.end - self.start)]
+
+    def _slice(self, index: slice) -> "Window":
+        first, last, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("windows only support contiguous slices")
+        last = max(first, last)
+        head, middle = len(self.head), self.end - self.start
+        # positions relative to the history range
+        start = min(max(first - head, 0), middle)
+        end = min(max(last - head, 0), middle)
+        return Window(self.history, self.start + start, self.start + end,
+                      self.head[first:last], self.tail[max(first - head - middle, 0):
+                                                       max(last - head - middle, 0)])
+
+    def __add__(self, messages: List[Message]) -> "Window":
+        return Window(self.history, self.start, self.end, self.head, self.tail + list(messages))
+
+    def __radd__(self, messages: List[Message]) -> "Window":
+        return Window(self.history, self.start, self.end, list(messages) + self.head, self.tail)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (Window, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Window({list(self)!r})"
+
+    def tokens(self) -> int:
+        """estimated tokens of every message in the window"""
+        return (sum(message_tokens(m["content"]) for m in self.head + self.tail)
+                + self.history.tokens(self.start, self.end))
+
+    def chunks(self) -> List[Union[bytes, bytearray]]:
+        """the encoded messages; the range of the history is one chunk, reused as encoded"""
+        chunks: List[Union[bytes, bytearray]] = [encode(message) for message in self.head]
+        if self.start < self.end:
+            chunks.append(self.history.encoded(self.start, self.end))
+        chunks.extend(encode(message) for message in self.tail)
+        return chunks
+
+    def encode(self) -> bytes:
+        """the messages as a JSON array"""
+        return _array(self.chunks(), b"[", b"]")
+
+
+def _array(chunks: List[Union[bytes, bytearray]], opening: bytes, closing: bytes) -> bytes:
+    """chunks separated by commas between opening and closing, copied once"""
+    parts = [opening]
+    for chunk in chunks:
+        parts.append(chunk)
+        parts.append(b",")
+    if chunks:
+        parts.pop()
+    parts.append(closing)
+    return b"".join(parts)
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    """a request body as JSON bytes, splicing in a Window's encoded messages"""
+    messages = payload.get("messages")
+    if not isinstance(messages, Window):
+        return encode(payload)
+    rest = encode({key: value for key, value in payload.items() if key != "messages"})
+    opening = rest[:-1] + b',"messages":[' if len(rest) > 2 else b'{"messages":['
+    return _array(messages.chunks(), opening, b"]}")
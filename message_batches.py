@@ -0,0 +1,236 @@
+"""
+Message Batches API support for claude cli
+
+for offline jobs where cost and throughput matter more than latency. Prompts
+are packaged into Message Batches submissions under the API's size limits,
+the submitted batch ids are appended to a state file next to the results,
+and a later run polls them and streams each result into the same JSONL
+records batch mode writes, one line at a time.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import config
+from batch import completed_ids, open_output, require_sync
+
+CUSTOM_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# {"requests":[ ... ]}
+ENVELOPE_BYTES = len(b'{"requests":[]}')
+
+# (prompt id, custom_id, encoded request)
+Request = Tuple[str, str, bytes]
+
+
+def custom_id(prompt_id: str) -> str:
+    """the custom_id for a prompt; ids the API would reject are hashed"""
+    if CUSTOM_ID.fullmatch(prompt_id):
+        return prompt_id
+    return "h-" + hashlib.sha256(prompt_id.encode("utf-8")).hexdigest()[:40]
+
+
+def build_requests(claude_cli: Any, prompts: Iterable[Dict[str, Any]],
+                   model: str = config.DEFAULT_MODEL,
+                   max_tokens: int = config.DEFAULT_MAX_TOKENS,
+                   system_prompt: Optional[str] = None) -> Iterator[Request]:
+    """encode each prompt as a batch request with the payload send_message would post"""
+    for item in prompts:
+        prompt_id = str(item["id"])
+        payload = claude_cli.build_payload([{"role": "user", "content": item["message"]}],
+                                           item.get("model", model),
+                                           item.get("max_tokens", max_tokens),
+                                           item.get("system", system_prompt))
+        request = {"custom_id": custom_id(prompt_id), "params": payload}
+        yield prompt_id, request["custom_id"], json.dumps(request, ensure_ascii=False).encode("utf-8")
+
+
+def chunk_requests(requests: Iterable[Request],
+                   max_requests: int = config.MESSAGE_BATCH_MAX_REQUESTS,
+                   max_bytes: int = config.MESSAGE_BATCH_MAX_BYTES) -> Iterator[List[Request]]:
+    """
+    group requests into submissions under the API's count and size limits
+    raises:
+        ValueError: if a single request is over the size limit
+    """
+    chunk: List[Request] = []
+    size = ENVELOPE_BYTES
+    for request in requests:
+        # one comma per request after the first
+        request_size = len(request[2]) + 1
+        if ENVELOPE_BYTES + request_size > max_bytes:
+            raise ValueError(config.ERROR_MESSAGES["batch_request_too_large"].format(request[0]))
+        if chunk and (len(chunk) >= max_requests or size + request_size > max_bytes):
+            yield chunk
+            chunk, size = [], ENVELOPE_BYTES
+        chunk.append(request)
+        size += request_size
+    if chunk:
+        yield chunk
+
+
+def result_record(prompt_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """a Message Batches result as the record batch mode writes for a prompt"""
+    record: Dict[str, Any] = {"id": prompt_id}
+    if result.get("type") == "succeeded":
+        message = result["message"]
+        record.update({
+            "success": True,
+            "message": message["content"][0]["text"],
+            "usage": message.get("usage", {}),
+            "model": message.get("model"),
+            "stop_reason": message.get("stop_reason"),
+        })
+    else:
+        error = result.get("error", {})
+        # errored results nest the API error object one level down
+        error = error.get("error", error)
+        reason = error.get("message") or result.get("type", "unknown")
+        record.update({"success": False,
+                       "error": config.ERROR_MESSAGES["api_request_failed"].format(reason),
+                       "stop_reason": None})
+    return record
+
+
+class MessageBatches:
+    def __init__(self, claude_cli: Any, output_path: str = config.BATCH_OUTPUT_FILE,
+                 poll_interval: float = config.MESSAGE_BATCH_POLL_INTERVAL,
+                 max_poll_interval: float = config.MESSAGE_BATCH_MAX_POLL_INTERVAL,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        submit and collect Message Batches through a ClaudeCLI's pooled session
+        args:
+            output_path: JSONL results file; submitted batches are tracked in
+                         output_path + MESSAGE_BATCH_STATE_SUFFIX
+            poll_interval: seconds before the first status check, grown 1.5x per check
+            max_poll_interval: upper bound for the wait between checks
+        raises:
+            TypeError: if claude_cli is an AsyncClaudeCLI
+        """
+        require_sync(claude_cli, "MessageBatches")
+        self.claude_cli = claude_cli
+        self.url = claude_cli.base_url + "/batches"
+        self.output_path = output_path
+        self.state_path = output_path + config.MESSAGE_BATCH_STATE_SUFFIX
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.sleep = sleep
+
+    def _record_state(self, record: Dict[str, Any]) -> None:
+        with open(self.state_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """submitted batches whose results have not been collected yet"""
+        batches: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.state_path):
+            return []
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # partial line from an interrupted run
+                    continue
+                if record.get("collected"):
+                    batches.pop(record["batch_id"], None)
+                else:
+                    batches[record["batch_id"]] = record
+        return list(batches.values())
+
+    def submit(self, prompts: Iterable[Dict[str, Any]], model: str = config.DEFAULT_MODEL,
+               max_tokens: int = config.DEFAULT_MAX_TOKENS,
+               system_prompt: Optional[str] = None,
+               max_requests: int = config.MESSAGE_BATCH_MAX_REQUESTS,
+               max_bytes: int = config.MESSAGE_BATCH_MAX_BYTES,
+               on_submit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, int]:
+        """
+        submit every prompt that has neither a successful result nor a pending batch
+        returns:
+            dict: counts of submitted and skipped prompts and of batches
+        raises:
+            requests.exceptions.RequestException: if a submission fails; the
+                batches submitted before it are kept in the state file
+        """
+        done = completed_ids(self.output_path)
+        for batch in self.pending():
+            done.update(batch["ids"])
+        counts = {"submitted": 0, "skipped": 0, "batches": 0}
+
+        def fresh() -> Iterator[Dict[str, Any]]:
+            for item in prompts:
+                if str(item["id"]) in done:
+                    counts["skipped"] += 1
+                    continue
+                yield item
+
+        encoded = build_requests(self.claude_cli, fresh(), model, max_tokens, system_prompt)
+        for chunk in chunk_requests(encoded, max_requests, max_bytes):
+            body = b'{"requests":[' + b",".join(request for _, _, request in chunk) + b"]}"
+            batch = self.claude_cli.request("post", self.url, data=body).json()
+            record = {"batch_id": batch["id"], "ids": [prompt_id for prompt_id, _, _ in chunk]}
+            self._record_state(record)
+            counts["submitted"] += len(chunk)
+            counts["batches"] += 1
+            if on_submit:
+                on_submit(batch)
+        return counts
+
+    def status(self, batch_id: str) -> Dict[str, Any]:
+        return self.claude_cli.request("get", f"{self.url}/{batch_id}").json()
+
+    def wait(self, batch_id: str,
+             on_status: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """poll a batch with growing intervals until processing has ended"""
+        interval = self.poll_interval
+        while True:
+            batch = self.status(batch_id)
+            if on_status:
+                on_status(batch)
+            if batch["processing_status"] == "ended":
+                return batch
+            self.sleep(interval)
+            interval = min(interval * 1.5, self.max_poll_interval)
+
+    def results(self, batch: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """stream the JSONL results of an ended batch without reading them all at once"""
+        url = batch.get("results_url") or f"{self.url}/{batch['id']}/results"
+        response = self.claude_cli.request("get", url, stream=True)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def collect(self, on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                on_status: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, int]:
+        """
+        wait for every pending batch and append its results to the output file
+        returns:
+            dict: counts of succeeded, failed and skipped prompts and of batches
+        """
+        done: Set[str] = completed_ids(self.output_path)
+        counts = {"succeeded": 0, "failed": 0, "skipped": 0, "batches": 0}
+        for pending in self.pending():
+            ids = {custom_id(prompt_id): prompt_id for prompt_id in pending["ids"]}
+            batch = self.wait(pending["batch_id"], on_status)
+            with open_output(self.output_path) as out:
+                for result in self.results(batch):
+                    prompt_id = ids.get(result["custom_id"], result["custom_id"])
+                    if prompt_id in done:
+                        counts["skipped"] += 1
+                        continue
+                    record = result_record(prompt_id, result["result"])
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    counts["succeeded" if record["success"] else "failed"] += 1
+                    if on_result:
+                        on_result(record)
+                out.flush()
+                os.fsync(out.fileno())
+            self._record_state({"batch_id": pending["batch_id"], "collected": True})
+            counts["batches"] += 1
+        return counts
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Local mock of the Anthropic Messages API
+
+used by the tests to exercise the real http path (pooling, streaming,
+retries) without network access. Replies can be scripted per request,
+e.g. a few 429s followed by a normal answer. Message Batches submitted to
+<url>/batches are answered from the same default reply. For benchmarks the
+server can also pace streamed chunks, fail a fraction of requests and
+enforce a requests-per-second limit with 429s.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+DEFAULT_REPLY = "Hello from the mock server"
+
+
+class _Server(ThreadingHTTPServer):
+    # benchmarks open hundreds of connections at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # a cancelled stream drops the connection mid-answer
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class MockAnthropicServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 reply: str = DEFAULT_REPLY, latency: float = 0.0,
+                 batch_polls: int = 0, chunk_delay: float = 0.0,
+                 error_rate: float = 0.0, requests_per_second: Optional[int] = None,
+                 seed: Optional[int] = None,
+                 model_latency: Optional[Dict[str, float]] = None) -> None:
+        """
+        args:
+            host: interface to listen on
+            port: port to listen on, 0 picks a free one
+            reply: text of every successful answer
+            latency: seconds to wait before answering each request
+            batch_polls: status checks a message batch stays in progress for
+            chunk_delay: seconds between the text deltas of a streamed answer
+            error_rate: fraction of unscripted requests answered with a 500 or 529
+            requests_per_second: answer requests past this rate with 429s, None for no limit
+            seed: seeds the error injection, for repeatable runs
+            model_latency: latency of particular models, in place of latency
+        """
+        self.reply = reply
+        self.latency = latency
+        self.batch_polls = batch_polls
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.requests_per_second = requests_per_second
+        self.random = random.Random(seed)
+        self.model_latency = model_latency or {}
+        # (start of the current one second window, requests in it)
+        self.window = (0.0, 0)
+        # batch id -> {"requests": [...], "polls": status checks so far}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        # custom_ids whose batch result is an error
+        self.batch_errors: Set[str] = set()
+        # scripted (status, headers, body) replies used before the default answer
+        self.script: Deque[Tuple[int, Dict[str, str], Dict[str, Any]]] = deque()
+        self.requests: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.httpd = _Server((host, port), self._handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Messages API url to point ClaudeCLI.base_url at"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/messages"
+
+    def enqueue(self, status: int, body: Optional[Dict[str, Any]] = None,
+                headers: Optional[Dict[str, str]] = None) -> None:
+        """script the reply to the next unscripted request"""
+        if body is None:
+            body = {"type": "error", "error": {"type": "rate_limit_error" if status == 429
+                                               else "api_error", "message": f"HTTP {status}"}}
+        with self.lock:
+            self.script.append((status, headers or {}, body))
+
+    def start(self) -> "MockAnthropicServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockAnthropicServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """the default successful answer to a request body"""
+        return {
+            "id": "msg_mock",
+            "type": "message",
+            "role": "assistant",
+            "model": payload.get("model", "mock"),
+            "content": [{"type": "text", "text": self.reply}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": len(json.dumps(payload.get("messages", []))) // 4,
+                      "output_tokens": len(self.reply.split())},
+        }
+
+    def inject(self) -> Optional[Tuple[int, Dict[str, str], Dict[str, Any]]]:
+        """a rate limit or injected error reply for the next request, if any"""
+        with self.lock:
+            if self.requests_per_second:
+                now = time.monotonic()
+                start, count = self.window
+                if now - start >= 1.0:
+                    start, count = now, 0
+                self.window = (start, count + 1)
+                if count >= self.requests_per_second:
+                    reset = max(0.0, start + 1.0 - now)
+                    headers = {"retry-after": str(math.ceil(reset)),
+                               "anthropic-ratelimit-requests-limit": str(self.requests_per_second * 60),
+                               "anthropic-ratelimit-requests-remaining": "0"}
+                    return 429, headers, {"type": "error", "error": {
+                        "type": "rate_limit_error", "message": "mock rate limit"}}
+            if self.error_rate and self.random.random() < self.error_rate:
+                status = self.random.choice((500, 529))
+                return status, {}, {"type": "error", "error": {
+                    "type": "overloaded_error" if status == 529 else "api_error",
+                    "message": f"mock injected {status}"}}
+        return None
+
+    def batch(self, batch_id: str, poll: bool = False) -> Optional[Dict[str, Any]]:
+        """the Message Batch object, counting a status check when poll is set"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if poll:
+                batch["polls"] += 1
+            ended = batch["polls"] > self.batch_polls
+        count = len(batch["requests"])
+        errored = sum(r["custom_id"] in self.batch_errors for r in batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else count,
+                               "succeeded": count - errored if ended else 0,
+                               "errored": errored if ended else 0,
+                               "canceled": 0, "expired": 0},
+            "results_url": f"{self.url}/batches/{batch_id}/results" if ended else None,
+        }
+
+    def batch_result(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if request["custom_id"] in self.batch_errors:
+            result = {"type": "errored", "error": {"type": "error", "error": {
+                "type": "invalid_request_error", "message": "mock batch error"}}}
+        else:
+            result = {"type": "succeeded", "message": self.message(request["params"])}
+        return {"custom_id": request["custom_id"], "result": result}
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes; don't let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def send_json(self, status: int, body: Dict[str, Any],
+                          headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def send_event(self, event: str, data: Dict[str, Any]) -> None:
+                self.send_chunk(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+            def send_stream(self, message: Dict[str, Any]) -> None:
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                text = message["content"][0]["text"]
+                start = dict(message, content=[], stop_reason=None,
+                             usage=dict(message["usage"], output_tokens=0))
+                self.send_event("message_start", {"type": "message_start", "message": start})
+                self.send_event("content_block_start", {
+                    "type": "content_block_start", "index": 0,
+                    "content_block": {"type": "text", "text": ""}})
+                for i, word in enumerate(text.split(" ")):
+                    if i and server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                    delta = word if i == 0 else " " + word
+                    self.send_event("content_block_delta", {
+                        "type": "content_block_delta", "index": 0,
+                        "delta": {"type": "text_delta", "text": delta}})
+                self.send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self.send_event("message_delta", {
+                    "type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                    "usage": {"output_tokens": message["usage"]["output_tokens"]}})
+                self.send_event("message_stop", {"type": "message_stop"})
+                self.send_chunk(b"")
+
+            def send_batch_results(self, batch_id: str) -> None:
+                self.send_response(200)
+                self.send_header("content-type", "application/x-jsonl")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                for request in server.batches[batch_id]["requests"]:
+                    line = json.dumps(server.batch_result(request)) + "\n"
+                    self.send_chunk(line.encode("utf-8"))
+                self.send_chunk(b"")
+
+            def do_GET(self) -> None:
+                parts = self.path.rstrip("/").split("/")
+                results = parts[-1] == "results"
+                batch_id = parts[-2] if results else parts[-1]
+                batch = server.batch(batch_id, poll=not results)
+                if batch is None:
+                    self.send_json(404, {"type": "error", "error": {
+                        "type": "not_found_error", "message": f"no batch {batch_id}"}})
+                elif results:
+                    self.send_batch_results(batch_id)
+                else:
+                    self.send_json(200, batch)
+
+            def do_HEAD(self) -> None:
+                self.send_response(405)
+                self.send_header("content-length", "0")
+                self.end_headers()
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("content-length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server.lock:
+                    server.requests.append(payload)
+                    scripted = server.script.popleft() if server.script else None
+                if scripted is None:
+                    scripted = server.inject()
+
+                latency = server.model_latency.get(payload.get("model"), server.latency)
+                if latency:
+                    time.sleep(latency)
+                if scripted:
+                    status, headers, body = scripted
+                    self.send_json(status, body, headers)
+                elif self.path.rstrip("/").endswith("/batches"):
+                    with server.lock:
+                        batch_id = f"msgbatch_mock_{len(server.batches)}"
+                        server.batches[batch_id] = {"requests": payload["requests"], "polls": 0}
+                    self.send_json(200, server.batch(batch_id))
+                elif payload.get("stream"):
+                    self.send_stream(server.message(payload))
+                else:
+                    self.send_json(200, server.message(payload))
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local mock of the Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before answering each request")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="Seconds between streamed text deltas")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 500 or 529")
+    parser.add_argument("--rps", type=int,
+                        help="Answer requests past this many per second with 429s")
+    parser.add_argument("--seed", type=int, help="Seed for the error injection")
+    args = parser.parse_args()
+
+    server = MockAnthropicServer(args.host, args.port, args.reply, args.latency,
+                                 chunk_delay=args.chunk_delay, error_rate=args.error_rate,
+                                 requests_per_second=args.rps, seed=args.seed)
+    print(f"Mock Messages API listening on {server.url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
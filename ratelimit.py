@@ -0,0 +1,204 @@
+"""
+Retry and rate limit handling for claude cli
+
+RetryPolicy decides whether and how long to wait before retrying a failed
+request, and RateLimiter keeps requests and tokens per minute under the
+account quota with token buckets shared by every thread using one client.
+"""
+
+import threading
+import time
+from typing import Callable, Mapping, Optional, Tuple
+
+import config
+
+
+def estimate_tokens(text: str) -> int:
+    """rough token count used for client-side budgeting (~4 chars per token)"""
+    return max(1, len(text) // config.CHARS_PER_TOKEN)
+
+
+def _parse_timestamp(value: str) -> Optional[float]:
+    """seconds from now until an RFC 3339 or HTTP-date timestamp"""
+    # only needed once a rate limit is hit, so kept off the startup path
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+
+    try:
+        when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    read the retry-after header
+    returns:
+        seconds to wait, or None if the header is missing or invalid
+    """
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return _parse_timestamp(value)
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = config.MAX_RETRIES,
+                 base_delay: float = config.RETRY_BASE_DELAY,
+                 max_delay: float = config.RETRY_MAX_DELAY,
+                 retry_statuses: Tuple[int, ...] = config.RETRYABLE_STATUS_CODES) -> None:
+        """
+        exponential backoff with full jitter
+        args:
+            max_retries: retries after the first attempt, 0 disables retrying
+            base_delay: seconds before the first retry, doubled each attempt
+            max_delay: upper bound for a single wait
+            retry_statuses: http status codes worth retrying
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+    def should_retry(self, attempt: int, status: Optional[int] = None,
+                     headers: Optional[Mapping[str, str]] = None) -> bool:
+        """
+        args:
+            attempt: number of attempts already made, starting at 0
+            status: http status of the failed attempt, None for connection errors
+            headers: response headers; the API can veto retries with x-should-retry
+        """
+        if attempt >= self.max_retries:
+            return False
+        if headers is not None and headers.get("x-should-retry") in ("true", "false"):
+            return headers["x-should-retry"] == "true"
+        return status is None or status in self.retry_statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """seconds to wait before the next attempt, honoring retry-after when given"""
+        import random
+
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        thread-safe token bucket refilled continuously at per_minute
+        args:
+            per_minute: refill rate, also the bucket capacity
+            clock: monotonic time source, replaceable in tests
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        take tokens, going into debt if the bucket is short
+        returns:
+            seconds the caller must wait before using the reservation
+        """
+        with self.lock:
+            self._refill(self.clock())
+            # a single request larger than the bucket would otherwise never fit
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def sync(self, remaining: float, reset_in: Optional[float] = None) -> None:
+        """
+        align the bucket with the server's view of the quota
+        args:
+            remaining: tokens the server says are left
+            reset_in: seconds until the server refills the quota completely
+        """
+        with self.lock:
+            self._refill(self.clock())
+            if remaining < self.tokens:
+                self.tokens = remaining
+            if remaining <= 0 and reset_in:
+                # wait for the server's reset rather than the local refill rate
+                self.tokens = min(self.tokens, -reset_in * self.rate)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[float] = config.RATE_LIMIT_RPM,
+                 tokens_per_minute: Optional[float] = config.RATE_LIMIT_TPM,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        client-side limiter shared by every worker using one client, so
+        concurrent requests stay at the quota instead of bursting past it
+        args:
+            requests_per_minute: request quota, None for no limit
+            tokens_per_minute: input token quota, None for no limit
+        """
+        self.requests = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        reserve quota for a request without waiting
+        returns:
+            seconds the caller must wait before sending it
+        """
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self.lock:
+            wait = max(wait, self.paused_until - self.clock())
+        return max(wait, 0.0)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        block until a request of the given size may be sent
+        returns:
+            seconds spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """hold back every worker, e.g. after the server answered 429"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """sync the buckets with the anthropic-ratelimit-* response headers"""
+        for bucket, name in ((self.requests, "requests"), (self.tokens, "input-tokens")):
+            if bucket is None:
+                continue
+            remaining = headers.get(f"anthropic-ratelimit-{name}-remaining")
+            if remaining is None:
+                continue
+            reset = headers.get(f"anthropic-ratelimit-{name}-reset")
+            try:
+                bucket.sync(float(remaining), _parse_timestamp(reset) if reset else None)
+            except ValueError:
+                continue
@@ -0,0 +1,228 @@
+"""
+Named sessions for claude cli
+
+every interactive conversation is written turn by turn into one SQLite
+database, with a full-text index (FTS5) updated in the same transaction,
+so old discussions can be listed, searched and resumed by name instead of
+by file path. Resuming reads only the newest turns that fit the context
+budget; the per-turn token estimates are stored so finding where to start
+does not read the turns themselves.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import config
+from ratelimit import estimate_tokens
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        turns INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+    CREATE TABLE IF NOT EXISTS turns (
+        id INTEGER PRIMARY KEY,
+        session_id INTEGER NOT NULL REFERENCES sessions (id),
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        -- content that was not a plain string is stored as JSON
+        encoded INTEGER NOT NULL DEFAULT 0,
+        tokens INTEGER NOT NULL,
+        created REAL NOT NULL,
+        UNIQUE (session_id, seq)
+    );
+"""
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content)
+
+
+def fts_query(query: str) -> str:
+    """free text as an FTS5 query matching every word, so punctuation is not syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class Session:
+    """a named conversation in a SessionStore; its row is created by the first append"""
+
+    def __init__(self, sessions: "SessionStore", name: str) -> None:
+        self.sessions = sessions
+        self.name = name
+
+    def __len__(self) -> int:
+        return self.sessions.count(self.name)
+
+    def append(self, messages: Iterable[Dict[str, Any]]) -> None:
+        self.sessions.append(self.name, messages)
+
+    def tail(self, max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.sessions.tail(self.name, max_tokens)
+
+
+class SessionStore:
+    def __init__(self, path: str = config.SESSIONS_DB) -> None:
+        """
+        args:
+            path: SQLite database holding every session
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # several terminals may write sessions at once
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            try:
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts "
+                                "USING fts5(content, tokenize='unicode61')")
+                self.fts = True
+            except sqlite3.OperationalError:
+                # sqlite built without FTS5: search falls back to a table scan
+                self.fts = False
+
+    def new(self) -> Session:
+        """a session with a fresh name, e.g. 20240501-143210"""
+        name = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while self.exists(name if suffix == 1 else f"{name}-{suffix}"):
+            suffix += 1
+        return Session(self, name if suffix == 1 else f"{name}-{suffix}")
+
+    def open(self, name: str) -> Session:
+        """
+        an existing session
+        raises:
+            ValueError: if there is no session with that name
+        """
+        if not self.exists(name):
+            raise ValueError(config.ERROR_MESSAGES["session_not_found"].format(name))
+        return Session(self, name)
+
+    def exists(self, name: str) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM sessions WHERE name = ?",
+                                   (name,)).fetchone() is not None
+
+    def count(self, name: str) -> int:
+        with self.lock:
+            row = self.db.execute("SELECT turns FROM sessions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def append(self, name: str, messages: Iterable[Dict[str, Any]]) -> None:
+        """add messages to a session, creating it first if needed, and index them"""
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id, turns FROM sessions WHERE name = ?", (name,)).fetchone()
+            messages = list(messages)
+            if row is None:
+                first = next((m for m in messages if m.get("role") == "user"), None)
+                title = " ".join(_text(first["content"]).split())[:80] if first else ""
+                cursor = self.db.execute(
+                    "INSERT INTO sessions (name, title, created, updated) VALUES (?, ?, ?, ?)",
+                    (name, title, now, now))
+                row = (cursor.lastrowid, 0)
+            session_id, seq = row
+            for message in messages:
+                content = message["content"]
+                encoded = not isinstance(content, str)
+                stored = json.dumps(content, ensure_ascii=False) if encoded else content
+                text = _text(content)
+                cursor = self.db.execute(
+                    "INSERT INTO turns (session_id, seq, role, content, encoded, tokens, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, seq, message["role"], stored, encoded, estimate_tokens(text), now))
+                if self.fts:
+                    self.db.execute("INSERT INTO turns_fts (rowid, content) VALUES (?, ?)",
+                                    (cursor.lastrowid, text))
+                seq += 1
+            self.db.execute("UPDATE sessions SET turns = ?, updated = ? WHERE id = ?",
+                            (seq, now, session_id))
+
+    def tail(self, name: str, max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        newest messages of a session that fit a token budget, starting with a user message
+        args:
+            max_tokens: budget, None for the whole session
+        """
+        with self.lock:
+            row = self.db.execute("SELECT id FROM sessions WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise ValueError(config.ERROR_MESSAGES["session_not_found"].format(name))
+            session_id = row[0]
+            start = 0
+            if max_tokens is not None:
+                # only the stored estimates are read until the start is known
+                used = 0
+                oldest: Optional[int] = None
+                for seq, tokens in self.db.execute(
+                        "SELECT seq, tokens FROM turns WHERE session_id = ? ORDER BY seq DESC",
+                        (session_id,)):
+                    used += tokens
+                    if used > max_tokens and oldest is not None:
+                        break
+                    oldest = seq
+                start = oldest or 0
+            rows = self.db.execute(
+                "SELECT role, content, encoded FROM turns WHERE session_id = ? AND seq >= ? "
+                "ORDER BY seq", (session_id, start)).fetchall()
+        messages = [{"role": role, "content": json.loads(content) if encoded else content}
+                    for role, content, encoded in rows]
+        while messages and messages[0]["role"] != "user":
+            messages.pop(0)
+        return messages
+
+    def list(self, limit: int = config.SESSIONS_LIST_LIMIT) -> List[Dict[str, Any]]:
+        """the most recently updated sessions, newest first"""
+        with self.lock:
+            rows = self.db.execute("SELECT name, title, turns, updated FROM sessions "
+                                   "ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [{"name": name, "title": title, "turns": turns, "updated": updated}
+                for name, title, turns, updated in rows]
+
+    def search(self, query: str, limit: int = config.SESSIONS_LIST_LIMIT) -> List[Dict[str, Any]]:
+        """
+        turns containing every word of the query, best matches first
+        returns:
+            list: dicts with the session name, turn number, role and a snippet
+        """
+        if not query.split():
+            return []
+        with self.lock:
+            if self.fts:
+                rows = self.db.execute(
+                    "SELECT s.name, t.seq, t.role, "
+                    "snippet(turns_fts, 0, '[', ']', '...', 12) "
+                    "FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid "
+                    "JOIN sessions s ON s.id = t.session_id "
+                    "WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (fts_query(query), limit)).fetchall()
+            else:
+                words = query.split()
+                rows = self.db.execute(
+                    "SELECT s.name, t.seq, t.role, substr(t.content, 1, 80) "
+                    "FROM turns t JOIN sessions s ON s.id = t.session_id WHERE "
+                    + " AND ".join("t.content LIKE ?" for _ in words)
+                    + " ORDER BY t.id DESC LIMIT ?",
+                    [f"%{word}%" for word in words] + [limit]).fetchall()
+        return [{"name": name, "turn": seq, "role": role, "snippet": " ".join(snippet.split())}
+                for name, seq, role, snippet in rows]
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,328 @@
+"""
+Request instrumentation for claude cli
+
+every request gets a sample with its phase timings (dns, connect, tls,
+time to first byte and first token, total), payload sizes and token counts.
+Stats aggregates the samples of a session or batch run into percentiles
+and throughput for --stats and /stats, and can export them as JSONL (one
+line per request) or Prometheus text.
+
+Connection phases are timed by a urllib3 connection class mounted through
+timed_adapter; they are only present for requests that opened a new
+connection.
+"""
+
+import json
+import math
+import threading
+import time
+from array import array
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import config
+
+# the sample of the request in flight; a ContextVar so threads and asyncio
+# tasks each see their own
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_stats", default=None)
+
+# phases reported as latency percentiles, in seconds
+PHASES = ("dns", "connect", "tls", "ttfb", "ttft", "total")
+TOKEN_FIELDS = (("input", "input_tokens"), ("output", "output_tokens"),
+                ("cache_read", "cache_read_input_tokens"),
+                ("cache_write", "cache_creation_input_tokens"))
+
+
+def current() -> Optional[Dict[str, Any]]:
+    """the sample of the request being sent from this thread or task, if any"""
+    return _current.get()
+
+
+def add_time(phase: str, seconds: float) -> None:
+    """add to a phase of the current request; retried attempts add up"""
+    sample = _current.get()
+    if sample is not None:
+        sample[phase] = sample.get(phase, 0.0) + seconds
+
+
+def mark(phase: str) -> None:
+    """record the time since the current request started, once per phase"""
+    sample = _current.get()
+    if sample is not None and phase not in sample:
+        sample[phase] = time.perf_counter() - sample["start"]
+
+
+def set_value(name: str, value: Any) -> None:
+    sample = _current.get()
+    if sample is not None:
+        sample[name] = value
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """nearest-rank percentile of sorted values"""
+    # the epsilon keeps e.g. 0.95 * 100 from rounding up to rank 96
+    rank = math.ceil(fraction * len(values) - 1e-9)
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+class Stats:
+    def __init__(self, export_path: Optional[str] = None) -> None:
+        """
+        args:
+            export_path: optional metrics file; ".prom" files get Prometheus text
+                         when closed, anything else one JSON line per request
+        """
+        self.export_path = export_path
+        self.prometheus = bool(export_path) and export_path.endswith(config.STATS_PROMETHEUS_SUFFIX)
+        self._export = (open(export_path, "a", encoding="utf-8")
+                        if export_path and not self.prometheus else None)
+        self.lock = threading.Lock()
+        # phase -> seconds of every request that has it; arrays keep long batch runs small
+        self.series: Dict[str, "array[float]"] = {phase: array("d") for phase in PHASES}
+        self.series["tokens_per_second"] = array("d")
+        # cancelled requests, e.g. the losers of a race, are not failures
+        self.counts = {"requests": 0, "failed": 0, "cancelled": 0, "cached": 0, "retries": 0}
+        self.tokens = {name: 0 for name, _ in TOKEN_FIELDS}
+        self.bytes = {"sent": 0, "received": 0}
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+
+    def start(self, model: str, stream: bool) -> Dict[str, Any]:
+        """begin the sample of a request sent from the current thread or task"""
+        sample = {"model": model, "stream": stream, "start": time.perf_counter()}
+        sample["token"] = _current.set(sample)
+        return sample
+
+    def finish(self, sample: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        complete a sample with the outcome of send_message and record it
+        returns:
+            dict: per-request metrics, times in milliseconds
+        """
+        end = time.perf_counter()
+        _current.reset(sample.pop("token"))
+        start = sample.pop("start")
+        total = end - start
+        sample["total"] = total
+        if response.get("success") and "ttft" not in sample:
+            # without streaming the first token arrives with the whole body
+            sample["ttft"] = total
+        usage = response.get("usage") or {}
+        for name, field in TOKEN_FIELDS:
+            sample[f"{name}_tokens"] = usage.get(field, 0) or 0
+        generating = total - sample.get("ttft", total)
+        if sample["output_tokens"] and generating > 0 and not response.get("cached"):
+            sample["tokens_per_second"] = sample["output_tokens"] / generating
+
+        record = {"time": round(time.time(), 3), "success": bool(response.get("success")),
+                  "cached": bool(response.get("cached"))}
+        if response.get("cancelled") is True:
+            record["cancelled"] = True
+        for key, value in sample.items():
+            if key in PHASES:
+                value = round(value * 1000, 3)
+            elif isinstance(value, float):
+                value = round(value, 3)
+            record[key if key not in PHASES else f"{key}_ms"] = value
+        self.add(record, start, end)
+        return record
+
+    def add(self, record: Dict[str, Any], start: Optional[float] = None,
+            end: Optional[float] = None) -> None:
+        """aggregate a per-request record, e.g. one returned by a daemon"""
+        with self.lock:
+            cancelled = bool(record.get("cancelled"))
+            self.counts["requests"] += 1
+            self.counts["failed"] += not record.get("success") and not cancelled
+            self.counts["cancelled"] += cancelled
+            self.counts["cached"] += bool(record.get("cached"))
+            self.counts["retries"] += record.get("retries", 0)
+            for phase in PHASES:
+                # a cancelled request's timings say when it was given up on, not how fast it was
+                if f"{phase}_ms" in record and not cancelled:
+                    self.series[phase].append(record[f"{phase}_ms"] / 1000)
+            if "tokens_per_second" in record:
+                self.series["tokens_per_second"].append(record["tokens_per_second"])
+            if not record.get("cached"):
+                # replies from the response cache cost no tokens
+                for name, _ in TOKEN_FIELDS:
+                    self.tokens[name] += record.get(f"{name}_tokens", 0)
+            self.bytes["sent"] += record.get("request_bytes", 0)
+            self.bytes["received"] += record.get("response_bytes", 0)
+            if start is None:
+                end = time.perf_counter()
+                start = end - record.get("total_ms", 0) / 1000
+            self.first_start = start if self.first_start is None else min(self.first_start, start)
+            self.last_end = end if self.last_end is None else max(self.last_end, end)
+            if self._export:
+                self._export.write(json.dumps(record) + "\n")
+                self._export.flush()
+
+    def summary(self) -> Dict[str, Any]:
+        """counts, totals and p50/p95/p99 of every phase in milliseconds"""
+        with self.lock:
+            series = {name: sorted(values) for name, values in self.series.items()}
+            summary: Dict[str, Any] = dict(self.counts, tokens=dict(self.tokens),
+                                           bytes=dict(self.bytes))
+            span = (self.last_end - self.first_start) if self.first_start is not None else 0.0
+        summary["seconds"] = round(span, 3)
+        summary["output_tokens_per_second"] = (round(summary["tokens"]["output"] / span, 1)
+                                               if span > 0 else 0.0)
+        for name, values in series.items():
+            if not values:
+                continue
+            scale = 1 if name == "tokens_per_second" else 1000
+            summary[name] = {f"p{int(q * 100)}": round(percentile(values, q) * scale, 1)
+                             for q in config.STATS_PERCENTILES}
+            summary[name]["count"] = len(values)
+        return summary
+
+    def format(self) -> str:
+        """the --stats / /stats report"""
+        summary = self.summary()
+        lines = [f"[Stats - {summary['requests']} requests, {summary['failed']} failed, "
+                 f"{summary['cancelled']} cancelled, {summary['cached']} cached, {summary['retries']} retries, "
+                 f"{summary['seconds']}s]"]
+        for name in PHASES + ("tokens_per_second",):
+            if name not in summary:
+                continue
+            unit = " tok/s" if name == "tokens_per_second" else "ms"
+            values = "  ".join(f"{key} {value}{unit}" for key, value in summary[name].items()
+                               if key != "count")
+            lines.append(f"  {name:<18} {values}  (n={summary[name]['count']})")
+        tokens = summary["tokens"]
+        lines.append(f"  tokens             input {tokens['input']}  output {tokens['output']}  "
+                     f"cache read {tokens['cache_read']}  cache write {tokens['cache_write']}")
+        lines.append(f"  throughput         {summary['output_tokens_per_second']} output tok/s  "
+                     f"sent {summary['bytes']['sent']} B  received {summary['bytes']['received']} B")
+        return "\n".join(lines)
+
+    def prometheus_text(self) -> str:
+        """the summary in the Prometheus text exposition format"""
+        summary = self.summary()
+        prefix = config.STATS_METRIC_PREFIX
+        lines = [f"# HELP {prefix}_request_duration_seconds Request latency by phase",
+                 f"# TYPE {prefix}_request_duration_seconds summary"]
+        for phase in PHASES:
+            if phase not in summary:
+                continue
+            for q in config.STATS_PERCENTILES:
+                value = summary[phase][f"p{int(q * 100)}"] / 1000
+                lines.append(f'{prefix}_request_duration_seconds{{phase="{phase}",quantile="{q}"}} {value}')
+            with self.lock:
+                total = sum(self.series[phase])
+            lines.append(f'{prefix}_request_duration_seconds_sum{{phase="{phase}"}} {round(total, 6)}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{phase="{phase}"}} '
+                         f'{summary[phase]["count"]}')
+        lines += [f"# HELP {prefix}_requests_total Requests sent",
+                  f"# TYPE {prefix}_requests_total counter",
+                  f'{prefix}_requests_total{{outcome="success"}} '
+                  f'{summary["requests"] - summary["failed"] - summary["cancelled"]}',
+                  f'{prefix}_requests_total{{outcome="failure"}} {summary["failed"]}',
+                  f'{prefix}_requests_total{{outcome="cancelled"}} {summary["cancelled"]}',
+                  f"# HELP {prefix}_response_cache_hits_total Replies served from the response cache",
+                  f"# TYPE {prefix}_response_cache_hits_total counter",
+                  f"{prefix}_response_cache_hits_total {summary['cached']}",
+                  f"# HELP {prefix}_retries_total Retried attempts",
+                  f"# TYPE {prefix}_retries_total counter",
+                  f"{prefix}_retries_total {summary['retries']}",
+                  f"# HELP {prefix}_tokens_total Tokens by type",
+                  f"# TYPE {prefix}_tokens_total counter"]
+        lines += [f'{prefix}_tokens_total{{type="{name}"}} {count}'
+                  for name, count in summary["tokens"].items()]
+        lines += [f"# HELP {prefix}_bytes_total Request and response body bytes",
+                  f"# TYPE {prefix}_bytes_total counter"]
+        lines += [f'{prefix}_bytes_total{{direction="{name}"}} {count}'
+                  for name, count in summary["bytes"].items()]
+        lines += [f"# HELP {prefix}_output_tokens_per_second Output tokens per second over the run",
+                  f"# TYPE {prefix}_output_tokens_per_second gauge",
+                  f"{prefix}_output_tokens_per_second {summary['output_tokens_per_second']}"]
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        """write the Prometheus file, or close the JSONL export"""
+        if self.prometheus:
+            with open(self.export_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+        elif self._export:
+            self._export.close()
+            self._export = None
+
+
+_adapter_class: Optional[type] = None
+
+
+def timed_adapter(**kwargs: Any) -> Any:
+    """
+    a requests HTTPAdapter whose new connections report dns, connect and tls
+    time to the current sample. urllib3 is imported on first use.
+    """
+    global _adapter_class
+    if _adapter_class is None:
+        _adapter_class = _build_adapter_class()
+    return _adapter_class(**kwargs)
+
+
+def _build_adapter_class() -> type:
+    import socket
+
+    import requests.adapters
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import NewConnectionError
+
+    class TimedConnection:
+        def _new_conn(self) -> socket.socket:
+            if _current.get() is None:
+                return super()._new_conn()
+            start = time.perf_counter()
+            host = self._dns_host
+            try:
+                addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+            except OSError:
+                # let urllib3 raise its usual error
+                return super()._new_conn()
+            resolved = time.perf_counter()
+            add_time("dns", resolved - start)
+            # connect to the resolved addresses so the name is not looked up twice
+            candidates = list(dict.fromkeys(info[4][0] for info in addresses))
+            try:
+                for i, address in enumerate(candidates):
+                    self._dns_host = address
+                    try:
+                        sock = super()._new_conn()
+                        break
+                    except NewConnectionError:
+                        if i == len(candidates) - 1:
+                            raise
+            finally:
+                self._dns_host = host
+            self._stats_connected = time.perf_counter()
+            add_time("connect", self._stats_connected - resolved)
+            return sock
+
+        def connect(self) -> None:
+            self._stats_connected = None
+            super().connect()
+            if self._stats_connected is not None and isinstance(self, HTTPSConnection):
+                add_time("tls", time.perf_counter() - self._stats_connected)
+
+    class TimedHTTPConnection(TimedConnection, HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(TimedConnection, HTTPSConnection):
+        pass
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                       "https": TimedHTTPSConnectionPool}
+
+    return TimedHTTPAdapter
@@ -0,0 +1,163 @@
+"""
+Append-only conversation store for claude cli
+
+a conversation is a JSONL file with one message per line. Every message
+is appended and fsynced as its turn completes, so a crash can lose at most
+the turn in flight. A sidecar index of line offsets (<file>.idx) lets a
+huge conversation be opened by reading only the messages at its tail.
+"""
+
+import json
+import os
+import struct
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import config
+
+OFFSET = struct.Struct("<Q")
+
+
+class ConversationStore:
+    def __init__(self, path: str) -> None:
+        """
+        open or create a JSONL conversation, repairing the index and any
+        half-written last line left by a crash
+        """
+        self.path = path
+        self.index_path = path + config.STORE_INDEX_SUFFIX
+        self.offsets: List[int] = []
+        self._recover()
+
+    def _recover(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        data = b""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            usable = data[:len(data) - len(data) % OFFSET.size]
+            self.offsets = [offset for (offset,) in OFFSET.iter_unpack(usable) if offset < size]
+
+        # index every complete line written after the last indexed one
+        position = self.offsets[-1] if self.offsets else 0
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            if self.offsets:
+                position += len(f.readline())
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    break
+                self.offsets.append(position)
+                position += len(line)
+        if position < size:
+            # drop a half-written line from an interrupted append
+            with open(self.path, "r+b") as f:
+                f.truncate(position)
+        if len(data) != len(self.offsets) * OFFSET.size:
+            self._write_index(self.offsets, "wb")
+
+    def _write_index(self, offsets: List[int], mode: str) -> None:
+        with open(self.index_path, mode) as f:
+            f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def append(self, messages: Iterable[Dict[str, Any]]) -> None:
+        """append messages and fsync them to disk before returning"""
+        new_offsets = []
+        with open(self.path, "ab") as f:
+            position = f.tell()
+            for message in messages:
+                line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                new_offsets.append(position)
+                position += len(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_index(new_offsets, "ab")
+        self.offsets.extend(new_offsets)
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """stream messages[start:stop] without loading the rest of the file"""
+        stop = len(self.offsets) if stop is None else min(stop, len(self.offsets))
+        if start >= stop:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[start])
+            for _ in range(stop - start):
+                yield json.loads(f.readline())
+
+    def tail(self, max_tokens: Optional[int] = None,
+             estimate: Optional[Callable[[int], int]] = None) -> List[Dict[str, Any]]:
+        """
+        newest messages that fit in a token budget, starting with a user message
+        args:
+            max_tokens: budget, None for the whole conversation
+            estimate: tokens for a line of the given byte length; by default its
+                      length over config.CHARS_PER_TOKEN, as the context window counts
+        """
+        if estimate is None:
+            estimate = lambda size: size // config.CHARS_PER_TOKEN
+        start = 0
+        if max_tokens is not None:
+            # line lengths come from the index, so nothing is parsed until the start is known
+            end = os.path.getsize(self.path)
+            start = len(self.offsets)
+            used = 0
+            while start > 0:
+                used += estimate(end - self.offsets[start - 1])
+                if used > max_tokens and start < len(self.offsets):
+                    break
+                end = self.offsets[start - 1]
+                start -= 1
+
+        messages = list(self.read(start))
+        while messages and messages[0].get("role") != "user":
+            messages.pop(0)
+        return messages
+
+    def export_json(self, filename: str) -> None:
+        """write the conversation in the plain JSON format, one message at a time"""
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("[")
+            for i, message in enumerate(self.read()):
+                f.write(",\n  " if i else "\n  ")
+                f.write(json.dumps(message, ensure_ascii=False))
+            f.write("\n]\n" if self.offsets else "]\n")
+
+    @classmethod
+    def write(cls, filename: str, messages: Iterable[Dict[str, Any]]) -> "ConversationStore":
+        """replace filename with a new store holding messages"""
+        temp = filename + ".tmp"
+        for path in (temp, temp + config.STORE_INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        store = cls(temp)
+        store.append(messages)
+        # without an index the new file is rescanned, so a crash in between is harmless
+        if os.path.exists(filename + config.STORE_INDEX_SUFFIX):
+            os.remove(filename + config.STORE_INDEX_SUFFIX)
+        os.replace(temp, filename)
+        os.replace(store.index_path, filename + config.STORE_INDEX_SUFFIX)
+        return cls(filename)
+
+
+def conversation_path(name: str) -> str:
+    """
+    store file of a named conversation, creating the conversations directory
+    raises:
+        ValueError: if the name could escape the conversations directory
+    """
+    if not name or name.startswith(".") or os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError(config.ERROR_MESSAGES["invalid_conversation_name"].format(name))
+    os.makedirs(config.CONVERSATIONS_DIR, exist_ok=True)
+    return os.path.join(config.CONVERSATIONS_DIR, name + config.STORE_FILE_EXTENSION)
+
+
+def is_store_file(filename: str) -> bool:
+    """whether a conversation file uses the append-only JSONL format"""
+    return filename.endswith(config.STORE_FILE_EXTENSION)
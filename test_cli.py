@@ -4,12 +4,32 @@ import json
 import sys
 import os
 import requests
+import tempfile
+import time
+import asyncio
+import subprocess
 
 # add the parent dit to the path so we can import cli
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import cli
 import config
+import batch
+import bench
+import chunker
+import daemon
+import files
+import message_batches
+import ratelimit
+import sessions
+import stats
+from mock_server import MockAnthropicServer
+from cache import ResponseCache, cache_key
+from context import ContextManager
+from warmer import CacheWarmer
+from history import ConversationHistory, encode_payload
+from store import ConversationStore, conversation_path
+from async_client import AsyncClaudeCLI
 
 class TestClaudeCLI(unittest.TestCase):
     """test cases for the ClaudeCLI class."""
@@ -65,7 +85,7 @@ class TestClaudeCLI(unittest.TestCase):
             self.assertTrue(result)
 
             # verify the file opened correctly, and verify json was written 
-            mock_file.assert_called_once_with("test.json", 'w', encodings='utf-8')
+            mock_file.assert_called_once_with("test.json", 'w', encoding='utf-8')
             mock_file().write.assert_called()
 
     def test_load_conversation(self):
@@ -84,7 +104,28 @@ class TestClaudeCLI(unittest.TestCase):
             self.assertTrue(result)
             self.assertEqual(self.claude_cli.conversation_history, test_conversation)
 
-    @patch('requests.post')
+    def test_session_pooling(self):
+        """test requests share one pooled session with the api headers"""
+        self.assertIsInstance(self.claude_cli.session, requests.Session)
+        self.assertEqual(self.claude_cli.session.headers["x-api-key"], self.api_key)
+        adapter = self.claude_cli.session.get_adapter(config.API_BASE_URL)
+        self.assertEqual(adapter._pool_maxsize, config.POOL_MAXSIZE)
+        self.assertEqual(self.claude_cli.timeout,
+                         (config.CONNECT_TIMEOUT, config.READ_TIMEOUT))
+
+    def test_session_without_keep_alive(self):
+        """test keep-alive can be turned off"""
+        claude_cli = cli.ClaudeCLI(self.api_key, keep_alive=False)
+        self.assertEqual(claude_cli.session.headers["connection"], "close")
+
+    def test_prewarm(self):
+        """test prewarm opens a connection in the background and swallows errors"""
+        with patch.object(self.claude_cli.session, 'head',
+                          side_effect=requests.exceptions.ConnectionError("offline")) as mock_head:
+            self.claude_cli.prewarm().join(timeout=5)
+        mock_head.assert_called_once_with(config.API_BASE_URL, timeout=self.claude_cli.timeout)
+
+    @patch('requests.Session.post')
     def test_send_message_success(self, mock_post):
         """test successfil message sending"""
         mock_response = Mock()
@@ -105,7 +146,7 @@ class TestClaudeCLI(unittest.TestCase):
         self.assertEqual(len(self.claude_cli.conversation_history), 2)
 
 
-    @patch('request.post')
+    @patch('requests.Session.post')
     def test_send_message_api_error(self, mock_post):
         """test API error handling"""
         mock_post.side_effect = requests.exceptions.RequestException("Connection error")
@@ -118,6 +159,1723 @@ class TestClaudeCLI(unittest.TestCase):
         self.assertIn("API request failed", result["error"])
         self.assertIsNone(result["message"])
 
+    @patch('requests.Session.post')
+    def test_send_message_stream(self, mock_post):
+        """test streamed replies are rendered incrementally and assembled"""
+        events = [
+            {"type": "message_start", "message": {
+                "model": "claude-3-sonnet-20240229", "content": [],
+                "usage": {"input_tokens": 10, "output_tokens": 1}}},
+            {"type": "content_block_start", "index": 0,
+             "content_block": {"type": "text", "text": ""}},
+            {"type": "content_block_delta", "index": 0,
+             "delta": {"type": "text_delta", "text": "Hello"}},
+            {"type": "content_block_delta", "index": 0,
+             "delta": {"type": "text_delta", "text": " there"}},
+            {"type": "content_block_stop", "index": 0},
+            {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+             "usage": {"output_tokens": 2}},
+            {"type": "message_stop"},
+        ]
+        lines = []
+        for event in events:
+            lines += [f"event: {event['type']}".encode(), f"data: {json.dumps(event)}".encode(), b""]
+        mock_response = Mock()
+        mock_response.iter_lines.return_value = iter(lines)
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+
+        deltas = []
+        result = self.claude_cli.send_message("Hello", stream=True, on_text=deltas.append)
+
+        self.assertTrue(result["success"])
+        self.assertEqual(deltas, ["Hello", " there"])
+        self.assertEqual(result["message"], "Hello there")
+        self.assertEqual(result["usage"], {"input_tokens": 10, "output_tokens": 2})
+        self.assertTrue(json.loads(mock_post.call_args.kwargs["data"])["stream"])
+        self.assertEqual(self.claude_cli.conversation_history[-1],
+                         {"role": "assistant", "content": "Hello there"})
+
+    @patch('requests.Session.post')
+    def test_send_message_stream_error_event(self, mock_post):
+        """test an error event mid-stream leaves history untouched"""
+        error = {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}
+        mock_response = Mock()
+        mock_response.iter_lines.return_value = iter(
+            [b"event: error", f"data: {json.dumps(error)}".encode(), b""])
+        mock_response.raise_for_status.return_value = None
+        mock_post.return_value = mock_response
+
+        result = self.claude_cli.send_message("Hello", stream=True)
+
+        self.assertFalse(result["success"])
+        self.assertIn("Overloaded", result["error"])
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+class TestPromptCaching(unittest.TestCase):
+    """test cases for prompt-caching breakpoints"""
+
+    def setUp(self):
+        self.claude_cli = cli.ClaudeCLI("test_api_key")
+        self.history = [
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "Hi there"}
+        ]
+
+    def test_breakpoints_on_system_and_history_prefix(self):
+        messages = self.history + [{"role": "user", "content": "Next"}]
+        payload = self.claude_cli.build_payload(messages, system_prompt="Be brief")
+
+        self.assertEqual(payload["system"], [{"type": "text", "text": "Be brief",
+                                              "cache_control": {"type": "ephemeral"}}])
+        self.assertEqual(payload["messages"][1]["content"],
+                         [{"type": "text", "text": "Hi there",
+                           "cache_control": {"type": "ephemeral"}}])
+        self.assertEqual(payload["messages"][0], self.history[0])
+        self.assertEqual(payload["messages"][2], {"role": "user", "content": "Next"})
+        # history itself is left as plain strings
+        self.assertEqual(self.history[1]["content"], "Hi there")
+
+    def test_single_message_not_marked(self):
+        payload = self.claude_cli.build_payload([{"role": "user", "content": "Hi"}])
+        self.assertEqual(payload["messages"], [{"role": "user", "content": "Hi"}])
+        self.assertNotIn("system", payload)
+
+    def test_disabled(self):
+        claude_cli = cli.ClaudeCLI("test_api_key", prompt_cache=False)
+        messages = self.history + [{"role": "user", "content": "Next"}]
+        payload = claude_cli.build_payload(messages, system_prompt="Be brief")
+        self.assertEqual(payload["system"], "Be brief")
+        self.assertEqual(payload["messages"], messages)
+
+    def test_usage_line_shows_cache_tokens(self):
+        line = cli.format_usage({"usage": {"input_tokens": 5, "output_tokens": 7,
+                                           "cache_read_input_tokens": 1200,
+                                           "cache_creation_input_tokens": 30}})
+        self.assertIn("Cache read: 1200, Cache write: 30", line)
+
+class TestContextManager(unittest.TestCase):
+    """test cases for the context window manager"""
+
+    @staticmethod
+    def conversation(turns):
+        # every message is ~25 tokens of text plus framing
+        messages = []
+        for i in range(turns):
+            messages.append({"role": "user", "content": f"question {i} " + "q" * 100})
+            messages.append({"role": "assistant", "content": f"answer {i} " + "a" * 100})
+        return messages + [{"role": "user", "content": "newest"}]
+
+    def test_no_budget_sends_everything(self):
+        messages = self.conversation(5)
+        self.assertEqual(ContextManager(None).fit(messages), messages)
+
+    def test_trim_keeps_newest_within_budget(self):
+        manager = ContextManager(200)
+        messages = self.conversation(10)
+        window = manager.fit(messages)
+        self.assertEqual(window[-1], messages[-1])
+        self.assertEqual(window[0]["role"], "user")
+        self.assertLess(len(window), len(messages))
+        self.assertLessEqual(manager.last_tokens, 200)
+
+    def test_trim_window_start_is_stable(self):
+        """test the window start only moves once the budget is exceeded again"""
+        manager = ContextManager(300)
+        messages = self.conversation(20)
+        first = manager.fit(messages)
+        messages = messages[:-1] + [{"role": "assistant", "content": "short"},
+                                    {"role": "user", "content": "again"}]
+        second = manager.fit(messages)
+        self.assertEqual(second[0], first[0])
+
+    def test_counts_are_cached(self):
+        manager = ContextManager(200)
+        messages = self.conversation(3)
+        with patch('context.estimate_tokens', return_value=1) as mock_estimate:
+            manager.fit(messages)
+            manager.fit(messages)
+        self.assertEqual(mock_estimate.call_count, len(messages))
+
+    def test_summarize_replaces_dropped_turns(self):
+        transcripts = []
+        def summarizer(text):
+            transcripts.append(text)
+            return "they talked"
+        with patch.object(config, 'SUMMARY_MAX_TOKENS', 20):
+            manager = ContextManager(250, "summarize", summarizer)
+            messages = self.conversation(10)
+            window = manager.fit(messages)
+            manager.fit(messages)
+
+        self.assertEqual(window[0]["content"], config.SUMMARY_PREFIX + "they talked")
+        self.assertEqual(window[1]["role"], "assistant")
+        self.assertEqual(window[-1], messages[-1])
+        self.assertIn("question 0", transcripts[0])
+        # the summary is reused while the window start is unchanged
+        self.assertEqual(len(transcripts), 1)
+
+    def test_peek_leaves_the_window(self):
+        manager = ContextManager(300)
+        messages = self.conversation(20)
+        window = manager.fit(messages)
+        longer = messages + [{"role": "assistant", "content": "a" * 400},
+                             {"role": "user", "content": "next"}]
+        peeked = manager.peek(longer)
+        self.assertEqual(peeked[-1], longer[-1])
+        # fit would move the start; peeking does not, so fit still sees the old one
+        self.assertNotEqual(peeked[0], window[0])
+        self.assertEqual(manager.fit(messages), window)
+
+    def test_peek_needs_the_summary(self):
+        with patch.object(config, 'SUMMARY_MAX_TOKENS', 20):
+            manager = ContextManager(250, "summarize", lambda text: "they talked")
+            messages = self.conversation(10)
+            self.assertIsNone(manager.peek(messages))
+            window = manager.fit(messages)
+            self.assertEqual(manager.peek(messages), window)
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(ValueError):
+            ContextManager(100, "forget")
+
+    @patch('requests.Session.post')
+    def test_send_message_applies_budget(self, mock_post):
+        """test only the window is sent while the full history is kept"""
+        mock_response = Mock()
+        mock_response.json.return_value = {"content": [{"text": "ok"}], "usage": {}}
+        mock_post.return_value = mock_response
+        claude_cli = cli.ClaudeCLI("test_api_key", context_budget=200, prompt_cache=False)
+        claude_cli.conversation_history = self.conversation(10)[:-1]
+
+        claude_cli.send_message("newest")
+
+        sent = json.loads(mock_post.call_args.kwargs["data"])["messages"]
+        self.assertLess(len(sent), 20)
+        self.assertEqual(len(claude_cli.conversation_history), 22)
+
+class TestHistory(unittest.TestCase):
+    """test the encoded conversation history and request windows"""
+
+    def setUp(self):
+        self.messages = TestContextManager.conversation(6)[:-1]
+        self.messages[3] = {"role": "assistant", "content": [{"type": "text", "text": "blocks é"}]}
+        self.history = ConversationHistory(self.messages)
+
+    def test_reads_like_a_list(self):
+        self.assertEqual(self.history, self.messages)
+        self.assertEqual(self.messages, self.history)
+        self.assertEqual(self.history[-2:], self.messages[-2:])
+        self.assertEqual(list(self.history), self.messages)
+        self.history.append({"role": "user", "content": "more"})
+        self.assertNotEqual(self.history, self.messages)
+        claude_cli = cli.ClaudeCLI("test_api_key")
+        claude_cli.conversation_history = self.messages
+        self.assertIsInstance(claude_cli.conversation_history, ConversationHistory)
+
+    def test_edits_like_a_list(self):
+        expected = list(self.messages)
+        edits = [lambda m: m.__setitem__(2, {"role": "user", "content": "edited"}),
+                 lambda m: m.insert(-1, {"role": "assistant", "content": "inserted"}),
+                 lambda m: m.__delitem__(slice(0, 2)),
+                 lambda m: m.pop(),
+                 lambda m: m.remove(expected[0])]
+        for edit in edits:
+            edit(self.history)
+            edit(expected)
+            self.assertEqual(self.history, expected)
+            # the encoded buffer and token sums follow the edit
+            self.assertEqual(json.loads((self.history + []).encode()), expected)
+            self.assertEqual(self.history.tokens(), ContextManager(None).total(expected))
+        self.history.clear()
+        self.assertEqual(self.history, [])
+
+    def test_item_edits_write_back(self):
+        """test changing an item's keys re-encodes it, as if the history were a list of dicts"""
+        first, last = self.history[0], self.history[-1]
+        first["content"] = "changed"
+        last.update(content="also changed")
+        self.messages[0]["content"] = "changed"
+        self.messages[-1]["content"] = "also changed"
+        self.assertEqual(self.history, self.messages)
+        self.assertEqual(json.loads(b"[" + self.history.encoded() + b"]"), self.messages)
+        self.assertEqual(self.history.tokens(), ContextManager(None).total(self.messages))
+        # the history stays as it was when an edit leaves no valid message
+        with self.assertRaises(KeyError):
+            first.pop("role")
+        self.assertEqual(first["role"], "user")
+        # content blocks are copies; assign the content to change them
+        blocks = self.history[3]["content"]
+        blocks.append({"type": "text", "text": "lost"})
+        self.assertEqual(self.history[3], self.messages[3])
+        # an item removed from the history is a plain dict again
+        del self.history[0]
+        first["content"] = "gone"
+        self.assertEqual(self.history, self.messages[1:])
+
+    def test_window_matches_list(self):
+        new = [{"role": "user", "content": "newest"}]
+        window = self.history + new
+        expected = self.messages + new
+        for index in [slice(3, None), slice(None, -2), slice(-1, None), slice(2, 5),
+                      slice(20, None), slice(0, 0)]:
+            self.assertEqual(window[index], expected[index], index)
+            self.assertEqual(json.loads(window[index].encode()), expected[index], index)
+        summary = [{"role": "user", "content": "summary"}, {"role": "assistant", "content": "ok"}]
+        self.assertEqual(summary + window[4:], summary + expected[4:])
+        self.assertEqual((summary + window[4:])[1:-1], (summary + expected[4:])[1:-1])
+        self.assertEqual(window[-1], new[0])
+        manager = ContextManager(None)
+        self.assertEqual(manager.total(window[5:]), manager.total(expected[5:]))
+
+    def test_payload_encoding(self):
+        claude_cli = cli.ClaudeCLI("test_api_key", context_budget=300)
+        claude_cli.conversation_history = self.messages
+        messages = claude_cli.context.fit(claude_cli.conversation_history + [
+            {"role": "user", "content": "newest"}], "Be brief")
+        payload = claude_cli.build_payload(messages, system_prompt="Be brief", stream=True,
+                                           splice=True)
+        expected = claude_cli.build_payload(messages, system_prompt="Be brief", stream=True)
+        self.assertIsInstance(expected["messages"], list)
+        self.assertEqual(json.loads(json.dumps(expected)), expected)
+        self.assertEqual(json.loads(encode_payload(payload)), expected)
+        self.assertEqual(cache_key(payload), cache_key(expected))
+        self.assertEqual(json.loads(encode_payload({"messages": self.history + []})),
+                         {"messages": self.messages})
+
+    def test_turns_sent_to_server(self):
+        with MockAnthropicServer() as server:
+            claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+            claude_cli.base_url = server.url
+            for message in ["one", "two", "three"]:
+                self.assertTrue(claude_cli.send_message(message)["success"])
+            claude_cli.close()
+        sent = server.requests[-1]["messages"]
+        self.assertEqual([m["role"] for m in sent], ["user", "assistant"] * 2 + ["user"])
+        self.assertEqual(sent[3]["content"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(claude_cli.conversation_history[4], {"role": "user", "content": "three"})
+
+    def test_turn_cost_flat(self):
+        """the window past the context budget is the same size, so a turn costs the same"""
+        def cost(messages):
+            claude_cli = cli.ClaudeCLI("test_api_key", context_budget=20000)
+            claude_cli.conversation_history = messages
+            new = [{"role": "user", "content": "newest"}]
+
+            def turn():
+                encode_payload(claude_cli.build_payload(
+                    claude_cli.context.fit(claude_cli.conversation_history + new), splice=True))
+            return bench.measure(turn, rounds=20)["min_ms"]
+
+        messages = TestContextManager.conversation(10000)[:-1]
+        self.assertLess(cost(messages), cost(messages[:4000]) * 3 + 0.5)
+
+class TestConversationStore(unittest.TestCase):
+    """test cases for the append-only conversation store"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "chat.jsonl")
+        self.messages = []
+        for i in range(10):
+            self.messages.append({"role": "user", "content": f"question {i}"})
+            self.messages.append({"role": "assistant", "content": f"answer {i} " + "a" * 40})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_and_read(self):
+        store = ConversationStore(self.path)
+        store.append(self.messages[:4])
+        store.append(self.messages[4:])
+        reopened = ConversationStore(self.path)
+        self.assertEqual(len(reopened), 20)
+        self.assertEqual(list(reopened.read()), self.messages)
+        self.assertEqual(list(reopened.read(18)), self.messages[18:])
+
+    def test_tail_within_budget(self):
+        """test only the newest messages are read and the tail opens on a user turn"""
+        store = ConversationStore(self.path)
+        store.append(self.messages)
+        tail = store.tail(40)
+        self.assertEqual(tail, self.messages[-len(tail):])
+        self.assertEqual(tail[0]["role"], "user")
+        self.assertLess(len(tail), 20)
+        self.assertEqual(store.tail(), self.messages)
+
+    def test_recovers_from_crash(self):
+        """test a lost index is rebuilt and a half-written line is dropped"""
+        store = ConversationStore(self.path)
+        store.append(self.messages[:2])
+        with open(self.path, "ab") as f:
+            f.write(json.dumps(self.messages[2]).encode() + b"\n" + b'{"role": "assis')
+        os.remove(store.index_path)
+
+        recovered = ConversationStore(self.path)
+        self.assertEqual(list(recovered.read()), self.messages[:3])
+        recovered.append(self.messages[3:4])
+        self.assertEqual(list(ConversationStore(self.path).read()), self.messages[:4])
+
+    def test_export_json(self):
+        store = ConversationStore(self.path)
+        store.append(self.messages)
+        export = os.path.join(self.tmpdir.name, "chat.json")
+        store.export_json(export)
+        with open(export, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), self.messages)
+
+    @patch('requests.Session.post')
+    def test_turns_are_appended_as_they_complete(self, mock_post):
+        mock_response = Mock()
+        mock_response.json.return_value = {"content": [{"text": "Hi there"}], "usage": {}}
+        mock_post.return_value = mock_response
+        claude_cli = cli.ClaudeCLI("test_api_key")
+        claude_cli.conversation_history = self.messages[:2]
+        self.assertTrue(claude_cli.attach_store(self.path))
+
+        claude_cli.send_message("Hello")
+        # e.g. a map-reduced file
+        claude_cli.record_turn("Summarize big.txt", "It is big")
+
+        self.assertEqual(list(ConversationStore(self.path).read()), self.messages[:2] + [
+            {"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi there"},
+            {"role": "user", "content": "Summarize big.txt"},
+            {"role": "assistant", "content": "It is big"}])
+
+    def test_load_and_save_round_trip(self):
+        """test JSON imports into a store and a tail-loaded store exports in full"""
+        source = os.path.join(self.tmpdir.name, "old.json")
+        with open(source, "w", encoding="utf-8") as f:
+            json.dump(self.messages, f)
+        claude_cli = cli.ClaudeCLI("test_api_key", context_budget=40)
+        self.assertTrue(claude_cli.load_conversation(source))
+        self.assertTrue(claude_cli.save_conversation(self.path))
+
+        claude_cli.load_conversation(self.path)
+        self.assertLess(len(claude_cli.conversation_history), 20)
+        export = os.path.join(self.tmpdir.name, "new.json")
+        self.assertTrue(claude_cli.save_conversation(export))
+        with open(export, encoding="utf-8") as f:
+            self.assertEqual(json.load(f), self.messages)
+
+class TestSessions(unittest.TestCase):
+    """test named sessions in a temporary database"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = sessions.SessionStore(os.path.join(self.tmpdir.name, "sessions.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_append_and_tail(self):
+        session = self.store.new()
+        self.assertEqual(len(session), 0)
+        with self.assertRaises(ValueError):
+            self.store.open(session.name)
+        session.append([{"role": "user", "content": "first question"},
+                        {"role": "assistant", "content": [{"type": "text", "text": "blocks"}]}])
+        for i in range(10):
+            session.append([{"role": "user", "content": "q" * 400},
+                            {"role": "assistant", "content": "a" * 400}])
+        self.assertEqual(len(self.store.open(session.name)), 22)
+        self.assertEqual(session.tail()[1]["content"], [{"type": "text", "text": "blocks"}])
+        # the newest turns under the budget, starting with a user message
+        tail = session.tail(250)
+        self.assertEqual(len(tail), 2)
+        self.assertEqual(tail[0]["role"], "user")
+        self.assertEqual(self.store.list()[0]["title"], "first question")
+        self.assertNotEqual(self.store.new().name, session.name)
+
+    def test_search(self):
+        for i in range(200):
+            session = self.store.new() if i % 50 == 0 else session
+            session.append([{"role": "user", "content": f"question {i} about topic{i % 7}"},
+                            {"role": "assistant", "content": "an answer"}])
+        session.append([{"role": "user", "content": "how do I rotate a (binary) tree?"}])
+        results = self.store.search("rotate tree")
+        self.assertEqual(len(results), 1)
+        self.assertEqual((results[0]["name"], results[0]["role"]), (session.name, "user"))
+        # punctuation is not query syntax
+        self.assertEqual(len(self.store.search("(binary)")), 1)
+        self.assertEqual(len(self.store.search("topic3", limit=100)), 29)
+        self.assertEqual(self.store.search("   "), [])
+
+    def test_search_scales(self):
+        session = self.store.new()
+        session.append({"role": "user" if i % 2 == 0 else "assistant",
+                        "content": f"turn {i} mentions word{i}"} for i in range(20000))
+        start = time.perf_counter()
+        results = self.store.search("word12345")
+        self.assertEqual([r["turn"] for r in results], [12345])
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_interactive_commands(self):
+        server = MockAnthropicServer().start()
+        claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        claude_cli.base_url = server.url
+        try:
+            with patch('builtins.input', side_effect=["hello there", "clear", "second", "quit"]), \
+                    patch('sys.stdout'):
+                cli.interactive_mode(claude_cli, config.DEFAULT_MODEL, 100, stream=False,
+                                     session_store=self.store)
+            listed = self.store.list()
+            self.assertEqual(sorted(row["title"] for row in listed), ["hello there", "second"])
+            first = next(row["name"] for row in listed if row["title"] == "hello there")
+            self.assertEqual(self.store.search("hello")[0]["name"], first)
+
+            with patch('builtins.input', side_effect=[f"/resume {first}", "more", "q"]), \
+                    patch('sys.stdout'):
+                cli.interactive_mode(claude_cli, config.DEFAULT_MODEL, 100, stream=False,
+                                     session_store=self.store)
+            self.assertEqual(len(self.store.open(first)), 4)
+            messages = server.requests[-1]["messages"]
+            self.assertEqual((len(messages), messages[0]["content"]), (3, "hello there"))
+        finally:
+            claude_cli.close()
+            server.stop()
+
+
+class TestBatch(unittest.TestCase):
+    """test cases for batch mode"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, "results.jsonl")
+        self.claude_cli = Mock()
+        self.claude_cli.complete.side_effect = self.fake_complete
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def fake_complete(message, model, max_tokens, system_prompt):
+        # later prompts finish first so completion order differs from input order
+        time.sleep(0.05 / int(message.split()[-1]))
+        return {"success": True, "message": f"re: {message}", "usage": {}, "model": model}
+
+    def read_output(self):
+        with open(self.output, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_load_prompts_jsonl(self):
+        """test JSONL prompts get ids and accept 'prompt' as an alias"""
+        path = os.path.join(self.tmpdir.name, "prompts.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"id": "a", "message": "hi"}\n\n{"prompt": "yo", "model": "m"}\n')
+        prompts = list(batch.load_prompts(path))
+        self.assertEqual([p["id"] for p in prompts], ["a", "3"])
+        self.assertEqual(prompts[1]["message"], "yo")
+        self.assertEqual(prompts[1]["model"], "m")
+
+    def test_load_prompts_invalid_line(self):
+        """test a malformed JSONL line raises ValueError with its line number"""
+        path = os.path.join(self.tmpdir.name, "prompts.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"id": "a"}\n')
+        with self.assertRaises(ValueError) as context:
+            list(batch.load_prompts(path))
+        self.assertIn("line 1", str(context.exception))
+
+    def test_load_prompts_directory(self):
+        """test every non-empty file in a directory is one prompt"""
+        for name, text in [("b.txt", "second"), ("a.txt", "first"), ("empty.txt", " ")]:
+            with open(os.path.join(self.tmpdir.name, name), "w", encoding="utf-8") as f:
+                f.write(text)
+        prompts = list(batch.load_prompts(self.tmpdir.name))
+        self.assertEqual([(p["id"], p["message"]) for p in prompts],
+                         [("a.txt", "first"), ("b.txt", "second")])
+
+    def test_run_batch_input_order(self):
+        """test results are written in input order"""
+        prompts = [{"id": str(i), "message": f"prompt {i}"} for i in range(1, 7)]
+        counts = batch.run_batch(self.claude_cli, prompts, self.output, concurrency=3)
+        self.assertEqual(counts, {"succeeded": 6, "failed": 0, "skipped": 0})
+        self.assertEqual([r["id"] for r in self.read_output()], [str(i) for i in range(1, 7)])
+
+    def test_run_batch_completion_order(self):
+        """test completion order writes every result once"""
+        prompts = [{"id": str(i), "message": f"prompt {i}"} for i in range(1, 5)]
+        batch.run_batch(self.claude_cli, prompts, self.output, concurrency=4, ordered=False)
+        ids = [r["id"] for r in self.read_output()]
+        self.assertEqual(sorted(ids), ["1", "2", "3", "4"])
+        self.assertNotEqual(ids, ["1", "2", "3", "4"])
+
+    def test_run_batch_resume(self):
+        """test prompts that already succeeded are skipped"""
+        with open(self.output, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "1", "success": True}) + "\n")
+            f.write(json.dumps({"id": "2", "success": False}) + "\n")
+            f.write('{"id": "3", "succ')
+        prompts = [{"id": str(i), "message": f"prompt {i}"} for i in range(1, 4)]
+        counts = batch.run_batch(self.claude_cli, prompts, self.output)
+        self.assertEqual(counts, {"succeeded": 2, "failed": 0, "skipped": 1})
+        sent = [c.args[0] for c in self.claude_cli.complete.call_args_list]
+        self.assertEqual(sorted(sent), ["prompt 2", "prompt 3"])
+        self.assertEqual(batch.completed_ids(self.output), {"1", "2", "3"})
+
+class TestChunker(unittest.TestCase):
+    """test splitting large files and map-reducing them against a local stub server"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "big.txt")
+        # 30 paragraphs of 3 lines, 40 chars (10 tokens) per line
+        with open(self.path, "w", encoding="utf-8") as f:
+            for p in range(30):
+                for l in range(3):
+                    f.write(f"paragraph {p:02d} line {l} ".ljust(39, ".") + "\n")
+                f.write("\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_chunked_only_past_the_context_budget(self):
+        """test -f files are map-reduced when over the context budget, not the chunk size"""
+        tokens = os.path.getsize(self.path) // config.CHARS_PER_TOKEN
+        self.assertTrue(cli.exceeds_budget(self.path, tokens - 100))
+        self.assertFalse(cli.exceeds_budget(self.path, tokens + 100))
+        # --context-budget 0 sends everything
+        self.assertFalse(cli.exceeds_budget(self.path, 0))
+
+    def chunks(self, *args):
+        with open(self.path, encoding="utf-8") as f:
+            return list(chunker.iter_chunks(f, *args))
+
+    def test_line_chunks_cover_file_with_overlap(self):
+        chunks = self.chunks(50, 10, "line")
+        self.assertGreater(len(chunks), 1)
+        for first, last, text in chunks:
+            self.assertLessEqual(len(text), 50 * config.CHARS_PER_TOKEN)
+            self.assertEqual(text.count("\n"), last - first + 1)
+        # each chunk starts within the previous one
+        for (_, previous_last, _), (first, _, _) in zip(chunks, chunks[1:]):
+            self.assertLessEqual(first, previous_last)
+        self.assertEqual(chunks[0][0], 1)
+        self.assertEqual(chunks[-1][1], 120)
+
+    def test_paragraph_boundaries(self):
+        for first, last, text in self.chunks(100, 0, "paragraph"):
+            self.assertTrue(text.startswith("paragraph"))
+            self.assertTrue(text.endswith("\n\n") or last == 120)
+        # without overlap the chunks partition the file
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual("".join(text for _, _, text in self.chunks(100, 0)), f.read())
+
+    def test_long_line_is_split(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("x" * 1000)
+        chunks = self.chunks(10, 0, "line")
+        self.assertEqual(len(chunks), 25)
+        self.assertTrue(all(first == last == 1 for first, last, _ in chunks))
+
+    def test_map_reduce_resumes(self):
+        work_dir = os.path.join(self.tmpdir.name, "work")
+        with MockAnthropicServer() as server:
+            claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+            claude_cli.base_url = server.url
+            progress = []
+            result = chunker.map_reduce(claude_cli, self.path, "Count the lines.", chunk_tokens=300,
+                                        overlap_tokens=0, work_dir=work_dir,
+                                        on_progress=lambda *p: progress.append(p))
+            self.assertTrue(result["success"], result)
+            self.assertEqual(result["message"], "Hello from the mock server")
+            total = result["chunks"]
+            self.assertGreater(total, 1)
+            self.assertIn(("map", total, total), progress)
+            self.assertEqual(len(server.requests), total + 1)
+            self.assertIn("Count the lines.", server.requests[-1]["messages"][0]["content"])
+
+            # a second run only repeats the final reduce
+            chunker.map_reduce(claude_cli, self.path, "Count the lines.", chunk_tokens=300,
+                               overlap_tokens=0, work_dir=work_dir)
+            self.assertEqual(len(server.requests), total + 2)
+            claude_cli.close()
+
+    def test_map_reduce_reduces_in_rounds(self):
+        with MockAnthropicServer(reply="partial answer " * 20) as server:
+            claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+            claude_cli.base_url = server.url
+            result = chunker.map_reduce(claude_cli, self.path, chunk_tokens=200, overlap_tokens=0,
+                                        work_dir=os.path.join(self.tmpdir.name, "work"))
+            claude_cli.close()
+        self.assertTrue(result["success"], result)
+        # more requests than chunks plus one: answers were combined in groups first
+        self.assertGreater(len(server.requests), result["chunks"] + 1)
+
+class TestFiles(unittest.TestCase):
+    """test -f over several files against a local stub server"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "src")
+        for name in ["a.py", "b.py", "pkg/c.py", "notes.txt", ".hidden/d.py"]:
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {name}\n")
+        self.output = os.path.join(self.tmpdir.name, "results.jsonl")
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        self.claude_cli.base_url = self.server.url
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def test_expand_paths(self):
+        paths = files.expand_paths([os.path.join(self.root, "**", "*.py")])
+        self.assertEqual([os.path.relpath(p, self.root) for p in paths],
+                         ["a.py", "b.py", os.path.join("pkg", "c.py")])
+        # directories skip hidden entries; repeated files are listed once
+        paths = files.expand_paths([self.root, os.path.join(self.root, "a.py")])
+        self.assertEqual(len(paths), 4)
+        with self.assertRaises(ValueError):
+            files.expand_paths([os.path.join(self.root, "*.rs")])
+
+    def test_render(self):
+        self.assertEqual(files.render("Review {path}:\n{content}", "a.py", "x = {}"),
+                         "Review a.py:\nx = {}")
+        self.assertEqual(files.render("Summarize", "a.py", "text"), "Summarize\n\ntext")
+
+    def run_files(self, **kwargs):
+        paths = files.expand_paths([self.root])
+        return files.run_files(self.claude_cli, paths, self.output, "Review {path}", **kwargs)
+
+    def test_unchanged_files_skipped(self):
+        output_dir = os.path.join(self.tmpdir.name, "replies")
+        counts = self.run_files(output_dir=output_dir)
+        self.assertEqual((counts["succeeded"], counts["unchanged"]), (4, 0))
+        # files are sent concurrently, in any order
+        self.assertIn(f"Review {os.path.join(self.root, 'a.py')}\n\n# a.py\n",
+                      [r["messages"][0]["content"] for r in self.server.requests])
+        with open(files.output_file(output_dir, os.path.join(self.root, "pkg", "c.py"))) as f:
+            self.assertEqual(f.read(), "Hello from the mock server\n")
+
+        with open(os.path.join(self.root, "b.py"), "a", encoding="utf-8") as f:
+            f.write("changed\n")
+        counts = self.run_files(output_dir=output_dir)
+        self.assertEqual((counts["succeeded"], counts["unchanged"]), (1, 3))
+        self.assertEqual(len(self.server.requests), 5)
+
+        # a different template changes every reply
+        paths = files.expand_paths([self.root])
+        counts = files.run_files(self.claude_cli, paths, self.output, "Explain {path}")
+        self.assertEqual(counts["succeeded"], 4)
+        with open(self.output, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 9)
+
+    def test_unreadable_and_failed_files(self):
+        with open(os.path.join(self.root, "image.png"), "wb") as f:
+            f.write(b"\x89PNG\xff\xfe")
+        self.server.enqueue(400)
+        counts = self.run_files(concurrency=1)
+        self.assertEqual(counts, {"succeeded": 3, "failed": 1, "unchanged": 0, "unreadable": 1})
+        # only the failed file is sent again
+        counts = self.run_files(concurrency=1)
+        self.assertEqual(counts, {"succeeded": 1, "failed": 0, "unchanged": 3, "unreadable": 1})
+
+class TestMessageBatches(unittest.TestCase):
+    """test cases for the Message Batches workflow against the mock server's batch endpoints"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, "results.jsonl")
+        self.server = MockAnthropicServer(batch_polls=2).start()
+        # the batch endpoints hang off the configured Messages API url
+        with patch.object(config, "API_BASE_URL", self.server.url):
+            self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=2)
+        self.claude_cli.retry_policy.base_delay = 0.01
+        self.sleeps = []
+        self.batches = message_batches.MessageBatches(self.claude_cli, self.output,
+                                                      poll_interval=1, sleep=self.sleeps.append)
+        self.prompts = [{"id": f"p{i}", "message": f"prompt {i}"} for i in range(5)]
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def read_output(self):
+        with open(self.output, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_chunking_by_count_and_size(self):
+        encoded = list(message_batches.build_requests(self.claude_cli, self.prompts))
+        self.assertEqual([len(c) for c in message_batches.chunk_requests(encoded, max_requests=2)],
+                         [2, 2, 1])
+        size = len(encoded[0][2]) * 3
+        chunks = list(message_batches.chunk_requests(encoded, max_bytes=size))
+        for chunk in chunks:
+            self.assertLessEqual(len(b",".join(r for _, _, r in chunk)) + message_batches.ENVELOPE_BYTES, size)
+        with self.assertRaises(ValueError):
+            list(message_batches.chunk_requests(encoded, max_bytes=10))
+
+    def test_request_params_match_send_message(self):
+        _, _, request = next(message_batches.build_requests(self.claude_cli, self.prompts[:1],
+                                                            system_prompt="be brief"))
+        params = json.loads(request)["params"]
+        self.assertEqual(params, self.claude_cli.build_payload(
+            [{"role": "user", "content": "prompt 0"}], system_prompt="be brief"))
+
+    def test_custom_id(self):
+        self.assertEqual(message_batches.custom_id("abc_1-2"), "abc_1-2")
+        hashed = message_batches.custom_id("docs/a b.txt")
+        self.assertRegex(hashed, r"^[A-Za-z0-9_-]{1,64}$")
+
+    def test_submit_and_collect(self):
+        self.server.batch_errors.add("p3")
+        counts = self.batches.submit(self.prompts, max_requests=2)
+        self.assertEqual(counts, {"submitted": 5, "skipped": 0, "batches": 3})
+        self.assertEqual(len(self.server.batches), 3)
+
+        counts = self.batches.collect()
+        self.assertEqual(counts, {"succeeded": 4, "failed": 1, "skipped": 0, "batches": 3})
+        records = {r["id"]: r for r in self.read_output()}
+        self.assertEqual(records["p0"]["message"], self.server.reply)
+        self.assertEqual(records["p0"]["stop_reason"], "end_turn")
+        self.assertFalse(records["p3"]["success"])
+        self.assertIn("mock batch error", records["p3"]["error"])
+        self.assertIsNone(records["p3"]["stop_reason"])
+        # two in-progress checks per batch, with growing waits
+        self.assertEqual(self.sleeps[:2], [1, 1.5])
+        self.assertEqual(self.batches.pending(), [])
+
+    def test_resubmit_skips_pending_and_done(self):
+        self.batches.submit(self.prompts[:3])
+        self.batches.collect()
+        counts = self.batches.submit(self.prompts)
+        self.assertEqual(counts, {"submitted": 2, "skipped": 3, "batches": 1})
+        counts = self.batches.submit(self.prompts)
+        self.assertEqual(counts["submitted"], 0)
+
+    def test_path_ids_round_trip(self):
+        self.batches.submit([{"id": "docs/a b.txt", "message": "hi"}])
+        self.batches.collect()
+        self.assertEqual(self.read_output()[0]["id"], "docs/a b.txt")
+
+    def test_submit_retries_overload(self):
+        self.server.enqueue(529)
+        counts = self.batches.submit(self.prompts)
+        self.assertEqual(counts["batches"], 1)
+
+class TestRaceAndCompare(unittest.TestCase):
+    """test sending one turn to several models against a local stub server"""
+
+    def setUp(self):
+        self.server = MockAnthropicServer(model_latency={"slow": 0.5}).start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        self.claude_cli.base_url = self.server.url
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+
+    def test_race_keeps_first_to_stream(self):
+        deltas = []
+        start = time.perf_counter()
+        result = self.claude_cli.race("Hello", ["slow", "fast"], on_text=deltas.append)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["model"], "fast")
+        self.assertEqual(result["cancelled"], ["slow"])
+        self.assertEqual("".join(deltas), result["message"])
+        self.assertEqual(self.claude_cli.conversation_history, [
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": result["message"]}])
+
+    def test_race_losers_not_failed_in_stats(self):
+        self.claude_cli.race("Hello", ["slow", "fast"])
+        # the loser is recorded once its cancelled request returns
+        deadline = time.perf_counter() + 2
+        while self.claude_cli.stats.summary()["requests"] < 2 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        summary = self.claude_cli.stats.summary()
+        self.assertEqual((summary["requests"], summary["failed"], summary["cancelled"]), (2, 0, 1))
+        self.assertIn("0 failed, 1 cancelled", self.claude_cli.stats.format())
+        self.assertIn('claude_cli_requests_total{outcome="success"} 1',
+                      self.claude_cli.stats.prometheus_text())
+
+    def test_cancelled_before_sending(self):
+        import threading
+
+        cancel = threading.Event()
+        cancel.set()
+        result = self.claude_cli._send([{"role": "user", "content": "Hello"}], "fast", 10,
+                                       None, True, None, cancel)
+        self.assertFalse(result["success"])
+        self.assertIn(config.ERROR_MESSAGES["request_cancelled"], result["error"])
+        self.assertEqual(self.server.requests, [])
+
+    def test_compare_collects_every_reply(self):
+        result = self.claude_cli.compare("Hello", ["slow", "fast"])
+        self.assertTrue(result["success"])
+        self.assertEqual([r["model"] for r in result["results"]], ["slow", "fast"])
+        self.assertTrue(all(r["success"] for r in result["results"]))
+        self.assertGreaterEqual(result["results"][0]["stats"]["total_ms"], 500)
+        # the first model's reply continues the conversation
+        self.assertEqual(len(self.claude_cli.conversation_history), 2)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_unexpected_error_still_reports(self):
+        """test a worker that raises still queues a failure, so compare and race return"""
+        with patch.object(self.claude_cli, '_send', side_effect=OSError("broken pipe")):
+            result = self.claude_cli.compare("Hello", ["slow", "fast"])
+            self.assertFalse(result["success"])
+            self.assertIn("broken pipe", result["results"][1]["error"])
+            result = self.claude_cli.race("Hello", ["slow", "fast"])
+            self.assertFalse(result["success"])
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+    def test_malformed_stream_is_a_failure(self):
+        with patch.object(self.claude_cli, 'create_message', side_effect=ValueError("bad json")):
+            result = self.claude_cli.send_message("Hello", "fast")
+            self.assertFalse(result["success"])
+            self.assertFalse(self.claude_cli.compare("Hello", ["slow", "fast"])["success"])
+
+    def test_needs_two_models(self):
+        with self.assertRaises(ValueError):
+            cli.distinct_models(["fast", "fast", " "])
+        self.assertEqual(cli.distinct_models("a, b,a".split(",")), ["a", "b"])
+
+class TestInteractive(unittest.TestCase):
+    """test the interactive loop's background turns against a local stub server"""
+
+    def setUp(self):
+        self.server = MockAnthropicServer(reply=" ".join(["word"] * 40), chunk_delay=0.05).start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        self.claude_cli.base_url = self.server.url
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+
+    def interactive(self, lines, **kwargs):
+        """run interactive mode on scripted input, where None is a Ctrl-C once a reply streams"""
+        lines = iter(lines)
+
+        def read(prompt=""):
+            line = next(lines, EOFError)
+            if line is EOFError:
+                raise EOFError
+            if line is None:
+                while not self.server.requests:
+                    time.sleep(0.01)
+                time.sleep(0.1)
+                # later turns answer at once
+                self.server.chunk_delay = 0
+                self.server.latency = 0
+                raise KeyboardInterrupt
+            return line
+
+        with patch('builtins.input', side_effect=read), patch('sys.stdout'):
+            cli.interactive_mode(self.claude_cli, config.DEFAULT_MODEL, 100, **kwargs)
+
+    def test_ctrl_c_cancels_only_the_reply(self):
+        start = time.perf_counter()
+        self.interactive(["slow question", None, "second", "quit"])
+        # the 2s stream was dropped and the session went on
+        self.assertLess(time.perf_counter() - start, 1.5)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual([m["content"] for m in self.claude_cli.conversation_history],
+                         ["second", " ".join(["word"] * 40)])
+
+    def test_ctrl_c_cancels_a_reply_not_streamed(self):
+        """test the turn is dropped while the server has yet to answer at all"""
+        self.server.latency = 2
+        start = time.perf_counter()
+        self.interactive(["slow question", None, "second", "quit"], stream=False)
+        self.assertLess(time.perf_counter() - start, 1.5)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual([m["content"] for m in self.claude_cli.conversation_history],
+                         ["second", " ".join(["word"] * 40)])
+
+    def test_type_ahead(self):
+        self.server.chunk_delay = 0
+        # every line is read before the first reply arrives, and answered in order
+        self.interactive(["one", "two", "/context", "three"])
+        self.assertEqual([r["messages"][-1]["content"] for r in self.server.requests],
+                         ["one", "two", "three"])
+        self.assertEqual(len(self.claude_cli.conversation_history), 6)
+
+    def test_ctrl_c_when_idle_exits(self):
+        lines = iter(["hello"])
+
+        def read(prompt=""):
+            try:
+                return next(lines)
+            except StopIteration:
+                raise KeyboardInterrupt
+
+        with patch('builtins.input', side_effect=read), patch('sys.stdout'):
+            cli.interactive_mode(self.claude_cli, config.DEFAULT_MODEL, 100)
+        # the reply may still be in flight when the session ends
+        self.assertLessEqual(len(self.server.requests), 1)
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+class TestCacheWarmer(unittest.TestCase):
+    """test prompt cache warming against a local stub server"""
+
+    # long enough to be cached
+    SYSTEM = "Follow the house rules. " * 200
+
+    def setUp(self):
+        self.server = MockAnthropicServer(reply="ok").start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        self.claude_cli.base_url = self.server.url
+        self.warmers = []
+
+    def tearDown(self):
+        for warmer in self.warmers:
+            warmer.close()
+        self.claude_cli.close()
+        self.server.stop()
+
+    def warmer(self, **kwargs):
+        warmer = CacheWarmer(self.claude_cli, config.DEFAULT_MODEL, self.SYSTEM, **kwargs)
+        self.warmers.append(warmer)
+        return warmer
+
+    def wait_for(self, count, timeout=2):
+        deadline = time.monotonic() + timeout
+        while len(self.server.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_warm_request_caches_the_next_prefix(self):
+        self.claude_cli.send_message("hello", system_prompt=self.SYSTEM)
+        warmer = self.warmer()
+        self.assertTrue(warmer.warm())
+
+        sent = self.server.requests[-1]
+        self.assertEqual(sent["max_tokens"], config.WARM_MAX_TOKENS)
+        self.assertEqual(sent["system"][0]["cache_control"], {"type": "ephemeral"})
+        # the breakpoint is where the next turn puts it: on the last reply
+        self.assertEqual(sent["messages"][1]["content"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(sent["messages"][-1]["content"], config.WARM_MESSAGE)
+        # warming is not a turn
+        self.assertEqual(len(self.claude_cli.conversation_history), 2)
+        self.assertEqual(self.claude_cli.stats.counts["requests"], 1)
+        self.assertGreater(warmer.spent, 0)
+
+    def test_pause_reports_warm_prefix(self):
+        warmer = self.warmer()
+        self.assertTrue(warmer.warm())
+        self.assertTrue(warmer.pause())
+        # a turn in flight writes the cache itself
+        self.assertFalse(warmer.warm())
+        self.claude_cli.send_message("hello", system_prompt=self.SYSTEM)
+        # the conversation grew since
+        self.assertFalse(warmer.pause())
+        self.claude_cli.clear_conversation()
+        self.assertFalse(warmer.pause())
+
+    def test_short_prefix_not_warmed(self):
+        warmer = CacheWarmer(self.claude_cli, config.DEFAULT_MODEL, "Be brief")
+        self.warmers.append(warmer)
+        self.assertFalse(warmer.warm())
+        self.assertFalse(warmer.pause())
+        self.assertEqual(self.server.requests, [])
+
+    def test_budget_stops_warming(self):
+        warmer = self.warmer(budget=config.PROMPT_CACHE_MIN_TOKENS)
+        self.assertFalse(warmer.warm())
+        self.assertTrue(warmer.exhausted)
+        self.assertEqual(self.server.requests, [])
+        self.assertIn("budget reached", warmer.format())
+
+    def test_refreshes_until_idle(self):
+        warmer = self.warmer(interval=0.05, idle_limit=0.3)
+        warmer.schedule()
+        self.wait_for(3)
+        self.assertGreaterEqual(len(self.server.requests), 3)
+        time.sleep(0.4)
+        count = len(self.server.requests)
+        time.sleep(0.2)
+        # idle past the limit: no more refreshes until the user is back
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_pause_cancels_refresh(self):
+        warmer = self.warmer(interval=0.05)
+        warmer.schedule()
+        self.wait_for(1)
+        warmer.pause()
+        time.sleep(0.1)
+        count = len(self.server.requests)
+        time.sleep(0.2)
+        self.assertEqual(len(self.server.requests), count)
+
+    def test_report_compares_warmed_and_cold_turns(self):
+        warmer = self.warmer()
+        warmer.record({"success": True, "stats": {"ttft_ms": 900.0}}, False)
+        warmer.record({"success": True, "stats": {"ttft_ms": 300.0}}, True)
+        # cached replies and failures say nothing about prefill
+        warmer.record({"success": True, "cached": True, "stats": {"ttft_ms": 1.0}}, True)
+        warmer.record({"success": False, "stats": {}}, False)
+        summary = warmer.summary()
+        self.assertEqual((summary["warmed_turns"], summary["cold_turns"]), (1, 1))
+        self.assertEqual(summary["saved_ms"], 600.0)
+        self.assertIn("saved", warmer.format())
+
+    def test_interactive_warms_between_turns(self):
+        warmer = self.warmer()
+        lines = iter(["hello", "/stats"])
+
+        def read(prompt=""):
+            # the first warm is sent while the user types
+            self.wait_for(1)
+            line = next(lines, None)
+            if line is None:
+                # and the next after the reply
+                self.wait_for(3)
+                raise EOFError
+            return line
+
+        with patch('builtins.input', side_effect=read), patch('sys.stdout'):
+            cli.interactive_mode(self.claude_cli, config.DEFAULT_MODEL, 100, self.SYSTEM,
+                                 warmer=warmer)
+        self.assertEqual([r["max_tokens"] for r in self.server.requests],
+                         [config.WARM_MAX_TOKENS, 100, config.WARM_MAX_TOKENS])
+        self.assertEqual(warmer.summary()["warmed_turns"], 1)
+
+class TestStructuredOutput(unittest.TestCase):
+    """test --output json/jsonl against a local stub server"""
+
+    def setUp(self):
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        self.claude_cli.base_url = self.server.url
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+
+    def run_mode(self, output, stream=False, **kwargs):
+        """single message mode's stdout, and its exit code"""
+        import io
+        code = 0
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            try:
+                cli.single_message_mode(self.claude_cli, "Hello", config.DEFAULT_MODEL, 100,
+                                        stream=stream, output=output, **kwargs)
+            except SystemExit as e:
+                code = e.code
+        return stdout.getvalue(), code
+
+    def test_json_record(self):
+        text, code = self.run_mode("json")
+        record = json.loads(text)
+        self.assertEqual(code, 0)
+        self.assertEqual(record["type"], "message")
+        self.assertEqual(record["message"], self.server.reply)
+        self.assertEqual(record["model"], config.DEFAULT_MODEL)
+        self.assertEqual(record["stop_reason"], "end_turn")
+        self.assertIn("input_tokens", record["usage"])
+        self.assertGreater(record["latency_ms"], 0)
+        self.assertNotIn("\x1b", text)
+
+    def test_jsonl_streams_deltas(self):
+        text, _ = self.run_mode("jsonl", stream=True)
+        records = [json.loads(line) for line in text.splitlines()]
+        deltas = [r for r in records if r["type"] == "delta"]
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(r["text"] for r in deltas), self.server.reply)
+        # the stop reason arrives in the message_delta event
+        self.assertEqual(records[-1]["type"], "message")
+        self.assertEqual(records[-1]["stop_reason"], "end_turn")
+        self.assertIsNotNone(records[-1]["ttft_ms"])
+
+    def test_json_waits_for_the_reply(self):
+        text, _ = self.run_mode("json", stream=True)
+        self.assertEqual(json.loads(text)["message"], self.server.reply)
+
+    def test_error_record(self):
+        self.server.enqueue(400)
+        text, code = self.run_mode("jsonl")
+        record = json.loads(text)
+        self.assertEqual(code, 1)
+        self.assertEqual(record["type"], "error")
+        self.assertIn("400", record["error"])
+
+    def test_compare_records(self):
+        models = [config.DEFAULT_MODEL, "claude-other"]
+        text, _ = self.run_mode("json", compare=models)
+        self.assertEqual(json.loads(text)["type"], "comparison")
+        self.assertEqual([r["model"] for r in json.loads(text)["results"]], models)
+        text, _ = self.run_mode("jsonl", compare=models)
+        self.assertEqual(len(text.splitlines()), 2)
+
+    def test_main_keeps_stdout_for_records(self):
+        import io
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                patch.object(config, 'API_BASE_URL', self.server.url), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                patch('sys.stderr', new_callable=io.StringIO), \
+                patch('sys.argv', ["cli.py", "-m", "Hello", "--api-key", "k", "--no-daemon",
+                                   "--output", "jsonl", "--stream",
+                                   "--save", os.path.join(tmpdir, "chat.json")]):
+            cli.main()
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(records[-1]["message"], self.server.reply)
+
+class TestRetryAndRateLimit(unittest.TestCase):
+    """test retries and rate limiting against a local stub server"""
+
+    def setUp(self):
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=2)
+        self.claude_cli.base_url = self.server.url
+        self.claude_cli.retry_policy.base_delay = 0.01
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+
+    def test_retries_scripted_429s(self):
+        """test 429 and 529 replies are retried until the request succeeds"""
+        self.server.enqueue(429, headers={"retry-after": "0"})
+        self.server.enqueue(529)
+        result = self.claude_cli.send_message("Hello")
+        self.assertTrue(result["success"])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_exhausted(self):
+        """test the failure is reported once max_retries is used up"""
+        for _ in range(3):
+            self.server.enqueue(429, headers={"retry-after": "0"})
+        result = self.claude_cli.send_message("Hello")
+        self.assertFalse(result["success"])
+        self.assertIn("429", result["error"])
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+    def test_client_errors_not_retried(self):
+        """test a 400 fails straight away"""
+        self.server.enqueue(400)
+        result = self.claude_cli.send_message("Hello")
+        self.assertFalse(result["success"])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_should_retry_header_veto(self):
+        """test x-should-retry: false stops retries of a retryable status"""
+        self.server.enqueue(529, headers={"x-should-retry": "false"})
+        result = self.claude_cli.send_message("Hello")
+        self.assertFalse(result["success"])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stream_through_server(self):
+        """test streaming over a real chunked http response"""
+        deltas = []
+        result = self.claude_cli.send_message("Hello", stream=True, on_text=deltas.append)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["message"], self.server.reply)
+        self.assertGreater(len(deltas), 1)
+
+    def test_parse_retry_after(self):
+        """test seconds and http-date retry-after values"""
+        self.assertEqual(ratelimit.parse_retry_after({"retry-after": "2.5"}), 2.5)
+        self.assertEqual(ratelimit.parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}), 0.0)
+        self.assertIsNone(ratelimit.parse_retry_after({}))
+
+    def test_backoff_is_bounded(self):
+        """test jittered backoff grows with the attempt but never passes max_delay"""
+        policy = ratelimit.RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for attempt in range(10):
+            self.assertLessEqual(policy.delay(attempt), min(5.0, 2 ** attempt))
+        self.assertEqual(policy.delay(0, retry_after=30), 5.0)
+
+    def test_token_bucket_limits_requests(self):
+        """test the limiter spaces requests out once the bucket is empty"""
+        now = [0.0]
+        waits = []
+        limiter = ratelimit.RateLimiter(requests_per_minute=60, clock=lambda: now[0],
+                                        sleep=waits.append)
+        for _ in range(60):
+            limiter.acquire()
+        self.assertEqual(waits, [])
+        limiter.acquire()
+        self.assertAlmostEqual(waits[-1], 1.0)
+
+    def test_limiter_syncs_with_headers(self):
+        """test an exhausted server quota blocks until its reset time"""
+        now = [0.0]
+        waits = []
+        limiter = ratelimit.RateLimiter(requests_per_minute=60, clock=lambda: now[0],
+                                        sleep=waits.append)
+        limiter.update_from_headers({"anthropic-ratelimit-requests-remaining": "0"})
+        limiter.acquire()
+        self.assertAlmostEqual(waits[-1], 1.0)
+
+class TestResponseCache(unittest.TestCase):
+    """test cases for the on-disk response cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.tmpdir.name)
+        self.payload = {"model": "m", "max_tokens": 10,
+                        "messages": [{"role": "user", "content": "Hello"}]}
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_key_is_canonical(self):
+        """test key ignores dict order and the stream flag but not the prompt"""
+        reordered = {"messages": self.payload["messages"], "max_tokens": 10, "model": "m",
+                     "stream": True}
+        self.assertEqual(cache_key(self.payload), cache_key(reordered))
+        self.assertNotEqual(cache_key(self.payload), cache_key(dict(self.payload, system="s")))
+
+    def test_hit_and_miss_counters(self):
+        key = cache_key(self.payload)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, {"content": [{"text": "Hi"}]})
+        self.assertEqual(self.cache.get(key), {"content": [{"text": "Hi"}]})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl_expiry(self):
+        self.cache.ttl = -1
+        key = cache_key(self.payload)
+        self.cache.put(key, {"content": []})
+        self.assertIsNone(self.cache.get(key))
+
+    def test_lru_eviction(self):
+        """test the least recently used entry goes first once max_bytes is passed"""
+        self.cache.max_bytes = 100
+        for key in ("a", "b"):
+            self.cache.put(key, {"text": "x" * 30})
+            time.sleep(0.01)
+        self.cache.get("a")
+        self.cache.put("c", {"text": "x" * 30})
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("c"))
+
+    def test_refresh_skips_lookup(self):
+        self.cache.put("a", {"text": "old"})
+        self.cache.refresh = True
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_send_message_uses_cache(self):
+        """test a repeated request is answered from the cache without calling the API"""
+        with MockAnthropicServer() as server:
+            claude_cli = cli.ClaudeCLI("test_api_key", cache=self.cache)
+            claude_cli.base_url = server.url
+            first = claude_cli.complete("Hello")
+            deltas = []
+            second = claude_cli.complete("Hello", stream=True, on_text=deltas.append)
+            claude_cli.close()
+
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["message"], first["message"])
+        self.assertEqual(deltas, [first["message"]])
+        self.assertEqual(len(server.requests), 1)
+        self.assertIn("Cache: 1 hits, 1 misses", cli.format_usage(second, self.cache))
+
+class TestAsyncClaudeCLI(unittest.IsolatedAsyncioTestCase):
+    """test cases for the asyncio client against a local stub server"""
+
+    async def asyncSetUp(self):
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = AsyncClaudeCLI("test_api_key", max_retries=2)
+        self.claude_cli.base_url = self.server.url
+        self.claude_cli.retry_policy.base_delay = 0.01
+
+    async def asyncTearDown(self):
+        await self.claude_cli.close()
+        self.server.stop()
+
+    async def test_send_message_updates_history(self):
+        result = await self.claude_cli.send_message("Hello")
+        self.assertTrue(result["success"])
+        self.assertEqual(result["message"], self.server.reply)
+        self.assertEqual(self.claude_cli.conversation_history[-1],
+                         {"role": "assistant", "content": self.server.reply})
+
+    async def test_stream(self):
+        deltas = []
+        result = await self.claude_cli.send_message("Hello", stream=True, on_text=deltas.append)
+        self.assertTrue(result["success"])
+        self.assertEqual("".join(deltas), self.server.reply)
+
+    async def test_retries_429(self):
+        self.server.enqueue(429, headers={"retry-after": "0"})
+        result = await self.claude_cli.complete("Hello")
+        self.assertTrue(result["success"])
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_error_reported(self):
+        self.server.enqueue(400)
+        result = await self.claude_cli.send_message("Hello")
+        self.assertFalse(result["success"])
+        self.assertIn("400", result["error"])
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+    async def test_concurrent_requests_share_one_loop(self):
+        results = await asyncio.gather(*(self.claude_cli.complete(f"prompt {i}")
+                                         for i in range(50)))
+        self.assertTrue(all(r["success"] for r in results))
+        self.assertEqual(len(self.server.requests), 50)
+
+    def test_sync_only_methods_absent(self):
+        """test the threaded ClaudeCLI methods are not inherited"""
+        self.assertNotIsInstance(self.claude_cli, cli.ClaudeCLI)
+        for name in ("race", "compare", "request", "session"):
+            self.assertFalse(hasattr(self.claude_cli, name), name)
+
+    async def test_summarize_off_the_loop(self):
+        import threading
+
+        claude_cli = AsyncClaudeCLI("test_api_key", max_retries=0, context_budget=250,
+                                    context_strategy="summarize")
+        claude_cli.base_url = self.server.url
+        summarize = claude_cli.context.summarizer
+        threads = []
+
+        def summarizer(text):
+            threads.append(threading.current_thread())
+            return summarize(text)
+
+        claude_cli.context.summarizer = summarizer
+        try:
+            with patch.object(config, 'SUMMARY_MAX_TOKENS', 20):
+                for word in ["one", "two", "three", "four"]:
+                    self.assertTrue((await claude_cli.send_message(f"{word} " * 100))["success"])
+        finally:
+            await claude_cli.close()
+        # the summary was requested while the loop went on
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertIn(cli.with_cache_control(config.SUMMARY_SYSTEM),
+                      [r.get("system") for r in self.server.requests])
+        self.assertTrue(self.server.requests[-1]["messages"][0]["content"].startswith(
+            config.SUMMARY_PREFIX))
+
+    async def test_save_and_load(self):
+        await self.claude_cli.send_message("Hello")
+        fork = self.claude_cli.fork()
+        self.assertIsInstance(fork, AsyncClaudeCLI)
+        self.assertEqual(fork.conversation_history, [])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ("saved.json", "saved.jsonl"):
+                path = os.path.join(tmpdir, name)
+                self.assertTrue(await self.claude_cli.save_conversation(path))
+                self.assertTrue(await fork.load_conversation(path))
+                self.assertEqual(fork.conversation_history, self.claude_cli.conversation_history)
+
+    def test_message_batches_raises(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(TypeError):
+                message_batches.MessageBatches(self.claude_cli, os.path.join(tmpdir, "out.jsonl"))
+
+    def test_batch_raises(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(TypeError):
+                batch.run_batch(self.claude_cli, [{"id": "1", "message": "Hello"}],
+                                os.path.join(tmpdir, "out.jsonl"))
+        self.assertEqual(self.server.requests, [])
+
+    def test_map_reduce_raises(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "big.txt")
+            with open(path, "w") as f:
+                f.write("line\n" * 10)
+            with self.assertRaises(TypeError):
+                chunker.map_reduce(self.claude_cli, path, "Summarize", work_dir=tmpdir)
+        self.assertEqual(self.server.requests, [])
+
+class TestStats(unittest.TestCase):
+    """test cases for request instrumentation"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key", max_retries=2)
+        self.claude_cli.base_url = self.server.url
+        self.claude_cli.retry_policy.base_delay = 0.01
+
+    def tearDown(self):
+        self.claude_cli.close()
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(stats.percentile(values, 0.5), 50)
+        self.assertEqual(stats.percentile(values, 0.95), 95)
+        self.assertEqual(stats.percentile(values, 0.99), 99)
+        self.assertEqual(stats.percentile([7], 0.99), 7)
+
+    def test_connection_phases_only_for_new_connections(self):
+        first = self.claude_cli.send_message("Hello")["stats"]
+        second = self.claude_cli.send_message("Again")["stats"]
+        self.assertIn("dns_ms", first)
+        self.assertIn("connect_ms", first)
+        self.assertNotIn("tls_ms", first)
+        self.assertNotIn("connect_ms", second)
+        for sample in (first, second):
+            self.assertLessEqual(sample["ttfb_ms"], sample["total_ms"])
+            self.assertGreater(sample["request_bytes"], 0)
+            self.assertGreater(sample["response_bytes"], 0)
+            self.assertEqual(sample["output_tokens"], 5)
+
+    def test_stream_time_to_first_token(self):
+        sample = self.claude_cli.send_message("Hello", stream=True)["stats"]
+        self.assertLessEqual(sample["ttfb_ms"], sample["ttft_ms"])
+        self.assertLessEqual(sample["ttft_ms"], sample["total_ms"])
+        self.assertTrue(sample["stream"])
+
+    def test_retries_and_failures_counted(self):
+        self.server.enqueue(429)
+        self.assertEqual(self.claude_cli.send_message("Hello")["stats"]["retries"], 1)
+        self.server.enqueue(400)
+        self.assertFalse(self.claude_cli.send_message("Hello")["stats"]["success"])
+        summary = self.claude_cli.stats.summary()
+        self.assertEqual(summary["requests"], 2)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["retries"], 1)
+        self.assertEqual(summary["total"]["count"], 2)
+        self.assertIn("p99", summary["total"])
+
+    def test_jsonl_export(self):
+        path = os.path.join(self.tmpdir.name, "stats.jsonl")
+        self.claude_cli.stats = stats.Stats(path)
+        self.claude_cli.complete("Hello")
+        self.claude_cli.complete("Hello")
+        self.claude_cli.stats.close()
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 2)
+        self.assertIn("total_ms", records[0])
+
+    def test_prometheus_export(self):
+        path = os.path.join(self.tmpdir.name, "stats.prom")
+        self.claude_cli.stats = stats.Stats(path)
+        self.claude_cli.complete("Hello")
+        self.claude_cli.stats.close()
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        self.assertIn('claude_cli_request_duration_seconds{phase="total",quantile="0.99"}', text)
+        self.assertIn('claude_cli_requests_total{outcome="success"} 1', text)
+        self.assertIn('claude_cli_tokens_total{type="output"} 5', text)
+
+    def test_cached_replies_cost_no_tokens(self):
+        self.claude_cli.cache = ResponseCache(self.tmpdir.name)
+        self.claude_cli.complete("Hello")
+        self.assertTrue(self.claude_cli.complete("Hello")["cached"])
+        summary = self.claude_cli.stats.summary()
+        self.assertEqual(summary["cached"], 1)
+        self.assertEqual(summary["tokens"]["output"], 5)
+        self.claude_cli.cache.close()
+
+class TestDaemon(unittest.TestCase):
+    """test cases for the resident daemon and the client that forwards to it"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmpdir.name, "daemon.sock")
+        patcher = patch.object(config, "CONVERSATIONS_DIR", os.path.join(self.tmpdir.name, "conversations"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = MockAnthropicServer().start()
+        self.claude_cli = cli.ClaudeCLI("test_api_key")
+        self.claude_cli.base_url = self.server.url
+        self.daemon = daemon.Daemon(self.claude_cli, self.socket_path).start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.claude_cli.close()
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def send(self, message, conversation=None, **kwargs):
+        client = daemon.DaemonClient.connect(self.socket_path, conversation)
+        self.assertIsNotNone(client)
+        return client.send_message(message, **kwargs)
+
+    def test_one_off_message(self):
+        result = self.send("Hello")
+        self.assertTrue(result["success"])
+        self.assertEqual(result["message"], self.server.reply)
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+    def test_client_collects_daemon_stats(self):
+        client = daemon.DaemonClient.connect(self.socket_path)
+        client.send_message("Hello")
+        self.assertEqual(client.stats.summary()["requests"], 1)
+        self.assertEqual(self.claude_cli.stats.summary()["requests"], 1)
+
+    def test_stream_forwards_text(self):
+        chunks = []
+        result = self.send("Hello", stream=True, on_text=chunks.append)
+        self.assertTrue(result["success"])
+        self.assertEqual("".join(chunks), self.server.reply)
+
+    def test_cancel_closes_the_connection(self):
+        import threading
+        cancel = threading.Event()
+        self.server.chunk_delay = 0.05
+        result = self.send("Hello", stream=True, on_text=lambda text: cancel.set(), cancel=cancel)
+        self.assertFalse(result["success"])
+        self.assertIn(config.ERROR_MESSAGES["request_cancelled"], result["error"])
+
+    def test_send_turn_through_daemon(self):
+        client = daemon.DaemonClient.connect(self.socket_path)
+        with patch('sys.stdout'):
+            result = cli.send_turn(client, "Hello", config.DEFAULT_MODEL, 100, None, False)
+        self.assertEqual(result["message"], self.server.reply)
+
+    def run_main(self, *argv):
+        """cli.main's --output json record for -m Hello"""
+        import io
+        with patch.object(config, 'API_BASE_URL', self.server.url), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                patch('sys.argv', ["cli.py", "-m", "Hello", "--api-key", "", "--socket",
+                                   self.socket_path, "--output", "json", *argv]):
+            cli.main()
+        return json.loads(stdout.getvalue())
+
+    def test_client_options_run_in_process(self):
+        self.claude_cli.cache = ResponseCache(os.path.join(self.tmpdir.name, "cache"), 3600)
+        self.send("Hello")
+        self.assertTrue(self.run_main()["cached"])
+        # the daemon would answer from its cache; --refresh asks for a fresh reply
+        record = self.run_main("--refresh")
+        self.assertNotIn("cached", record)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_named_conversation(self):
+        self.send("first", "notes")
+        self.send("second", "notes")
+        contents = [m["content"] for m in self.server.requests[-1]["messages"]]
+        self.assertEqual(contents[0], "first")
+        self.assertEqual(len(ConversationStore(conversation_path("notes"))), 4)
+
+    def test_named_conversation_reloaded_after_outside_write(self):
+        self.send("first", "notes")
+        ConversationStore(conversation_path("notes")).append(
+            [{"role": "user", "content": "elsewhere"}, {"role": "assistant", "content": "ok"}])
+        self.send("third", "notes")
+        contents = [m["content"] for m in self.server.requests[-1]["messages"]]
+        self.assertEqual(contents[2], "elsewhere")
+
+    def test_invalid_conversation_name(self):
+        result = self.send("Hello", "../escape")
+        self.assertFalse(result["success"])
+        with self.assertRaises(ValueError):
+            conversation_path(".hidden")
+
+    def test_stop_and_stale_socket(self):
+        self.assertTrue(daemon.is_running(self.socket_path))
+        self.assertTrue(daemon.stop(self.socket_path))
+        self.daemon.thread.join(5)
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertIsNone(daemon.DaemonClient.connect(self.socket_path))
+
+        # a socket file left by a killed daemon is taken over
+        open(self.socket_path, "w").close()
+        self.assertFalse(daemon.is_running(self.socket_path))
+        self.daemon = daemon.Daemon(self.claude_cli, self.socket_path).start()
+        self.assertTrue(self.send("Hello")["success"])
+
+    def test_second_daemon_refused(self):
+        with self.assertRaises(ValueError):
+            daemon.Daemon(self.claude_cli, self.socket_path).start()
+
+    def test_fork_shares_pool(self):
+        fork = self.claude_cli.fork()
+        self.assertIs(fork.session, self.claude_cli.session)
+        fork.send_message("Hello")
+        self.assertEqual(len(fork.conversation_history), 2)
+        self.assertEqual(self.claude_cli.conversation_history, [])
+
+class TestBench(unittest.TestCase):
+    """test the benchmark harness and the mock server's load shaping"""
+
+    def send(self, server, message="Hello"):
+        claude_cli = cli.ClaudeCLI("test_api_key", max_retries=0)
+        claude_cli.base_url = server.url
+        try:
+            return claude_cli.complete(message)
+        finally:
+            claude_cli.close()
+
+    def test_mock_error_injection(self):
+        with MockAnthropicServer(error_rate=1.0, seed=0) as server:
+            result = self.send(server)
+        self.assertFalse(result["success"])
+        self.assertTrue("500" in result["error"] or "529" in result["error"], result["error"])
+
+    def test_mock_rate_limit(self):
+        with MockAnthropicServer(requests_per_second=1) as server:
+            self.assertTrue(self.send(server)["success"])
+            result = self.send(server)
+        self.assertFalse(result["success"])
+        self.assertIn("429", result["error"])
+
+    def test_mock_chunk_delay(self):
+        with MockAnthropicServer(reply="one two three", chunk_delay=0.05) as server:
+            claude_cli = cli.ClaudeCLI("test_api_key")
+            claude_cli.base_url = server.url
+            start = time.perf_counter()
+            result = claude_cli.complete("Hello", stream=True)
+            claude_cli.close()
+        self.assertEqual(result["message"], "one two three")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+
+    def test_measure(self):
+        result = bench.measure(lambda: None, rounds=10)
+        self.assertEqual(result["rounds"], 10)
+        self.assertLessEqual(result["min_ms"], result["median_ms"])
+        self.assertLessEqual(result["median_ms"], result["p95_ms"])
+        self.assertLessEqual(result["p95_ms"], result["max_ms"])
+
+    def test_compare(self):
+        baseline = {"results": {"single": {"median_ms": 10.0}, "batch.c8": {"requests_per_second": 100.0},
+                                "startup": {"milliseconds": 10.0}}}
+        report = {"results": {"single": {"median_ms": 11.0}, "batch.c8": {"requests_per_second": 50.0},
+                              "startup": {"milliseconds": 20.0}, "new": {"median_ms": 1.0}}}
+        regressions = bench.compare(baseline, report, threshold=0.2)
+        self.assertEqual(sorted(r["name"] for r in regressions), ["batch.c8", "startup"])
+        self.assertEqual(bench.compare(report, report), [])
+
+    def test_bench_history(self):
+        results = bench.bench_history([10, 40], rounds=2)
+        self.assertEqual(sorted(results), ["history.reencode.n10", "history.reencode.n40",
+                                           "history.turn.n10", "history.turn.n40",
+                                           "history.whole.n10", "history.whole.n40"])
+        self.assertEqual(results["history.turn.n40"]["messages"], 40)
+
+    def test_run(self):
+        report = bench.run(["single", "multi_turn", "batch", "store"], rounds=4, requests=8,
+                           concurrency=[2], messages=40)
+        results = report["results"]
+        self.assertEqual(sorted(results), ["batch.c2", "multi_turn", "single.blocking",
+                                           "single.streaming", "store.append_turn",
+                                           "store.load_json", "store.load_jsonl",
+                                           "store.save_json", "store.save_jsonl"])
+        self.assertEqual(results["batch.c2"]["failed"], 0)
+        self.assertEqual(results["multi_turn"]["rounds"], 4)
+
+class TestStartup(unittest.TestCase):
+    """importing cli must stay cheap, since scripts run -m thousands of times"""
+
+    def test_import_time_budget(self):
+        report = bench.import_time("cli")
+        self.assertLess(report["milliseconds"], config.STARTUP_BUDGET_MS, report)
+
+    def test_heavy_modules_not_imported(self):
+        heavy = ["requests", "colorama", "argparse"]
+        process = subprocess.run(
+            [sys.executable, "-c", f"import sys, cli; print([m for m in {heavy!r} if m in sys.modules])"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual(process.stdout.strip(), "[]")
+
+    def test_colors_off_by_default(self):
+        self.assertEqual(f"{cli.Fore.RED}{cli.Style.BRIGHT}", "")
+
 class TestConfig(unittest.TestCase):
     """Test cases for the config module"""
 
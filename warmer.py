@@ -0,0 +1,192 @@
+"""
+Prompt cache warming for claude cli
+
+in interactive mode the system prompt and the history are prefilled when the
+next message is sent, on the critical path. CacheWarmer sends a one-token
+request for the conversation so far as soon as it changes (at the start and
+after each reply), so the prompt cache already holds it when the user sends
+their next message, and refreshes it before it expires while the user is idle.
+Warming stops at a spend cap, and the time to first token of warmed and cold
+turns is compared to report what it saved.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+from stats import percentile
+
+
+class CacheWarmer:
+    def __init__(self, claude_cli: Any, model: str = config.DEFAULT_MODEL,
+                 system_prompt: Optional[str] = None,
+                 budget: float = config.WARM_BUDGET_TOKENS,
+                 interval: float = config.WARM_REFRESH_INTERVAL,
+                 idle_limit: float = config.WARM_IDLE_LIMIT) -> None:
+        """
+        args:
+            claude_cli: client whose conversation is warmed; its prompt caching must be on
+            budget: spend cap in input-token equivalents, see config.WARM_TOKEN_WEIGHTS
+            interval: seconds between refreshes while the user is idle
+            idle_limit: stop refreshing once the user has been idle this long
+        """
+        self.claude_cli = claude_cli
+        self.model = model
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.interval = interval
+        self.idle_limit = idle_limit
+        self.condition = threading.Condition()
+        # monotonic time the next warm is due, None when none is
+        self.due: Optional[float] = None
+        # last reply or change to the conversation
+        self.active = time.monotonic()
+        # a turn is in flight; warming waits for its reply
+        self.paused = False
+        self.closed = False
+        # (history, its length, time) of the last successful warm
+        self.warmed: Optional[Tuple[Any, int, float]] = None
+        self.spent = 0.0
+        self.exhausted = False
+        self.failed = 0
+        # latency of each warm request, and time to first token of turns, in ms
+        self.latencies: List[float] = []
+        self.turns: Dict[str, List[float]] = {"warmed": [], "cold": []}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self) -> None:
+        """warm the conversation as it is now, and keep it warm while the user is idle"""
+        with self.condition:
+            self.active = time.monotonic()
+            self.due = self.active
+            self.paused = False
+            self.condition.notify()
+
+    def pause(self) -> bool:
+        """
+        stop warming while a turn is sent
+        returns:
+            bool: whether the turn's prefix is in the prompt cache
+        """
+        with self.condition:
+            self.due = None
+            self.paused = True
+            return self._is_warm()
+
+    def _is_warm(self) -> bool:
+        if self.warmed is None:
+            return False
+        history, length, warmed_at = self.warmed
+        return (history is self.claude_cli.conversation_history
+                and length == len(history)
+                and time.monotonic() - warmed_at < config.PROMPT_CACHE_TTL)
+
+    def record(self, response: Dict[str, Any], warmed: bool) -> None:
+        """count a turn's time to first token as warmed or cold"""
+        ttft = (response.get("stats") or {}).get("ttft_ms")
+        if response.get("success") and not response.get("cached") and ttft is not None:
+            with self.condition:
+                self.turns["warmed" if warmed else "cold"].append(ttft)
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.closed and (self.due is None or self.due > time.monotonic()):
+                    self.condition.wait(None if self.due is None else self.due - time.monotonic())
+                if self.closed:
+                    return
+                self.due = None
+            self.warm()
+            with self.condition:
+                if (self.due is None and not self.paused and not self.exhausted
+                        and time.monotonic() - self.active < self.idle_limit):
+                    self.due = time.monotonic() + self.interval
+
+    def warm(self) -> bool:
+        """
+        send one warm request for the conversation as it is now
+        returns:
+            bool: whether the prefix is now cached; False when it was too short
+                  to cache, over the budget or the request failed
+        """
+        import requests
+        from cli import StreamError
+
+        claude_cli = self.claude_cli
+        history = claude_cli.conversation_history
+        length = len(history)
+        window = claude_cli.context.peek(history + [{"role": "user", "content": config.WARM_MESSAGE}],
+                                         self.system_prompt)
+        if window is None:
+            # the next turn starts with a new summary, so its prefix is not known yet
+            return False
+        tokens = claude_cli.context.total(window)
+        if self.system_prompt:
+            tokens += claude_cli.context.count(self.system_prompt)
+        if tokens < config.PROMPT_CACHE_MIN_TOKENS:
+            return False
+        # assume the whole prefix is written, the dearest case
+        if self.spent + tokens * config.WARM_TOKEN_WEIGHTS["cache_creation_input_tokens"] > self.budget:
+            self.exhausted = True
+            return False
+
+        with self.condition:
+            if self.paused:
+                # a turn started meanwhile and writes the cache itself
+                return False
+        payload = claude_cli.build_payload(window, self.model, config.WARM_MAX_TOKENS,
+                                           self.system_prompt, splice=True)
+        start = time.perf_counter()
+        try:
+            # not through send_message: no history, response cache or turn stats
+            result = claude_cli.create_message(payload)
+        except (requests.exceptions.RequestException, StreamError, ValueError):
+            with self.condition:
+                self.failed += 1
+            return False
+        usage = result.get("usage") or {}
+        with self.condition:
+            self.latencies.append((time.perf_counter() - start) * 1000)
+            self.spent += sum((usage.get(field) or 0) * weight
+                              for field, weight in config.WARM_TOKEN_WEIGHTS.items())
+            self.warmed = (history, length, time.monotonic())
+        return True
+
+    def summary(self) -> Dict[str, Any]:
+        """warm requests, spend and the median time to first token of warmed and cold turns"""
+        with self.condition:
+            summary: Dict[str, Any] = {"requests": len(self.latencies), "failed": self.failed,
+                                       "spent": round(self.spent), "budget": self.budget,
+                                       "exhausted": self.exhausted}
+            if self.latencies:
+                summary["warm_ms"] = round(percentile(sorted(self.latencies), 0.5), 1)
+            for kind, values in self.turns.items():
+                summary[f"{kind}_turns"] = len(values)
+                if values:
+                    summary[f"{kind}_ttft_ms"] = round(percentile(sorted(values), 0.5), 1)
+        if "warmed_ttft_ms" in summary and "cold_ttft_ms" in summary:
+            summary["saved_ms"] = round(summary["cold_ttft_ms"] - summary["warmed_ttft_ms"], 1)
+        return summary
+
+    def format(self) -> str:
+        """the cache warming part of /stats"""
+        summary = self.summary()
+        lines = [f"[Cache warming - {summary['requests']} requests, {summary['failed']} failed, "
+                 f"~{summary['spent']:,} of {summary['budget']:,} tokens"
+                 f"{' (budget reached)' if summary['exhausted'] else ''}]"]
+        if "warm_ms" in summary:
+            lines.append(f"  warm request       p50 {summary['warm_ms']}ms")
+        for kind in ("warmed", "cold"):
+            if f"{kind}_ttft_ms" in summary:
+                lines.append(f"  {kind + ' turns':<18} ttft p50 {summary[f'{kind}_ttft_ms']}ms  "
+                             f"(n={summary[f'{kind}_turns']})")
+        if "saved_ms" in summary:
+            lines.append(f"  saved              ~{summary['saved_ms']}ms to first token per warmed turn")
+        return "\n".join(lines)